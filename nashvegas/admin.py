@@ -1,12 +1,125 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections, models, DEFAULT_DB_ALIAS
+from django.db.models.query import QuerySet
 
 from nashvegas.models import Migration
+from nashvegas.utils import get_capable_databases, get_estimated_row_count
+
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+DATABASE_VAR = "database"
+
+# Below this many rows an exact count is cheap enough to be worth doing.
+ESTIMATED_COUNT_THRESHOLD = NASHVEGAS.get("admin_estimated_count", 10000)
+
+
+class EstimatedCountQuerySet(QuerySet):
+    """
+    Answers ``count()`` from the database's table statistics rather than
+    scanning the ledger, as long as the query is unfiltered.
+    """
+    
+    def count(self):
+        if not self.query.where and self._result_cache is None:
+            estimate = get_estimated_row_count(
+                self.model._meta.db_table,
+                using=self.db
+            )
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super(EstimatedCountQuerySet, self).count()
+
+
+if hasattr(admin, "SimpleListFilter"):
+    class DatabaseListFilter(admin.SimpleListFilter):
+        title = "database"
+        parameter_name = DATABASE_VAR
+        
+        def lookups(self, request, model_admin):
+            databases = list(get_capable_databases())
+            if len(databases) > 1:
+                return [(db, db) for db in databases]
+        
+        def queryset(self, request, queryset):
+            # MigrationAdmin.queryset has already switched to this database
+            return queryset
+else:
+    # Django 1.3 has no custom list filters; the database is still picked
+    # with the ``database`` parameter
+    DatabaseListFilter = None
+
+
+class MigrationChangeList(ChangeList):
+    
+    def get_query_set(self, *args):
+        # The search box is handled by MigrationAdmin.search so that it never
+        # falls back to scanning the content of every migration. Django 1.4
+        # passes the request, and 1.3 would take the database parameter for
+        # a field lookup.
+        query, self.query = self.query, ""
+        params = self.params
+        if DatabaseListFilter is None:
+            self.params = dict(params)
+            self.params.pop(DATABASE_VAR, None)
+        try:
+            qs = super(MigrationChangeList, self).get_query_set(*args)
+        finally:
+            self.query = query
+            self.params = params
+        if query:
+            qs = self.model_admin.search(qs, query)
+        return qs
+    
+    def url_for_result(self, result):
+        url = super(MigrationChangeList, self).url_for_result(result)
+        if DATABASE_VAR in self.params:
+            url = "%s?%s=%s" % (url, DATABASE_VAR, self.params[DATABASE_VAR])
+        return url
 
 
 class MigrationAdmin(admin.ModelAdmin):
     list_display = ["migration_label", "date_created", "scm_version"]
-    list_filter = ["date_created"]
-    search_fields = ["content", "migration_label"]
+    list_filter = ["date_created"] + filter(None, [DatabaseListFilter])
+    search_fields = ["^migration_label"]
+    
+    def get_database(self, request):
+        database = request.GET.get(DATABASE_VAR, DEFAULT_DB_ALIAS)
+        if database not in connections.databases:
+            return DEFAULT_DB_ALIAS
+        return database
+    
+    def queryset(self, request):
+        qs = super(MigrationAdmin, self).queryset(request)
+        qs = qs._clone(klass=EstimatedCountQuerySet)
+        return qs.using(self.get_database(request)).defer("content")
+    
+    def get_changelist(self, request, **kwargs):
+        return MigrationChangeList
+    
+    def search(self, qs, query):
+        """
+        Matches migrations whose label starts with ``query``, which the
+        label index can answer. With the "admin_fulltext_search" setting
+        the content is searched as well, through the backend's full-text
+        index (see the documentation for the index to create).
+        """
+        label_q = models.Q(migration_label__startswith=query)
+        if not NASHVEGAS.get("admin_fulltext_search"):
+            return qs.filter(label_q)
+        
+        vendor = connections[qs.db].vendor
+        if vendor == "postgresql":
+            where = ("to_tsvector('simple', content) @@ "
+                     "plainto_tsquery('simple', %s)")
+        elif vendor == "mysql":
+            where = "MATCH (content) AGAINST (%s IN BOOLEAN MODE)"
+        else:
+            return qs.filter(label_q)
+        
+        matches = qs.extra(where=[where], params=[query])
+        return qs.filter(label_q | models.Q(pk__in=matches.values("pk")))
 
 
 admin.site.register(Migration, MigrationAdmin)
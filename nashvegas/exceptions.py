@@ -1,2 +1,6 @@
 class MigrationError(Exception):
     pass
+
+
+class LockTimeoutError(MigrationError):
+    pass
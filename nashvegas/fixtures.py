@@ -0,0 +1,250 @@
+import gzip
+import hashlib
+import os
+import zipfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core import serializers
+from django.core.management.color import no_style
+from django.db import connections, router, DEFAULT_DB_ALIAS
+from django.db.models import get_apps
+
+from nashvegas.models import FixtureDigest, now
+
+try:
+    import bz2
+    has_bz2 = True
+except ImportError:
+    has_bz2 = False
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+INITIAL_DATA = "initial_data"
+
+
+class SingleZipReader(zipfile.ZipFile):
+    def read(self):
+        return zipfile.ZipFile.read(self, self.namelist()[0])
+
+
+COMPRESSION_TYPES = {
+    None: open,
+    "gz": gzip.GzipFile,
+    "zip": SingleZipReader,
+}
+if has_bz2:
+    COMPRESSION_TYPES["bz2"] = bz2.BZ2File
+
+
+def get_fixture_dirs():
+    """
+    Returns the directories ``loaddata`` searches for fixtures, in order.
+    """
+    app_module_paths = []
+    for app in get_apps():
+        if hasattr(app, "__path__"):
+            # It's a 'models/' subpackage
+            app_module_paths.extend(app.__path__)
+        else:
+            # It's a models.py module
+            app_module_paths.append(app.__file__)
+
+    app_fixtures = [
+        os.path.join(os.path.dirname(path), "fixtures")
+        for path in app_module_paths
+    ]
+    return app_fixtures + list(settings.FIXTURE_DIRS) + [""]
+
+
+def get_fixture_files(name=INITIAL_DATA, using=DEFAULT_DB_ALIAS):
+    """
+    Returns ``(path, format, compression)`` for every file ``loaddata`` would
+    load for the fixture ``name`` on ``using``.
+    """
+    formats = serializers.get_public_serializer_formats()
+    results = []
+    for fixture_dir in get_fixture_dirs():
+        for database in [using, None]:
+            for format in formats:
+                for compression in COMPRESSION_TYPES:
+                    file_name = ".".join([
+                        p for p in [name, database, format, compression] if p
+                    ])
+                    path = os.path.join(fixture_dir, file_name)
+                    if os.path.isfile(path):
+                        results.append((path, format, compression))
+    return results
+
+
+def get_fixture_digest(files):
+    """
+    Returns a digest of the names and contents of fixture ``files``.
+    """
+    digest = hashlib.md5()
+    for path, format, compression in files:
+        digest.update(os.path.abspath(path))
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), ""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _has_auto_now(model):
+    """
+    Returns whether ``model`` has a field whose ``pre_save`` would replace
+    the fixture's value, which a raw save keeps.
+    """
+    for field in model._meta.local_fields:
+        if getattr(field, "auto_now", False) or \
+           getattr(field, "auto_now_add", False):
+            return True
+    return False
+
+
+def _save_batch(batch, using):
+    """
+    Saves deserialized objects of a single model, inserting those which do
+    not exist yet with one ``bulk_create``.
+    """
+    model = batch[0].object.__class__
+    if not hasattr(model._base_manager, "bulk_create") or \
+       model._meta.parents or _has_auto_now(model):
+        # bulk_create is new in Django 1.4, can't handle multi-table
+        # inheritance and isn't a raw save
+        for obj in batch:
+            obj.save(using=using)
+        return
+
+    pks = [obj.object.pk for obj in batch if obj.object.pk is not None]
+    existing = set()
+    if pks:
+        existing = set(
+            model._base_manager.using(using).filter(
+                pk__in=pks
+            ).values_list("pk", flat=True)
+        )
+
+    new = []
+    for obj in batch:
+        if obj.object.pk in existing or obj.m2m_data:
+            obj.save(using=using)
+        else:
+            new.append(obj.object)
+    if new:
+        model._base_manager.using(using).bulk_create(new)
+
+
+@contextmanager
+def _constraint_checks_disabled(connection):
+    # Django 1.3 can't defer constraint checks
+    if hasattr(connection, "constraint_checks_disabled"):
+        with connection.constraint_checks_disabled():
+            yield
+    else:
+        yield
+
+
+def load_fixture_files(files, using=DEFAULT_DB_ALIAS, batch_size=None):
+    """
+    Loads fixture ``files`` the way ``loaddata`` does, but inserting new
+    objects in batches rather than saving them one at a time. Returns the
+    number of objects loaded.
+
+    Unlike ``loaddata``, objects which are bulk inserted do not send
+    ``pre_save``/``post_save``.
+    """
+    connection = connections[using]
+    batch_size = batch_size or NASHVEGAS.get("initial_data_batch_size", 500)
+    models = set()
+    count = 0
+
+    with _constraint_checks_disabled(connection):
+        for path, format, compression in files:
+            fixture = COMPRESSION_TYPES[compression](path, "r")
+            try:
+                batch = []
+                objects = serializers.deserialize(format, fixture, using=using)
+                for obj in objects:
+                    model = obj.object.__class__
+                    if not router.allow_syncdb(using, model):
+                        continue
+                    if batch and (model is not batch[0].object.__class__ or
+                                  len(batch) >= batch_size):
+                        _save_batch(batch, using)
+                        batch = []
+                    batch.append(obj)
+                    models.add(model)
+                    count += 1
+                if batch:
+                    _save_batch(batch, using)
+            finally:
+                fixture.close()
+
+    if hasattr(connection, "check_constraints"):
+        connection.check_constraints(
+            table_names=[m._meta.db_table for m in models]
+        )
+
+    if count:
+        cursor = connection.cursor()
+        for line in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(line)
+        cursor.close()
+
+    return count
+
+
+def get_fixture_tables(files, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the tables the objects of fixture ``files`` are stored in,
+    including those of their parents and many-to-many relations.
+    """
+    tables = set()
+    for path, format, compression in files:
+        fixture = COMPRESSION_TYPES[compression](path, "r")
+        try:
+            for obj in serializers.deserialize(format, fixture, using=using):
+                model = obj.object.__class__
+                tables.add(model._meta.db_table)
+                tables.update([
+                    parent._meta.db_table
+                    for parent in model._meta.get_parent_list()
+                ])
+                tables.update([
+                    model._meta.get_field(name).m2m_db_table()
+                    for name in obj.m2m_data or {}
+                ])
+        finally:
+            fixture.close()
+    return tables
+
+
+def load_initial_data(using=DEFAULT_DB_ALIAS, force=False, touched=None):
+    """
+    Loads the initial_data fixtures into ``using`` unless they are unchanged
+    since they were last loaded there and none of the ``touched`` tables,
+    which migrations may have emptied or recreated, holds their objects.
+    Returns the number of objects loaded, or ``None`` when loading was
+    skipped.
+    """
+    files = get_fixture_files(INITIAL_DATA, using)
+    digest = get_fixture_digest(files)
+
+    try:
+        recorded = FixtureDigest.objects.using(using).get(name=INITIAL_DATA)
+    except FixtureDigest.DoesNotExist:
+        recorded = FixtureDigest(name=INITIAL_DATA)
+
+    if recorded.digest == digest and not force:
+        touched = set([table.lower() for table in touched or ()])
+        if not touched:
+            return None
+        tables = get_fixture_tables(files, using)
+        if not touched & set([table.lower() for table in tables]):
+            return None
+
+    count = load_fixture_files(files, using)
+    recorded.digest = digest
+    recorded.date_updated = now()
+    recorded.save(using=using)
+    return count
@@ -0,0 +1,200 @@
+import json
+import logging
+import re
+import threading
+import time
+
+from collections import defaultdict
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils.importlib import import_module
+
+from nashvegas.exceptions import MigrationError
+
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+EXPLAINABLE_RE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b",
+                            re.IGNORECASE)
+
+logger = logging.getLogger("nashvegas")
+
+
+class MigrationHook(object):
+    """
+    Receives events as ``upgradedb`` executes migrations. Subclasses
+    override the events they are interested in; durations are in seconds.
+
+    Hooks are listed in the "hooks" key of the ``NASHVEGAS`` setting, either
+    as a dotted path or as a ``(dotted path, keyword arguments)`` pair.
+    """
+
+    def before_migration(self, database, migration):
+        pass
+
+    def after_migration(self, database, migration, duration, success):
+        pass
+
+    def before_statement(self, database, migration, statement):
+        pass
+
+    def after_statement(self, database, migration, statement, duration,
+                        rowcount, success):
+        pass
+
+
+class SlowStatementLogger(MigrationHook):
+    """
+    Logs statements which take longer than ``threshold`` seconds, along with
+    the database's query plan for them where one can be had.
+    """
+
+    def __init__(self, threshold=1.0, explain=True):
+        self.threshold = threshold
+        self.explain = explain
+
+    def get_plan(self, database, statement):
+        connection = connections[database]
+        if not EXPLAINABLE_RE.match(statement):
+            return None
+        if connection.vendor == "sqlite":
+            sql = "EXPLAIN QUERY PLAN %s" % statement
+        elif connection.vendor == "oracle":
+            return None
+        else:
+            sql = "EXPLAIN %s" % statement
+
+        # a failed EXPLAIN must not abort the migration's transaction
+        sid = None
+        if connection.features.uses_savepoints:
+            sid = transaction.savepoint(using=database)
+        cursor = connection.cursor()
+        try:
+            cursor.execute(sql)
+            rows = cursor.fetchall()
+        except Exception:
+            if sid is not None:
+                transaction.savepoint_rollback(sid, using=database)
+            return None
+        finally:
+            cursor.close()
+        if sid is not None:
+            transaction.savepoint_commit(sid, using=database)
+        return "\n".join([
+            " ".join([unicode(column) for column in row]) for row in rows
+        ])
+
+    def after_statement(self, database, migration, statement, duration,
+                        rowcount, success):
+        if not success or duration < self.threshold:
+            return
+
+        plan = None
+        if self.explain:
+            plan = self.get_plan(database, statement)
+        logger.warning(
+            "Slow statement in %s on %s (%.3fs, %s rows):\n%s%s",
+            migration, database, duration, rowcount, statement,
+            plan and "\nPlan:\n%s" % plan or ""
+        )
+
+
+class JSONLinesSink(MigrationHook):
+    """
+    Appends every event as a line of JSON to the file at ``path``, which is
+    opened on the first event and flushed after each one.
+    """
+
+    def __init__(self, path, statements=True):
+        self.path = path
+        self.statements = statements
+        self.lock = threading.Lock()
+        self.fp = None
+
+    def write(self, event, **data):
+        data["event"] = event
+        data["time"] = time.time()
+        line = json.dumps(data) + "\n"
+        with self.lock:
+            if self.fp is None:
+                self.fp = open(self.path, "a")
+            self.fp.write(line)
+            self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
+
+    def before_migration(self, database, migration):
+        self.write("before_migration", database=database, migration=migration)
+
+    def after_migration(self, database, migration, duration, success):
+        self.write("after_migration", database=database, migration=migration,
+                   duration=duration, success=success)
+
+    def before_statement(self, database, migration, statement):
+        if self.statements:
+            self.write("before_statement", database=database,
+                       migration=migration, statement=statement)
+
+    def after_statement(self, database, migration, statement, duration,
+                        rowcount, success):
+        if self.statements:
+            self.write("after_statement", database=database,
+                       migration=migration, statement=statement,
+                       duration=duration, rowcount=rowcount, success=success)
+
+
+class TimingRecorder(MigrationHook):
+    """
+    Keeps how long each migration and each of its statements took, for
+    ``upgradedb --rehearse`` to report.
+    """
+
+    def __init__(self):
+        # (database, migration): (duration, success)
+        self.migrations = {}
+        # (database, migration): [(duration, statement)]
+        self.statements = defaultdict(list)
+
+    def after_migration(self, database, migration, duration, success):
+        # retried migrations add up
+        previous = self.migrations.get((database, migration), (0.0, None))[0]
+        self.migrations[database, migration] = (previous + duration, success)
+
+    def after_statement(self, database, migration, statement, duration,
+                        rowcount, success):
+        self.statements[database, migration].append((duration, statement))
+
+
+def get_hooks():
+    """
+    Returns instances of the hooks configured in the ``NASHVEGAS`` setting.
+    """
+    hooks = []
+    for hook in NASHVEGAS.get("hooks", []):
+        if isinstance(hook, basestring):
+            path, kwargs = hook, {}
+        else:
+            path, kwargs = hook
+
+        module, sep, name = path.rpartition(".")
+        try:
+            hook_class = getattr(import_module(module), name)
+        except (ImportError, AttributeError, ValueError):
+            raise MigrationError("Unable to load migration hook %r" % path)
+        hooks.append(hook_class(**kwargs))
+    return hooks
+
+
+def notify(hooks, event, **kwargs):
+    """
+    Sends ``event`` to each of ``hooks``. A failing hook is logged rather
+    than allowed to interrupt the migration.
+    """
+    for hook in hooks:
+        try:
+            getattr(hook, event)(**kwargs)
+        except Exception:
+            logger.exception("Migration hook %r failed on %s", hook, event)
@@ -0,0 +1,211 @@
+import re
+
+from django.conf import settings
+
+from nashvegas.utils import get_index_name
+
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+
+TABLE = r"(?P<table>[`\"\w$.]+)"
+ALTER_TABLE = (r"^ALTER\s+TABLE\s+(?:IF\s+EXISTS\s+)?(?:ONLY\s+)?" + TABLE +
+               r"\s.*")
+CREATE_TABLE_RE = re.compile(
+    r"^CREATE\s+(?:(?:GLOBAL\s+|LOCAL\s+)?TEMP(?:ORARY)?\s+)?TABLE\s+"
+    r"(?:IF\s+NOT\s+EXISTS\s+)?" + TABLE,
+    re.IGNORECASE
+)
+
+
+class Rule(object):
+    """
+    A risky kind of statement. ``backends`` maps the vendors the rule applies
+    to onto the lock the statement takes there and how risky it is.
+    """
+
+    def __init__(self, name, pattern, backends, description):
+        self.name = name
+        self.pattern = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+        self.backends = backends
+        self.description = description
+
+    def match(self, statement, vendor):
+        if vendor not in self.backends:
+            return None
+        return self.pattern.match(statement)
+
+
+RULES = [
+    Rule("volatile-default",
+         ALTER_TABLE + r"\bADD\s+(?:COLUMN\s+)?.*\bDEFAULT\s+\(?\s*"
+         r"(?:random|clock_timestamp|timeofday|gen_random_uuid|"
+         r"uuid_generate_\w+|nextval)\s*\(",
+         {"postgresql": ("ACCESS EXCLUSIVE", "high")},
+         "adds a column with a volatile default, rewriting the table"),
+    Rule("add-column",
+         ALTER_TABLE + r"\bADD\s+(?:COLUMN\s+)?(?!CONSTRAINT|INDEX|KEY|"
+         r"UNIQUE|PRIMARY|FOREIGN|CHECK|FULLTEXT|SPATIAL)",
+         {"mysql": ("table copy", "medium")},
+         "adds a column, which copies the table before MySQL 8.0"),
+    Rule("alter-type",
+         ALTER_TABLE + r"\bALTER\s+(?:COLUMN\s+)?[`\"\w$]+\s+"
+         r"(?:SET\s+DATA\s+)?TYPE\b",
+         {"postgresql": ("ACCESS EXCLUSIVE", "high")},
+         "changes a column's type, rewriting the table and its indexes"),
+    Rule("modify-column",
+         ALTER_TABLE + r"\b(?:MODIFY|CHANGE)\s+(?:COLUMN\s+)?",
+         {"mysql": ("table copy", "high"), "oracle": ("EXCLUSIVE", "medium")},
+         "changes a column's definition, which may rewrite the table"),
+    Rule("set-not-null",
+         ALTER_TABLE + r"\bALTER\s+(?:COLUMN\s+)?[`\"\w$]+\s+SET\s+NOT\s+NULL",
+         {"postgresql": ("ACCESS EXCLUSIVE", "high")},
+         "scans the whole table for NULLs while holding its lock"),
+    Rule("foreign-key",
+         ALTER_TABLE + r"\bADD\s+(?:CONSTRAINT\s+[`\"\w$]+\s+)?FOREIGN\s+KEY"
+         r"(?!.*\bNOT\s+VALID\b)",
+         {"postgresql": ("SHARE ROW EXCLUSIVE", "high"),
+          "mysql": ("table copy", "high"),
+          "oracle": ("EXCLUSIVE", "high")},
+         "validates a new foreign key in-line, scanning the table while "
+         "blocking writes (add it NOT VALID, then VALIDATE CONSTRAINT)"),
+    Rule("check-constraint",
+         ALTER_TABLE + r"\bADD\s+(?:CONSTRAINT\s+[`\"\w$]+\s+)?CHECK\b"
+         r"(?!.*\bNOT\s+VALID\b)",
+         {"postgresql": ("ACCESS EXCLUSIVE", "high")},
+         "validates a new CHECK constraint in-line, scanning the table while "
+         "holding its lock (add it NOT VALID, then VALIDATE CONSTRAINT)"),
+    Rule("unique-constraint",
+         ALTER_TABLE + r"\bADD\s+(?:CONSTRAINT\s+[`\"\w$]+\s+)?"
+         r"(?:UNIQUE|PRIMARY\s+KEY)\b(?!.*\bUSING\s+INDEX\b)",
+         {"postgresql": ("ACCESS EXCLUSIVE", "high"),
+          "mysql": ("metadata", "medium"),
+          "oracle": ("EXCLUSIVE", "high")},
+         "builds a unique index while holding the table's lock"),
+    Rule("create-index",
+         r"^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?!CONCURRENTLY\b)"
+         r"(?:IF\s+NOT\s+EXISTS\s+)?[`\"\w$]+\s+ON\s+(?:ONLY\s+)?" + TABLE +
+         r"(?!.*\bONLINE\b)",
+         {"postgresql": ("SHARE", "high"), "oracle": ("SHARE", "high")},
+         "builds an index while blocking writes (build it CONCURRENTLY or "
+         "defer it)"),
+    Rule("lock-table",
+         r"^LOCK\s+TABLES?\s+(?:ONLY\s+)?" + TABLE,
+         {"postgresql": ("explicit", "high"), "mysql": ("explicit", "high"),
+          "oracle": ("explicit", "high")},
+         "locks the table explicitly"),
+    Rule("rewrite-table",
+         r"^(?:VACUUM\s+(?:\([^)]*\)\s*)?FULL|CLUSTER)\s+(?:VERBOSE\s+)?" +
+         TABLE,
+         {"postgresql": ("ACCESS EXCLUSIVE", "high")},
+         "rewrites the table"),
+    Rule("unbounded-dml",
+         r"^(?:UPDATE\s+(?:ONLY\s+)?" + TABLE + r"\s+SET\b|DELETE\s+FROM\s+"
+         r"(?:ONLY\s+)?(?P<delete_table>[`\"\w$.]+))(?!.*\bWHERE\b)",
+         {"postgresql": ("ROW EXCLUSIVE", "medium"),
+          "mysql": ("row", "medium"),
+          "oracle": ("row", "medium"),
+          "sqlite": ("database", "medium")},
+         "changes every row of the table in a single transaction"),
+]
+
+
+class Finding(object):
+    """
+    A risky statement, weighed by the size of the table it touches: a high
+    risk statement on a table of at least ``max_rows`` rows is an error.
+    """
+
+    def __init__(self, rule, statement, table, lock, risk, rows, max_rows):
+        self.rule = rule
+        self.statement = statement
+        self.table = table
+        self.lock = lock
+        self.risk = risk
+        self.rows = rows
+        self.is_error = (
+            risk == "high" and rows is not None and rows >= max_rows
+        )
+
+    def __unicode__(self):
+        rows = self.rows is None and "unknown size" or "~%d rows" % self.rows
+        return unicode("%s %s: %s [%s lock, %s on %s]" % (
+            self.is_error and "ERROR" or "warning",
+            self.rule.name,
+            self.rule.description,
+            self.lock,
+            rows,
+            self.table
+        ))
+
+
+def get_table_name(name, vendor):
+    """
+    Returns the unqualified table name of an identifier as written in a
+    statement, folding unquoted names to the case the database stores.
+    """
+    name = name.split(".")[-1]
+    if name[:1] in "`\"":
+        return name.strip("`\"")
+    if vendor == "postgresql":
+        return name.lower()
+    if vendor == "oracle":
+        return name.upper()
+    return name
+
+
+def _strip_comments(statement):
+    return "\n".join([
+        line for line in statement.splitlines()
+        if not line.strip().startswith("--")
+    ]).strip()
+
+
+class Linter(object):
+    """
+    Classifies the statements of pending migrations on a database by the
+    locks they take and whether they rewrite their table.
+
+    ``row_count`` returns a table's estimated size, or ``None`` where it is
+    unknown; tables created by the migrations being linted are empty.
+    """
+
+    def __init__(self, vendor, row_count, max_rows=None):
+        self.vendor = vendor
+        self.row_count = row_count
+        if max_rows is None:
+            max_rows = NASHVEGAS.get("lint_max_rows", 100000)
+        self.max_rows = max_rows
+        self.created_tables = set()
+
+    def lint_statement(self, statement, defer_indexes=False):
+        statement = _strip_comments(statement)
+
+        created = CREATE_TABLE_RE.match(statement)
+        if created is not None:
+            self.created_tables.add(
+                get_table_name(created.group("table"), self.vendor)
+            )
+            return []
+
+        if defer_indexes and get_index_name(statement):
+            # built CONCURRENTLY, outside the migration
+            return []
+
+        findings = []
+        for rule in RULES:
+            match = rule.match(statement, self.vendor)
+            if match is None:
+                continue
+            groups = match.groupdict()
+            table = get_table_name(
+                groups.get("table") or groups.get("delete_table"),
+                self.vendor
+            )
+            if table in self.created_tables:
+                continue
+            lock, risk = rule.backends[self.vendor]
+            findings.append(Finding(
+                rule, statement, table, lock, risk,
+                self.row_count(table), self.max_rows
+            ))
+        return findings
@@ -0,0 +1,154 @@
+import datetime
+import hashlib
+import os
+import socket
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction, IntegrityError, DatabaseError
+
+from nashvegas.models import MigrationLock, now
+
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+LOCK_NAME = "nashvegas"
+
+
+class LeaderLock(object):
+    """
+    Makes sure a single node at a time migrates a database. PostgreSQL and
+    MySQL take an advisory lock, which is released with the connection
+    should the node die. Other backends insert a row in the ledger's lock
+    table instead, which another node takes over once it is older than
+    "leader_lock_expiry" seconds (an hour by default). The leader refreshes
+    the row from a background thread three times per expiry for as long as
+    it holds the lock.
+    
+    Locks of different ``name`` are independent, e.g. for the schemas of a
+    database.
+    """
+    
+    def __init__(self, using, name=LOCK_NAME):
+        self.using = using
+        self.name = name
+        self.owner = "%s:%d" % (socket.gethostname(), os.getpid())
+        # PostgreSQL's advisory locks are keyed by a 64 bit integer
+        self.key = int(hashlib.md5(name).hexdigest()[:15], 16)
+        self.heartbeat = None
+    
+    def _fetch(self, sql, params):
+        cursor = connections[self.using].cursor()
+        try:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+            transaction.commit_unless_managed(using=self.using)
+    
+    def _get_mysql_name(self):
+        # GET_LOCK names are global to the server
+        name = "%s.%s" % (
+            self.name, connections[self.using].settings_dict["NAME"]
+        )
+        return name[:64]
+    
+    def acquire(self):
+        """
+        Takes the lock if no other node holds it, returning whether it did.
+        """
+        vendor = connections[self.using].vendor
+        if vendor == "postgresql":
+            return bool(self._fetch("SELECT pg_try_advisory_lock(%s)",
+                                    [self.key]))
+        if vendor == "mysql":
+            return self._fetch("SELECT GET_LOCK(%s, 0)",
+                               [self._get_mysql_name()]) == 1
+        
+        expiry = NASHVEGAS.get("leader_lock_expiry", 3600)
+        MigrationLock.objects.using(self.using).filter(
+            name=self.name,
+            date_acquired__lt=now() - datetime.timedelta(seconds=expiry)
+        ).delete()
+        transaction.commit_unless_managed(using=self.using)
+        try:
+            MigrationLock.objects.using(self.using).create(
+                name=self.name,
+                owner=self.owner
+            )
+        except IntegrityError:
+            transaction.rollback_unless_managed(using=self.using)
+            return False
+        transaction.commit_unless_managed(using=self.using)
+        
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._beat, args=(stopped,))
+        thread.daemon = True
+        thread.start()
+        self.heartbeat = (thread, stopped)
+        return True
+    
+    def refresh(self):
+        """
+        Renews the row of a lock held in the lock table so that it does not
+        expire, returning whether it is still held.
+        """
+        refreshed = MigrationLock.objects.using(self.using).filter(
+            name=self.name,
+            owner=self.owner
+        ).update(date_acquired=now())
+        transaction.commit_unless_managed(using=self.using)
+        return refreshed == 1
+    
+    def _beat(self, stopped):
+        interval = NASHVEGAS.get("leader_lock_expiry", 3600) / 3.0
+        try:
+            while True:
+                stopped.wait(interval)
+                if stopped.is_set():
+                    break
+                try:
+                    if not self.refresh():
+                        break
+                except DatabaseError:
+                    # e.g. the database is locked by the migration; the
+                    # next beat retries
+                    transaction.rollback_unless_managed(using=self.using)
+        finally:
+            # the thread has a connection of its own
+            connections[self.using].close()
+    
+    def wait(self):
+        """
+        Waits for the lock where the database can block on it, returning
+        whether it was taken. Other backends keep their locks in a table,
+        which may not have been created yet.
+        """
+        vendor = connections[self.using].vendor
+        if vendor == "postgresql":
+            self._fetch("SELECT pg_advisory_lock(%s)", [self.key])
+            return True
+        if vendor == "mysql":
+            return self._fetch(
+                "SELECT GET_LOCK(%s, %s)",
+                [self._get_mysql_name(),
+                 NASHVEGAS.get("leader_lock_expiry", 3600)]
+            ) == 1
+        return False
+    
+    def release(self):
+        vendor = connections[self.using].vendor
+        if vendor == "postgresql":
+            self._fetch("SELECT pg_advisory_unlock(%s)", [self.key])
+        elif vendor == "mysql":
+            self._fetch("SELECT RELEASE_LOCK(%s)", [self._get_mysql_name()])
+        else:
+            if self.heartbeat is not None:
+                thread, stopped = self.heartbeat
+                stopped.set()
+                thread.join()
+                self.heartbeat = None
+            MigrationLock.objects.using(self.using).filter(
+                name=self.name,
+                owner=self.owner
+            ).delete()
+            transaction.commit_unless_managed(using=self.using)
@@ -1,4 +1,7 @@
 import difflib
+import hashlib
+import re
+import sys
 
 from optparse import make_option
 from subprocess import PIPE, Popen
@@ -7,10 +10,38 @@ from django.db import connections, DEFAULT_DB_ALIAS
 from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.utils.datastructures import SortedDict
+
+from nashvegas.utils import iter_sql_statements
 
 
 NASHVEGAS = getattr(settings, "NASHVEGAS", {})
 
+# (object type, pattern matching the statement which defines it); the groups
+# of the pattern make up the object's name
+SCHEMA_OBJECTS = [
+    ("TABLE", re.compile(
+        r"^CREATE\s+(?:(?:GLOBAL|LOCAL|TEMP|TEMPORARY|UNLOGGED)\s+)*TABLE\s+"
+        r"(?:IF\s+NOT\s+EXISTS\s+)?([^\s(]+)", re.I)),
+    ("VIEW", re.compile(
+        r"^CREATE\s+(?:OR\s+REPLACE\s+)?(?:MATERIALIZED\s+)?VIEW\s+(\S+)",
+        re.I)),
+    ("INDEX", re.compile(
+        r"^CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:CONCURRENTLY\s+)?"
+        r"(?:IF\s+NOT\s+EXISTS\s+)?(\S+)", re.I)),
+    ("CONSTRAINT", re.compile(
+        r"^ALTER\s+TABLE\s+(?:ONLY\s+)?(\S+)\s+ADD\s+CONSTRAINT\s+(\S+)",
+        re.I)),
+    ("SEQUENCE", re.compile(r"^CREATE\s+SEQUENCE\s+(\S+)", re.I)),
+    ("FUNCTION", re.compile(
+        r"^CREATE\s+(?:OR\s+REPLACE\s+)?FUNCTION\s+([^\s(]+\s*\([^)]*\))",
+        re.I)),
+    ("TRIGGER", re.compile(
+        r"^CREATE\s+(?:CONSTRAINT\s+)?TRIGGER\s+(\S+).*?\sON\s+(\S+)",
+        re.I | re.S)),
+    ("TYPE", re.compile(r"^CREATE\s+TYPE\s+(\S+)", re.I)),
+]
+
 
 def ignorable_sql(line, level):
     if level == 0:
@@ -32,6 +63,69 @@ def normalize_sql(lines, level=1):
     return [line for line in lines if not ignorable_sql(line, level)]
 
 
+def get_object_key(statement):
+    """
+    Returns the ``(type, name)`` of the schema object ``statement`` defines.
+    Statements which define no object we know of are keyed by their hash, so
+    they only ever match identical statements.
+    """
+    for object_type, pattern in SCHEMA_OBJECTS:
+        match = pattern.match(statement)
+        if match is not None:
+            return object_type, ".".join(match.groups())
+    return "STATEMENT", hashlib.md5(statement).hexdigest()[:12]
+
+
+def parse_schema(lines):
+    """
+    Splits a schema dump into its statements, keyed by the schema object
+    each one defines.
+    """
+    objects = SortedDict()
+    for statement in iter_sql_statements(lines):
+        # strip comments, which would otherwise hide the statement's keyword
+        body = "\n".join([
+            line for line in statement.splitlines()
+            if not line.lstrip().startswith("--")
+        ]).strip()
+        if not body:
+            continue
+        key = get_object_key(body)
+        if key in objects:
+            # e.g. repeated GRANTs; keep them apart rather than overwrite
+            suffix = 2
+            while (key[0], "%s#%d" % (key[1], suffix)) in objects:
+                suffix += 1
+            key = (key[0], "%s#%d" % (key[1], suffix))
+        objects[key] = body + ";\n"
+    return objects
+
+
+def compare_schemas(current, new, context=10):
+    """
+    Compares two parsed schemas object by object, only diffing the objects
+    whose definitions differ. Yields the lines of the report.
+    """
+    def digest(statement):
+        return hashlib.md5(statement).digest()
+    
+    for key in sorted(set(current) | set(new)):
+        object_type, name = key
+        if key not in new:
+            yield "Only in current database: %s %s\n" % (object_type, name)
+            yield current[key]
+        elif key not in current:
+            yield "Only in fresh database: %s %s\n" % (object_type, name)
+            yield new[key]
+        elif digest(current[key]) != digest(new[key]):
+            yield "Differs: %s %s\n" % (object_type, name)
+            for line in difflib.unified_diff(
+                    current[key].splitlines(True),
+                    new[key].splitlines(True),
+                    n=context):
+                yield line
+
+
 class Command(BaseCommand):
     
     option_list = BaseCommand.option_list + (
@@ -57,6 +151,12 @@ class Command(BaseCommand):
                     default=1,
                     help="Ignore level. 0=ignore nothing, 1=ignore comments (default), "
                          "2=ignore constraints"),
+        make_option("-r", "--raw",
+                    action="store_true",
+                    dest="raw",
+                    default=False,
+                    help="Diff the dumps line by line rather than schema "
+                         "object by schema object."),
     )
     help = "Checks for schema differences."
     
@@ -81,6 +181,7 @@ class Command(BaseCommand):
         self.compare_name = options.get("db_name")
         self.lines = options.get("lines")
         self.ignore = int(options.get('ignore'))
+        self.raw = options.get("raw")
 
         if not self.compare_name:
             self.compare_name = "%s_compare" % self.current_name
@@ -110,6 +211,24 @@ class Command(BaseCommand):
             self.teardown_database()
         
         print "Outputing diff between the two..."
-        print "".join(difflib.unified_diff(normalize_sql(current_sql, self.ignore),
-                                           normalize_sql(new_sql, self.ignore),
-                                           n=int(self.lines)))
+        if self.raw:
+            print "".join(difflib.unified_diff(
+                normalize_sql(current_sql, self.ignore),
+                normalize_sql(new_sql, self.ignore),
+                n=int(self.lines)
+            ))
+            return
+        
+        # constraints are ignored as whole objects rather than line by line
+        level = min(self.ignore, 1)
+        current_objects = parse_schema(normalize_sql(current_sql, level))
+        new_objects = parse_schema(normalize_sql(new_sql, level))
+        if self.ignore > 1:
+            for objects in [current_objects, new_objects]:
+                for key in objects.keys():
+                    if key[0] == "CONSTRAINT":
+                        del objects[key]
+        
+        for line in compare_schemas(current_objects, new_objects,
+                                    int(self.lines)):
+            sys.stdout.write(line)
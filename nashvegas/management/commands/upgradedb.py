@@ -1,27 +1,85 @@
+import csv
+import hashlib
+import itertools
+import multiprocessing
 import os
+import random
 import re
 import sys
+import threading
+import time
 import traceback
 
+from collections import defaultdict
+from cStringIO import StringIO
 from optparse import make_option
 from subprocess import Popen, PIPE
 
 from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db import DatabaseError
 from django.db.models import get_model
 from django.conf import settings
-from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.core.management.sql import emit_post_sync_signal
 from django.utils.importlib import import_module
 
-from nashvegas.exceptions import MigrationError
-from nashvegas.models import Migration
+try:
+    from django.utils.timezone import now
+    now
+except ImportError:
+    import datetime
+    now = datetime.datetime.now
+
+from nashvegas.exceptions import MigrationError, LockTimeoutError
+from nashvegas.fixtures import load_initial_data
+from nashvegas.hooks import get_hooks, notify, TimingRecorder
+from nashvegas.lint import Linter
+from nashvegas.locks import LeaderLock
+from nashvegas.models import Migration, MigrationCheckpoint, DeferredIndex
+from nashvegas.models import MigrationAttempt
+from nashvegas.partitions import init_worker, run_partition
+from nashvegas.partitions import run_partition_in_savepoint
+from nashvegas.tenants import get_tenant_schemas, get_tenant_schema
+from nashvegas.tenants import use_tenant_schema, inherit_tenant_schemas
 from nashvegas.utils import get_sql_for_new_models, get_capable_databases
 from nashvegas.utils import get_pending_migrations
+from nashvegas.utils import iter_sql_statements, supports_transactional_ddl
+from nashvegas.utils import batch_insert_statements, get_migration_directives
+from nashvegas.utils import split_migration_name, get_migration_label
+from nashvegas.utils import open_migration, read_data_header
+from nashvegas.utils import get_migration_content, describe_compressed_migration
+from nashvegas.utils import read_migration_directives
+from nashvegas.utils import get_shard_group, get_migration_directory
+from nashvegas.utils import quote_sql_literal, get_index_name
+from nashvegas.utils import make_concurrent_index, get_estimated_row_count
+from nashvegas.utils import get_timeout_sql, is_lock_timeout
+from nashvegas.utils import get_sql_for_new_columns, get_schema_fingerprint
+from nashvegas.utils import get_sql_for_new_indexes
+from nashvegas.utils import get_all_migrations, scratch_database
+from nashvegas.utils import is_memory_database
+from nashvegas.utils import get_model_tables, read_model_snapshot
+from nashvegas.utils import write_model_snapshot, get_secondary_indexes
+from nashvegas.utils import get_touched_table, get_analyze_sql
+from nashvegas.utils import get_loadable_statement
+from nashvegas.utils import get_schema_sql, get_migration_phase
+from nashvegas.utils import MIGRATION_PHASES
+from nashvegas.utils import DATA_MIGRATION_DELIMITERS
 
 
 sys.path.append("migrations")
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
 MIGRATION_NAME_RE = re.compile(r"(\d+)(.*)")
+DURATION_RE = re.compile(r"^(\d+(?:\.\d+)?)([smh]?)$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+PLAN_MANIFEST_RE = re.compile(
+    r"^-- nashvegas-plan: (\S+) ([0-9a-f]{32}) (\S+)$"
+)
+# per-statement clocks for the timing markers of compiled plans
+PLAN_CLOCK_SQL = {
+    "postgresql": "clock_timestamp()",
+    "mysql": "SYSDATE()",
+    "oracle": "SYSTIMESTAMP",
+}
 
 
 class Transactional(object):
@@ -40,6 +98,84 @@ class Transactional(object):
             transaction.leave_transaction_management(using=db)
 
 
+class ProgressReader(object):
+    """
+    Wraps a data migration's file, counting the rows read from it and
+    reporting progress every ``every`` rows.
+    """
+    
+    def __init__(self, fp, every=None):
+        self.fp = fp
+        self.every = every or 100000
+        self.rows = 0
+    
+    def _count(self, data):
+        rows = self.rows + data.count("\n")
+        if rows / self.every > self.rows / self.every:
+            sys.stdout.write("%d rows...." % rows)
+            sys.stdout.flush()
+        self.rows = rows
+        return data
+    
+    def read(self, size=-1):
+        return self._count(self.fp.read(size))
+    
+    def readline(self, size=-1):
+        return self._count(self.fp.readline(size))
+    
+    def __iter__(self):
+        return iter(self.readline, "")
+    
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+
+class PrefixedOutput(object):
+    """
+    Stands in for ``sys.stdout`` while databases are migrated concurrently.
+    The output of a thread with a prefix is gathered into whole lines, which
+    are written with the prefix, so that the progress of different databases
+    is not interleaved within a line.
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    
+    def set_prefix(self, prefix):
+        self.finish()
+        self.local.prefix = prefix
+    
+    def write(self, data):
+        prefix = getattr(self.local, "prefix", None)
+        if prefix is None:
+            with self.lock:
+                self.stream.write(data)
+            return
+        lines = (getattr(self.local, "buffer", "") + data).split("\n")
+        self.local.buffer = lines.pop()
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.stream.write("%s%s\n" % (prefix, line))
+    
+    def finish(self):
+        """
+        Writes out the thread's unfinished line, if any.
+        """
+        if getattr(self.local, "buffer", ""):
+            self.write("\n")
+    
+    def flush(self):
+        # unfinished lines are only written once they are finished
+        with self.lock:
+            self.stream.flush()
+
+
 class Command(BaseCommand):
     
     option_list = BaseCommand.option_list + (
@@ -53,12 +189,65 @@ class Command(BaseCommand):
                     dest="do_execute",
                     default=False,
                     help="Execute migrations not in versions table."),
+        make_option("--phase",
+                    dest="phase",
+                    default=None,
+                    metavar="PHASE",
+                    help="Only execute, list, compile or check the pending "
+                         "migrations of a deploy phase: pre (expand) or post "
+                         "(contract)."),
+        make_option("--max-duration",
+                    dest="max_duration",
+                    default=None,
+                    metavar="DURATION",
+                    help="Only start migrations predicted to finish within "
+                         "DURATION of the command starting, in seconds or "
+                         "with an s, m or h suffix."),
+        make_option("--rehearse",
+                    action="store_true",
+                    dest="do_rehearse",
+                    default=False,
+                    help="Apply pending migrations to a scratch copy of each "
+                         "database's schema and report how long they took."),
+        make_option("--sample-rows",
+                    dest="sample_rows",
+                    type="int",
+                    default=0,
+                    metavar="N",
+                    help="Copy up to N rows of each table into the scratch "
+                         "databases of --rehearse."),
+        make_option("--fingerprint-check",
+                    action="store_true",
+                    dest="do_fingerprint_check",
+                    default=False,
+                    help="Compare the live schema with the fingerprint "
+                         "recorded by the last migration, and find the "
+                         "migration it diverged at on a rebuilt database."),
+        make_option("--lint",
+                    action="store_true",
+                    dest="do_lint",
+                    default=False,
+                    help="Report pending SQL statements which lock or rewrite "
+                         "tables, failing on high risk ones against large "
+                         "tables."),
+        make_option("--resume",
+                    action="store_true",
+                    dest="do_resume",
+                    default=False,
+                    help="Continue partially applied migrations from the "
+                         "first statement that did not complete."),
         make_option("-c", "--create",
                     action="store_true",
                     dest="do_create",
                     default=False,
                     help="Generates sql for models that are installed but not "
                          "in your database."),
+        make_option("--record-snapshot",
+                    action="store_true",
+                    dest="record_snapshot",
+                    default=False,
+                    help="Used with --create to add the models it outputs "
+                         "sql for to the model snapshot."),
         make_option("--create-all",
                     action="store_true",
                     dest="do_create_all",
@@ -71,6 +260,25 @@ class Command(BaseCommand):
                     default=False,
                     help="Seed nashvegas with migrations that have previously "
                          "been applied in another manner."),
+        make_option("--build-indexes",
+                    action="store_true",
+                    dest="do_build_indexes",
+                    default=False,
+                    help="Build the indexes deferred by earlier migrations "
+                         "which have not been built yet."),
+        make_option("--compile-plan",
+                    dest="compile_plan",
+                    default=None,
+                    metavar="DIRECTORY",
+                    help="Write the pending SQL migrations of each database "
+                         "to DIRECTORY/<database>.sql, to be applied with the "
+                         "database's own client."),
+        make_option("--mark-applied-from",
+                    dest="mark_applied_from",
+                    default=None,
+                    metavar="DIRECTORY",
+                    help="Check that the plans compiled into DIRECTORY have "
+                         "been applied and finish them as --execute would."),
         make_option("-d", "--database",
                     action="append",
                     dest="databases",
@@ -129,73 +337,425 @@ class Command(BaseCommand):
         if db == DEFAULT_DB_ALIAS and default_exists:
             migration_path = os.path.join(self.path, migration)
         else:
-            migration_path = os.path.join(self.path, db, migration)
+            migration_path = os.path.join(
+                get_migration_directory(self.path, db), migration
+            )
 
         return migration_path
     
-    def _execute_migration(self, database, migration, show_traceback=True):
-        created_models = set()
-        
-        with open(migration, "rb") as fp:
-            lines = fp.readlines()
-        content = "".join(lines)
+    def _use_checkpoints(self, database):
+        """
+        Statement checkpoints are only needed where a failed migration
+        cannot simply be rolled back; the "checkpoint" setting overrides
+        the per-backend default.
+        """
+        checkpoint = NASHVEGAS.get("checkpoint")
+        if checkpoint is None:
+            return not supports_transactional_ddl(connections[database])
+        return checkpoint
+    
+    def _get_checkpoint(self, database, label):
+        try:
+            checkpoint = MigrationCheckpoint.objects.using(database).get(
+                migration_label=label
+            )
+        except MigrationCheckpoint.DoesNotExist:
+            return MigrationCheckpoint(migration_label=label)
         
-        if migration.endswith(".sql"):
-            # TODO: this should support proper comments
-            to_execute = "".join(
-                [l for l in lines if not l.startswith("### New Model: ")]
+        retrying = (self._scope(database), label) in self.retrying
+        if not self.resume and not retrying:
+            raise MigrationError(
+                "Migration %r on %r was partially applied (%d statements); "
+                "rerun with --resume to continue from where it stopped" % (
+                    label, database, checkpoint.statements_applied
+                )
             )
-            connection = connections[database]
-            cursor = connection.cursor()
+        return checkpoint
+    
+    def _execute_sql(self, database, label, lines, defer_indexes=False):
+        """
+        Executes ``lines`` one statement at a time. Where checkpoints are
+        in use, progress is committed after every statement so that a
+        failed migration can be resumed with --resume.
+        
+        With ``defer_indexes``, plain ``CREATE INDEX`` statements are
+        recorded to be built once the database's migrations are done rather
+        than executed.
+        """
+        connection = connections[database]
+        checkpoint = None
+        if self._use_checkpoints(database):
+            checkpoint = self._get_checkpoint(database, label)
+            if checkpoint.statements_applied:
+                sys.stdout.write(
+                    "resuming after statement %d...." %
+                    checkpoint.statements_applied
+                )
+        
+        # The statements already applied must not have changed, though the
+        # one that failed may have been fixed before resuming.
+        applied = checkpoint and checkpoint.statements_applied or 0
+        digest = hashlib.md5()
+        
+        statements = iter_sql_statements(lines, connection.vendor)
+        if applied:
+            for statement in itertools.islice(statements, applied):
+                digest.update(statement)
+            self._verify_checkpoint(database, checkpoint, digest)
+        
+        index = applied
+        cursor = connection.cursor()
+        batch_size = self._get_insert_batch_size(connection)
+        for sources, statement in batch_insert_statements(statements,
+                                                          batch_size):
+            index_name = defer_indexes and get_index_name(statement)
+            table = get_touched_table(statement)
+            if table:
+                self.touched[self._scope(database)].add(table)
+            try:
+                if index_name:
+                    DeferredIndex.objects.using(database).create(
+                        migration_label=label,
+                        name=index_name,
+                        statement=statement,
+                    )
+                else:
+                    self._execute_statement(cursor, database, label,
+                                            statement)
+            except Exception:
+                sys.stdout.write("failed at statement %d\n" % (index + 1))
+                raise
+            
+            index += len(sources)
+            for source in sources:
+                digest.update(source)
             
+            if checkpoint is not None:
+                checkpoint.statements_applied = index
+                checkpoint.statements_hash = digest.hexdigest()
+                checkpoint.date_updated = now()
+                checkpoint.save(using=database)
+                transaction.commit(using=database)
+        cursor.close()
+        
+        if checkpoint is not None and checkpoint.pk:
+            checkpoint.delete()
+    
+    def _defers_indexes(self, migration):
+        value = read_migration_directives(migration).get(
+            "defer_indexes",
+            NASHVEGAS.get("defer_indexes", False)
+        )
+        if isinstance(value, basestring):
+            return value.lower() not in ("0", "false", "no")
+        return bool(value)
+    
+    def _get_insert_batch_size(self, connection):
+        if connection.vendor == "oracle":
+            # no multi-row VALUES
+            return 1
+        return NASHVEGAS.get("insert_batch_size", 100)
+    
+    def _execute_statement(self, cursor, database, label, statement,
+                           params=None, many=False):
+        """
+        Executes a single statement of a migration, timing it for the
+        configured hooks.
+        """
+        def execute():
+            if many:
+                cursor.executemany(statement, params)
+            elif params is None:
+                cursor.execute(statement)
+            else:
+                cursor.execute(statement, params)
+        
+        if not self.hooks:
+            return execute()
+        
+        notify(self.hooks, "before_statement",
+               database=database, migration=label, statement=statement)
+        start = time.time()
+        try:
+            execute()
+        except Exception:
+            notify(self.hooks, "after_statement",
+                   database=database, migration=label, statement=statement,
+                   duration=time.time() - start, rowcount=None, success=False)
+            raise
+        notify(self.hooks, "after_statement",
+               database=database, migration=label, statement=statement,
+               duration=time.time() - start, rowcount=cursor.rowcount,
+               success=True)
+    
+    def _verify_checkpoint(self, database, checkpoint, digest):
+        if checkpoint.statements_hash != digest.hexdigest():
+            raise MigrationError(
+                "The statements of %r already applied on %r have changed "
+                "since it failed and it cannot be resumed" % (
+                    checkpoint.migration_label, database
+                )
+            )
+    
+    def _execute_data(self, database, migration, fp):
+        """
+        Streams a delimited data migration into its table, using COPY on
+        PostgreSQL and batched inserts elsewhere.
+        
+        The header is made up of directive comments naming the table,
+        followed by a row of column names::
+        
+            # nashvegas: table=reference_country
+            code,name
+            US,United States
+        """
+        header = read_data_header(fp)
+        table = get_migration_directives(header).get("table")
+        if not table or table is True:
+            raise MigrationError(
+                "Data migration %r does not name its table "
+                "(# nashvegas: table=<name>)" % migration
+            )
+        
+        ext = split_migration_name(migration)[1]
+        delimiter = DATA_MIGRATION_DELIMITERS[ext]
+        columns = csv.reader(header[-1:], delimiter=delimiter).next()
+        
+        self.touched[self._scope(database)].add(table)
+        connection = connections[database]
+        qn = connection.ops.quote_name
+        table = qn(table)
+        columns = [qn(column.strip()) for column in columns]
+        progress = ProgressReader(fp, NASHVEGAS.get("data_progress_rows"))
+        cursor = connection.cursor()
+        
+        label = get_migration_label(migration)
+        
+        if connection.vendor == "postgresql":
+            sql = "COPY %s (%s) FROM STDIN WITH CSV DELIMITER %s" % (
+                table,
+                ", ".join(columns),
+                delimiter == "\t" and "E'\\t'" or "','"
+            )
+            notify(self.hooks, "before_statement",
+                   database=database, migration=label, statement=sql)
+            start = time.time()
             try:
-                cursor.execute(to_execute)
-                cursor.close()
+                cursor.copy_expert(sql, progress)
             except Exception:
+                notify(self.hooks, "after_statement",
+                       database=database, migration=label, statement=sql,
+                       duration=time.time() - start, rowcount=None,
+                       success=False)
+                raise
+            notify(self.hooks, "after_statement",
+                   database=database, migration=label, statement=sql,
+                   duration=time.time() - start, rowcount=progress.rows,
+                   success=True)
+        else:
+            sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+                table,
+                ", ".join(columns),
+                ", ".join(["%s"] * len(columns))
+            )
+            batch_size = NASHVEGAS.get("data_batch_size", 1000)
+            reader = csv.reader(progress, delimiter=delimiter)
+            while True:
+                # empty fields are loaded as NULL, as COPY does
+                rows = [
+                    [value != "" and value or None for value in row]
+                    for row in itertools.islice(reader, batch_size)
+                ]
+                if not rows:
+                    break
+                self._execute_statement(
+                    cursor, database, label, sql, rows, many=True
+                )
+        cursor.close()
+        
+        sys.stdout.write("%d rows...." % progress.rows)
+    
+    def _read_sql(self, lines, created_models, digest):
+        """
+        Yields the executable lines of a SQL migration, collecting the
+        models it creates from its "### New Model" markers.
+        """
+        for line in lines:
+            digest.update(line)
+            # TODO: this should support proper comments
+            if line.startswith("### New Model: "):
+                created_models.add(
+                    get_model(
+                        *line.replace(
+                            "### New Model: ",
+                            ""
+                        ).strip().split(".")
+                    )
+                )
+            else:
+                yield line
+    
+    def _execute_migration(self, database, migration, show_traceback=True):
+        start = time.time()
+        created_models = set()
+        name, ext, compression = split_migration_name(migration)
+        label = get_migration_label(migration)
+        
+        if compression or ext in DATA_MIGRATION_DELIMITERS:
+            # never read all of a compressed or data migration into memory
+            content = None
+        else:
+            with open(migration, "rb") as fp:
+                content = fp.read()
+        
+        if ext == ".sql" or ext in DATA_MIGRATION_DELIMITERS:
+            if content is None:
+                fp = open_migration(migration)
+            else:
+                fp = StringIO(content)
+            digest = hashlib.md5()
+            try:
+                if ext == ".sql":
+                    self._execute_sql(
+                        database,
+                        label,
+                        self._read_sql(fp, created_models, digest),
+                        defer_indexes=self._defers_indexes(migration)
+                    )
+                else:
+                    self._execute_data(database, migration, fp)
+            except MigrationError:
+                sys.stdout.write("failed\n")
+                raise
+            except Exception, e:
                 sys.stdout.write("failed\n")
+                if is_lock_timeout(e):
+                    raise LockTimeoutError(*e.args)
                 if show_traceback:
                     traceback.print_exc()
                 raise MigrationError()
             else:
                 sys.stdout.write("success\n")
+            finally:
+                fp.close()
             
-            for l in lines:
-                if l.startswith("### New Model: "):
-                    created_models.add(
-                        get_model(
-                            *l.replace(
-                                "### New Model: ",
-                                ""
-                            ).strip().split(".")
-                        )
-                    )
+            if content is None and ext == ".sql":
+                content = describe_compressed_migration(
+                    migration,
+                    digest.hexdigest()
+                )
         
-        elif migration.endswith(".py"):
+        elif ext == ".py":
             # TODO: python files have no concept of active database
             #       we should probably pass it to migrate()
             module = {}
-            execfile(migration, {}, module)
+            execfile(migration, module)
             
             if "migrate" in module and callable(module["migrate"]):
                 try:
-                    module["migrate"]()
-                except Exception:
+                    if "partitions" in module:
+                        self._run_partitions(database, migration,
+                                             module["partitions"])
+                    else:
+                        module["migrate"]()
+                except MigrationError:
+                    sys.stdout.write("failed\n")
+                    raise
+                except Exception, e:
                     sys.stdout.write("failed\n")
+                    if is_lock_timeout(e):
+                        raise LockTimeoutError(*e.args)
                     if show_traceback:
                         traceback.print_exc()
                     raise MigrationError()
                 else:
                     sys.stdout.write("success\n")
         
+        if content is None:
+            content = get_migration_content(migration)
+        
         Migration.objects.using(database).create(
-            migration_label=os.path.split(migration)[-1],
+            migration_label=label,
             content=content,
             scm_version=self._get_rev(migration),
+            duration=time.time() - start,
+            phase=get_migration_phase(migration),
         )
         
         return created_models
     
-    def init_nashvegas(self):
+    def _run_partitions(self, database, migration, partitions):
+        """
+        Runs ``migrate(partition)`` of a partitioned Python migration for
+        each of its partitions, on a pool of "partition_processes" worker
+        processes with connections of their own and the migration's
+        timeouts. Partitions commit as they succeed; the migration fails if
+        any of them does. Partitions run in this process instead are part
+        of the migration's transaction.
+        """
+        tasks = [
+            (migration, database, partition)
+            for partition in partitions.get_partitions(database)
+        ]
+        processes = NASHVEGAS.get("partition_processes",
+                                  multiprocessing.cpu_count())
+        if connections[database].vendor == "sqlite":
+            # a single writer, and workers would not see an in-memory
+            # database
+            processes = 1
+        
+        schemas = {}
+        if get_tenant_schema(database) is not None:
+            schemas[database] = get_tenant_schema(database)
+        
+        timeouts = self._get_timeouts(migration)
+        set_sql, reset_sql = get_timeout_sql(
+            connections[database],
+            timeouts["lock_timeout"],
+            timeouts["statement_timeout"]
+        )
+        
+        pool = None
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(
+                min(processes, len(tasks)),
+                initializer=init_worker,
+                initargs=(schemas, {database: set_sql})
+            )
+            results = pool.imap_unordered(run_partition, tasks)
+        else:
+            results = itertools.imap(run_partition_in_savepoint, tasks)
+        
+        failed = []
+        try:
+            for done, (partition, result, error) in enumerate(results):
+                if error is not None:
+                    failed.append(partition)
+                    sys.stdout.write("partition %r failed:\n%s" % (
+                        partition, error
+                    ))
+                elif result is not None and self.verbosity > 1:
+                    sys.stdout.write("partition %r: %r\n" % (
+                        partition, result
+                    ))
+                sys.stdout.write("%d/%d partitions...." % (
+                    done + 1, len(tasks)
+                ))
+                sys.stdout.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        
+        if failed:
+            raise MigrationError(
+                "%d of %d partitions of %r failed: %s" % (
+                    len(failed), len(tasks), migration,
+                    ", ".join(map(repr, failed))
+                )
+            )
+    
+    def init_nashvegas(self, databases=None):
         # Copied from line 35 of django.core.management.commands.syncdb
         # Import the 'management' module within each installed app, to
         # register dispatcher events.
@@ -216,33 +776,121 @@ class Command(BaseCommand):
                 if not msg.startswith("No module named") or "management" not in msg:
                     raise
         
-        # @@@ make cleaner / check explicitly for model instead of looping
-        #     over and doing string comparisons
-        databases = self.databases or get_capable_databases()
+        databases = databases or self.databases or get_capable_databases()
         for database in databases:
-            connection = connections[database]
-            cursor = connection.cursor()
-            all_new = get_sql_for_new_models(['nashvegas'], using=database)
-            for lines in all_new:
+            # nodes starting at once would otherwise all create the ledger
+            lock = LeaderLock(database, self._get_lock_name(database, "init"))
+            locked = lock.wait()
+            try:
+                self._init_ledger(database)
+            finally:
+                if locked:
+                    lock.release()
+    
+    def _scope(self, database):
+        # the tenant schemas of a database are migrated concurrently
+        return database, get_tenant_schema(database)
+    
+    def _get_lock_name(self, database, purpose=None):
+        name = "nashvegas"
+        if purpose is not None:
+            name = "%s.%s" % (name, purpose)
+        schema = get_tenant_schema(database)
+        if schema is not None:
+            name = "%s.%s" % (name, schema)
+        return name
+    
+    def _init_ledger(self, database):
+        """
+        Creates nashvegas's tables on ``database`` and adds the columns older
+        ledgers lack. Where the backend cannot wait for the lock, a statement
+        which fails because another node ran it first is skipped.
+        """
+        def pending():
+            # @@@ make cleaner / check explicitly for model instead of
+            #     looping over and doing string comparisons
+            statements = []
+            for lines in get_sql_for_new_models(['nashvegas'], using=database):
                 to_execute = "\n".join([
                     l
                     for l in lines.split("\n")
                     if not l.startswith("### New Model: ")
                 ])
-                if not to_execute:
-                    continue
-                cursor.execute(to_execute)
+                if to_execute:
+                    statements.append(to_execute)
+            # ledgers created by older versions lack the newer columns and
+            # the label index
+            return (statements +
+                    get_sql_for_new_columns(Migration, database) +
+                    get_sql_for_new_columns(MigrationAttempt, database) +
+                    get_sql_for_new_indexes(Migration, database))
+        
+        connection = connections[database]
+        for statement in pending():
+            cursor = connection.cursor()
+            try:
+                cursor.execute(statement)
+            except DatabaseError:
+                transaction.rollback_unless_managed(using=database)
+                if statement in pending():
+                    raise
+            else:
                 transaction.commit_unless_managed(using=database)
+            finally:
+                cursor.close()
+    
+    def _get_sql_for_new_models(self, database, apps=None):
+        """
+        Returns the SQL for the models of ``apps`` which are not in the model
+        snapshot of ``database``'s migrations, and the snapshot with them
+        added, to be written once their migration has been.
+        
+        The snapshot is started from the tables in the database the first
+        time; after that no database connection is needed.
+        """
+        db_path = get_migration_directory(self.path, database)
+        snapshot = read_model_snapshot(db_path)
+        started = snapshot is None
+        if started:
+            statements = get_sql_for_new_models(apps, using=database)
+            
+            connection = connections[database]
+            converter = connection.introspection.table_name_converter
+            tables = connection.introspection.table_names()
+            snapshot = dict(
+                (name, table)
+                for name, table in get_model_tables(using=database).items()
+                if converter(table) in tables
+            )
+        else:
+            statements = get_sql_for_new_models(
+                apps,
+                using=database,
+                tables=snapshot.values()
+            )
+        
+        snapshot.update(get_model_tables(apps, using=database))
+        return statements, snapshot
     
     def create_all_migrations(self):
+        created_in = set()
         for database in get_capable_databases():
-            statements = get_sql_for_new_models(using=database)
+            # the databases of a shard group share one migration
+            db_path = get_migration_directory(self.path, database)
+            if db_path in created_in:
+                continue
+            
+            statements, snapshot = self._get_sql_for_new_models(database)
             if len(statements) == 0:
                 continue
             
-            number = self._get_current_migration_number(database)
+            # numbered after the migrations on disk, applied or not
+            number = max([0] + [
+                n for n, migration in
+                get_all_migrations(self.path, [database]).get(database, [])
+            ])
+            created_in.add(db_path)
             
-            db_path = os.path.join(self.path, database)
             if not os.path.exists(db_path):
                 os.makedirs(db_path)
             
@@ -258,63 +906,1042 @@ class Command(BaseCommand):
             with open(path, 'w') as fp:
                 for s in statements:
                     fp.write(s + '\n')
+            write_model_snapshot(db_path, snapshot)
             
             print "Created new migration: %r" % path
     
     def create_migrations(self, database):
-        statements = get_sql_for_new_models(self.args, using=database)
+        statements, snapshot = self._get_sql_for_new_models(database,
+                                                            self.args)
         if len(statements) > 0:
             for s in statements:
                 print s
+            # only once the output has made it into a migration
+            if self.record_snapshot:
+                write_model_snapshot(
+                    get_migration_directory(self.path, database),
+                    snapshot
+                )
+    
+    def _get_timeouts(self, migration):
+        """
+        Returns the lock and statement timeouts and the number of lock
+        timeout retries of a migration, from its directives or else the
+        ``NASHVEGAS`` setting.
+        """
+        directives = read_migration_directives(migration)
+        timeouts = {}
+        for name, default in [("lock_timeout", None),
+                              ("statement_timeout", None),
+                              ("lock_retries", 3)]:
+            value = directives.get(name, NASHVEGAS.get(name, default))
+            if value is None:
+                timeouts[name] = None
+                continue
+            match = DURATION_RE.match(str(value).strip())
+            if match is None or (name == "lock_retries" and
+                                 (match.group(2) or "." in match.group(1))):
+                raise MigrationError("Invalid %s %r in %r" % (
+                    name, value, migration
+                ))
+            timeouts[name] = (float(match.group(1)) *
+                              DURATION_UNITS[match.group(2)])
+        return timeouts
+    
+    def _execute_timeout_sql(self, db, statements):
+        if not statements:
+            return
+        cursor = connections[db].cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    
+    def _get_bulk_load_tables(self, migration_path):
+        """
+        Returns the tables a migration marked ``bulk_load`` loads, named by
+        the directive or, for a bare flag on a data migration, its table.
+        """
+        directives = read_migration_directives(migration_path)
+        tables = directives.get("bulk_load")
+        if not tables:
+            return []
+        if tables is True:
+            ext = split_migration_name(migration_path)[1]
+            if ext not in DATA_MIGRATION_DELIMITERS:
+                raise MigrationError(
+                    "Migration %r does not name the tables it bulk loads "
+                    "(-- nashvegas: bulk_load=<table> <table>)" %
+                    migration_path
+                )
+            tables = directives.get("table") or ""
+        return tables.split()
+    
+    def _drop_for_bulk_load(self, db, label, tables):
+        """
+        Drops the non-unique indexes and foreign keys of ``tables``. They are
+        recorded as deferred indexes of the migration first, so that they are
+        rebuilt even if nashvegas is interrupted before it gets to them.
+        """
+        for table in tables:
+            secondary = get_secondary_indexes(table, db)
+            with Transactional():
+                for name, drop, create in secondary:
+                    DeferredIndex.objects.using(db).create(
+                        migration_label=label,
+                        name=name,
+                        statement=create,
+                    )
+            
+            cursor = connections[db].cursor()
+            for name, drop, create in secondary:
+                with Transactional():
+                    self._execute_statement(cursor, db, label, drop)
+            cursor.close()
+            
+            if secondary:
+                sys.stdout.write("Dropped %d indexes and constraints of %s "
+                                 "for bulk loading.\n" % (
+                                     len(secondary), table
+                                 ))
+    
+    def _run_migration(self, db, migration, migration_path, show_traceback):
+        """
+        Executes a single migration in its own transaction, returning the
+        models it created.
+        
+        The indexes and foreign keys of the tables a migration bulk loads are
+        dropped while it runs and rebuilt afterwards, whether it succeeded or
+        not.
+        """
+        label = get_migration_label(migration)
+        tables = self._get_bulk_load_tables(migration_path)
+        if tables:
+            self._drop_for_bulk_load(db, label, tables)
+        
+        try:
+            created_models = self._retry_migration(
+                db, migration, migration_path, show_traceback
+            )
+        except Exception:
+            exc_info = sys.exc_info()
+            if tables:
+                try:
+                    self.build_deferred_indexes(db, label)
+                except MigrationError:
+                    # left for upgradedb --build-indexes
+                    pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        
+        if tables:
+            self.build_deferred_indexes(db, label)
+        return created_models
+    
+    def _retry_migration(self, db, migration, migration_path, show_traceback):
+        """
+        A migration which fails to acquire a lock within its lock timeout is
+        rolled back and retried up to "lock_retries" times, after a random
+        delay which doubles with every attempt. Each attempt, successful or
+        not, is recorded with its outcome and duration.
+        """
+        label = get_migration_label(migration)
+        timeouts = self._get_timeouts(migration_path)
+        set_sql, reset_sql = get_timeout_sql(
+            connections[db],
+            timeouts["lock_timeout"],
+            timeouts["statement_timeout"]
+        )
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            notify(self.hooks, "before_migration", database=db,
+                   migration=label)
+            start = time.time()
+            try:
+                try:
+                    with Transactional():
+                        sys.stdout.write(
+                            "Executing migration %r on %r...." % (
+                                migration, db
+                            )
+                        )
+                        self._execute_timeout_sql(db, set_sql)
+                        created_models = self._execute_migration(
+                            db,
+                            migration_path,
+                            show_traceback=show_traceback
+                        )
+                finally:
+                    with Transactional():
+                        self._execute_timeout_sql(db, reset_sql)
+            except LockTimeoutError, e:
+                notify(self.hooks, "after_migration",
+                       database=db, migration=label,
+                       duration=time.time() - start, success=False)
+                with Transactional():
+                    MigrationAttempt.objects.using(db).create(
+                        migration_label=label,
+                        attempt=attempt,
+                        error=repr(e.args),
+                        outcome="lock_timeout",
+                        duration=time.time() - start,
+                    )
+                if attempt > timeouts["lock_retries"]:
+                    self.retrying.discard((self._scope(db), label))
+                    raise
+                
+                # full jitter, so that retries do not queue up together
+                delay = random.uniform(0, min(
+                    NASHVEGAS.get("lock_retry_max_delay", 30),
+                    NASHVEGAS.get("lock_retry_delay", 1) * 2 ** (attempt - 1)
+                ))
+                sys.stdout.write(
+                    "Lock timeout on attempt %d, retrying in %.1fs.\n" % (
+                        attempt, delay
+                    )
+                )
+                time.sleep(delay)
+                # statements committed by the failed attempt stay applied
+                self.retrying.add((self._scope(db), label))
+                continue
+            except Exception:
+                notify(self.hooks, "after_migration",
+                       database=db, migration=label,
+                       duration=time.time() - start, success=False)
+                self.retrying.discard((self._scope(db), label))
+                raise
+            
+            duration = time.time() - start
+            self.retrying.discard((self._scope(db), label))
+            with Transactional():
+                MigrationAttempt.objects.using(db).create(
+                    migration_label=label,
+                    attempt=attempt,
+                    error="",
+                    outcome="success",
+                    duration=duration,
+                )
+            self._record_fingerprint(db, label)
+            notify(self.hooks, "after_migration",
+                   database=db, migration=label,
+                   duration=duration, success=True)
+            return created_models
+    
+    def _record_fingerprint(self, db, label):
+        """
+        Records the schema fingerprint of ``db`` on the ledger row of the
+        migration just applied. It is read once the migration has committed,
+        so that the catalog queries hold no locks for the migration.
+        """
+        if not NASHVEGAS.get("fingerprint", True):
+            return
+        with Transactional():
+            Migration.objects.using(db).filter(
+                migration_label=label
+            ).update(fingerprint=get_schema_fingerprint(db))
+    
+    def _emit_post_sync(self, db, created_models):
+        with Transactional():
+            emit_post_sync_signal(
+                created_models=created_models,
+                verbosity=self.verbosity,
+                interactive=self.interactive,
+                db=db,
+            )
     
     def execute_migrations(self, show_traceback=True):
         """
         Executes all pending migrations across all capable
         databases
         """
-        all_migrations = get_pending_migrations(self.path, self.databases)
+        databases, tenants = self._split_tenant_databases()
+        all_migrations = {}
+        if databases:
+            all_migrations = get_pending_migrations(
+                self.path, databases, phase=self.phase
+            )
+            self._check_phases(all_migrations)
         
-        if not len(all_migrations):
+        if not len(all_migrations) and not tenants:
             sys.stdout.write("There are no migrations to apply.\n")
         
+        shards = defaultdict(list)
+        for db, migrations in all_migrations.iteritems():
+            group = get_shard_group(db)
+            if group is not None:
+                shards[group].append(db)
+            else:
+                self.execute_database_migrations(db, migrations,
+                                                 show_traceback)
+        
+        try:
+            for group, databases in shards.iteritems():
+                self.execute_shard_migrations(group, databases, all_migrations,
+                                              show_traceback)
+            for db in tenants:
+                self.execute_tenant_migrations(db, show_traceback)
+        finally:
+            if self.deferred:
+                print "Deferred to stay within --max-duration:"
+                for db, migration in self.deferred:
+                    print "\t%s: %s (predicted %.1fs)" % (
+                        db, migration, self._predict_duration(db, migration)
+                    )
+            for thread in self.analyzers:
+                thread.join()
+    
+    def _check_phases(self, all_migrations):
+        """
+        Raises for a pending migration with an invalid phase directive
+        before any migration runs, rather than once it has been applied and
+        is being recorded.
+        """
         for db, migrations in all_migrations.iteritems():
-            connection = connections[db]
-            
-            # init connection
-            cursor = connection.cursor()
-            cursor.close()
-                        
             for migration in migrations:
+                get_migration_phase(self._get_migration_path(db, migration))
+    
+    def _split_tenant_databases(self):
+        """
+        Splits the databases being migrated into those migrated as they are
+        and those whose tenant schemas are migrated one by one.
+        """
+        tenants = NASHVEGAS.get("tenant_schemas", {})
+        databases = list(self.databases or get_capable_databases())
+        return (
+            [db for db in databases if db not in tenants],
+            [db for db in databases if db in tenants]
+        )
+    
+    def _fits_budget(self, db, migration):
+        if self.max_duration is None:
+            return True
+        elapsed = time.time() - self.started
+        return elapsed + self._predict_duration(db, migration) <= \
+            self.max_duration
+    
+    def _predict_duration(self, db, migration):
+        """
+        Predicts how long ``migration`` will take on ``db``: as long as it
+        took on the slowest database sharing ``db``'s migrations it has
+        already been applied to, or else its size times the rate at which
+        migrations of its type have been applied to ``db``.
+        """
+        label = get_migration_label(migration)
+        directory = get_migration_directory(self.path, db)
+        durations = []
+        for database in self.databases or get_capable_databases():
+            if get_migration_directory(self.path, database) != directory:
+                # the same label is a different migration there
+                continue
+            durations.extend(
+                Migration.objects.using(database).filter(
+                    migration_label=label
+                ).exclude(duration=None).values_list("duration", flat=True)
+            )
+        if durations:
+            return max(durations)
+        
+        size = os.path.getsize(self._get_migration_path(db, migration))
+        return size * self._get_rate(db, split_migration_name(migration)[1])
+    
+    def _get_rate(self, db, ext):
+        """
+        Returns the seconds per byte migrations of type ``ext`` have taken
+        on ``db``. The history starts from a megabyte at the "seconds_per_mb"
+        setting, so that the fixed cost of a few small migrations does not
+        dominate it.
+        """
+        if (db, ext) not in self.rates:
+            paths = dict([
+                (get_migration_label(path), path)
+                for number, path in get_all_migrations(
+                    self.path, [db]
+                ).get(db, [])
+            ])
+            seconds = NASHVEGAS.get("seconds_per_mb", 10.0)
+            size = 1024 * 1024
+            for label, duration in Migration.objects.using(db).exclude(
+                duration=None
+            ).values_list("migration_label", "duration"):
+                if label in paths and split_migration_name(label)[1] == ext:
+                    seconds += duration
+                    size += os.path.getsize(paths[label])
+            self.rates[db, ext] = seconds / size
+        return self.rates[db, ext]
+    
+    def execute_shard_migrations(self, group, databases, all_migrations,
+                                 show_traceback=True):
+        """
+        Migrates the databases of a shard group: the first one (the canary)
+        on its own, then the rest concurrently, with up to "shard_concurrency"
+        at a time. No further databases are started once one has failed.
+        """
+        order = NASHVEGAS["shard_groups"][group]
+        databases = sorted(databases, key=order.index)
+        total = len(databases)
+        done = []
+        failed = []
+        lock = threading.Lock()
+        
+        output = PrefixedOutput(sys.stdout)
+        
+        def migrate(db):
+            output.set_prefix("[%s] " % db)
+            try:
+                self.execute_database_migrations(db, all_migrations[db],
+                                                 show_traceback)
+            except Exception:
+                with lock:
+                    failed.append(db)
+                    output.finish()
+                    sys.stdout.write("Shard %r of %r failed:\n" % (db, group))
+                    traceback.print_exc()
+            else:
+                with lock:
+                    done.append(db)
+                    sys.stdout.write("Shard %r of %r migrated (%d/%d).\n" % (
+                        db, group, len(done), total
+                    ))
+            finally:
+                output.set_prefix(None)
+                connections[db].close()
+        
+        canary, rest = databases[0], databases[1:]
+        sys.stdout.write("Migrating canary %r of %r.\n" % (canary, group))
+        sys.stdout = output
+        try:
+            migrate(canary)
+            
+            queue = list(rest)
+            
+            def worker():
+                while True:
+                    with lock:
+                        if failed or not queue:
+                            return
+                        db = queue.pop(0)
+                    migrate(db)
+            
+            if not failed and rest:
+                concurrency = min(NASHVEGAS.get("shard_concurrency", 4),
+                                  len(rest))
+                threads = [
+                    threading.Thread(target=worker)
+                    for i in range(concurrency)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+        finally:
+            sys.stdout = output.stream
+        
+        if failed:
+            raise MigrationError(
+                "Migrating %r failed on %s; %d of %d shards were migrated and "
+                "%d were not started" % (
+                    group, ", ".join(map(repr, failed)), len(done), total,
+                    total - len(done) - len(failed)
+                )
+            )
+    
+    def execute_tenant_migrations(self, db, show_traceback=True):
+        """
+        Migrates each tenant schema of ``db``, each with a ledger of its own.
+        The schemas and migrations are found once; up to "tenant_concurrency"
+        threads then work through the schemas, each on a single connection
+        whose search_path moves from one schema to the next. The first schema
+        (the canary) is migrated on its own, and no further schemas are
+        started once one has failed.
+        """
+        schemas = get_tenant_schemas(db)
+        if not schemas:
+            sys.stdout.write("There are no tenant schemas on %r.\n" % db)
+            return
+        possible_migrations = get_all_migrations(self.path, [db])
+        total = len(schemas)
+        done = []
+        failed = []
+        lock = threading.Lock()
+        output = PrefixedOutput(sys.stdout)
+        
+        def migrate(schema):
+            output.set_prefix("[%s/%s] " % (db, schema))
+            try:
+                use_tenant_schema(db, schema)
+                self.init_nashvegas([db])
+                migrations = get_pending_migrations(
+                    self.path, [db], phase=self.phase,
+                    possible_migrations=possible_migrations
+                ).get(db, [])
+                self._check_phases({db: migrations})
+                if migrations:
+                    self.execute_database_migrations(db, migrations,
+                                                     show_traceback)
+            except Exception:
+                with lock:
+                    failed.append(schema)
+                    output.finish()
+                    sys.stdout.write("Tenant %r of %r failed:\n" % (
+                        schema, db
+                    ))
+                    traceback.print_exc()
+            else:
+                with lock:
+                    done.append(schema)
+                    if migrations or self.verbosity > 1:
+                        sys.stdout.write(
+                            "Tenant %r of %r migrated (%d/%d).\n" % (
+                                schema, db, len(done), total
+                            )
+                        )
+            finally:
+                output.set_prefix(None)
+        
+        def worker(queue):
+            try:
+                while True:
+                    with lock:
+                        if failed or not queue:
+                            return
+                        schema = queue.pop(0)
+                    migrate(schema)
+            finally:
+                connections[db].close()
+        
+        def run(queue, concurrency):
+            # the threads' connections, not the command's, are pointed at
+            # the tenants' schemas
+            threads = [
+                threading.Thread(target=worker, args=(queue,))
+                for i in range(concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        canary, rest = schemas[0], schemas[1:]
+        sys.stdout.write("Migrating canary %r of %r.\n" % (canary, db))
+        sys.stdout = output
+        try:
+            run([canary], 1)
+            if not failed and rest:
+                run(list(rest),
+                    min(NASHVEGAS.get("tenant_concurrency", 4), len(rest)))
+        finally:
+            sys.stdout = output.stream
+        
+        if failed:
+            raise MigrationError(
+                "Migrating %r failed on %s; %d of %d tenants were migrated "
+                "and %d were not started" % (
+                    db, ", ".join(map(repr, failed)), len(done), total,
+                    total - len(done) - len(failed)
+                )
+            )
+    
+    def execute_database_migrations(self, db, migrations, show_traceback=True):
+        """
+        Executes the pending ``migrations`` of a single database, once this
+        node has been elected to by taking the database's migration lock.
+        Nodes which find the lock taken poll the ledger every
+        "leader_poll_interval" seconds until it shows the migrations applied,
+        and only take over if the lock is released before then.
+        """
+        lock = LeaderLock(db, self._get_lock_name(db))
+        if not lock.acquire():
+            sys.stdout.write(
+                "Waiting for another node to migrate %r...." % db
+            )
+            labels = [get_migration_label(m) for m in migrations]
+            while True:
+                time.sleep(NASHVEGAS.get("leader_poll_interval", 5))
+                applied = Migration.objects.using(db).filter(
+                    migration_label__in=labels
+                ).count()
+                transaction.commit_unless_managed(using=db)
+                if applied == len(labels):
+                    sys.stdout.write("migrated by another node\n")
+                    return
+                if lock.acquire():
+                    sys.stdout.write("taking over\n")
+                    break
+        
+        try:
+            # another node may have applied some of them in the meantime
+            applied = set(Migration.objects.using(db).filter(
+                migration_label__in=[get_migration_label(m) for m in migrations]
+            ).values_list("migration_label", flat=True))
+            migrations = [
+                m for m in migrations
+                if get_migration_label(m) not in applied
+            ]
+            if migrations:
+                self._execute_database_migrations(db, migrations,
+                                                  show_traceback)
+        finally:
+            lock.release()
+    
+    def _execute_database_migrations(self, db, migrations, show_traceback):
+        # post_syncdb makes every listener rescan every installed app, so it
+        # is sent once per database rather than after each migration
+        per_migration = NASHVEGAS.get("post_sync_per_migration", False)
+        
+        # listeners write to the alias' default schema, not the tenant's
+        tenant = get_tenant_schema(db) is not None
+        
+        connection = connections[db]
+        
+        # init connection
+        cursor = connection.cursor()
+        cursor.close()
+        
+        created_models = set()
+        pending_signal = False
+        try:
+            for i, migration in enumerate(migrations):
+                if not self._fits_budget(db, migration):
+                    self.deferred.extend([(db, m) for m in migrations[i:]])
+                    break
+                
                 migration_path = self._get_migration_path(db, migration)
                 
-                with Transactional():
-                    sys.stdout.write(
-                        "Executing migration %r on %r...." %
-                        (migration, db)
-                    )
-                    created_models = self._execute_migration(
-                        db,
-                        migration_path,
-                        show_traceback=show_traceback
+                # migrations marked with "post_sync" rely on the signal
+                # having been sent for the migrations before them
+                directives = read_migration_directives(migration_path)
+                if pending_signal and directives.get("post_sync"):
+                    self._emit_post_sync(db, created_models)
+                    created_models = set()
+                    pending_signal = False
+                
+                migration_models = self._run_migration(
+                    db, migration, migration_path, show_traceback
+                )
+                created_models.update(migration_models)
+                self.touched[self._scope(db)].update([
+                    model._meta.db_table for model in migration_models
+                ])
+                pending_signal = not tenant
+                
+                if per_migration and pending_signal:
+                    self._emit_post_sync(db, created_models)
+                    created_models = set()
+                    pending_signal = False
+        finally:
+            if pending_signal:
+                self._emit_post_sync(db, created_models)
+        
+        # analyze_tables forgets the tables migrations touched
+        touched = set(self.touched.get(self._scope(db), ()))
+        self.build_deferred_indexes(db)
+        self.analyze_tables(db)
+        
+        if self.load_initial_data and not tenant:
+            self._load_initial_data(db, touched)
+    
+    def analyze_tables(self, db):
+        """
+        Refreshes the planner statistics of the tables migrations on ``db``
+        touched, rather than leaving queries against them to be planned from
+        stale statistics until autoanalyze catches up. With
+        "analyze_in_background" set, this happens on a connection of its own
+        while the command moves on to the next database.
+        """
+        touched = self.touched.pop(self._scope(db), set())
+        if not touched or not NASHVEGAS.get("analyze", True):
+            return
+        
+        connection = connections[db]
+        existing = dict([
+            (table.lower(), table)
+            for table in connection.introspection.table_names()
+        ])
+        tables = sorted(set([
+            existing[table.lower()]
+            for table in touched if table.lower() in existing
+        ]))
+        if not tables:
+            return
+        statements = get_analyze_sql(connection, tables)
+        background = (NASHVEGAS.get("analyze_in_background", False) and
+                      connection.vendor != "sqlite")
+        
+        def analyze():
+            try:
+                cursor = connections[db].cursor()
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.close()
+                transaction.commit_unless_managed(using=db)
+            except Exception:
+                sys.stdout.write("Analyzing tables on %r failed:\n" % db)
+                traceback.print_exc()
+            else:
+                sys.stdout.write("Analyzed %s on %r.\n" % (
+                    ", ".join(tables), db
+                ))
+            finally:
+                if background:
+                    connections[db].close()
+        
+        if background:
+            thread = threading.Thread(target=inherit_tenant_schemas(analyze))
+            thread.start()
+            self.analyzers.append(thread)
+        else:
+            analyze()
+    
+    def build_deferred_indexes(self, db, migration_label=None):
+        """
+        Builds the indexes migrations on ``db`` deferred, outside of their
+        transactions and on connections of their own, up to
+        "index_concurrency" at a time. PostgreSQL builds them CONCURRENTLY so
+        that their tables remain writable meanwhile. Foreign keys dropped for
+        bulk loads are added back once the indexes are built.
+        """
+        pending = DeferredIndex.objects.using(db).filter(
+            date_built__isnull=True
+        ).order_by("pk")
+        if migration_label is not None:
+            pending = pending.filter(migration_label=migration_label)
+        pending = list(pending)
+        if not pending:
+            return
+        
+        failed = []
+        lock = threading.Lock()
+        
+        def build(index):
+            try:
+                self._build_index(db, index)
+            except Exception:
+                with lock:
+                    failed.append(index.name)
+                    sys.stdout.write("Building index %s on %r failed:\n" % (
+                        index.name, db
+                    ))
+                    traceback.print_exc()
+            else:
+                with lock:
+                    sys.stdout.write("Built index %s on %r.\n" % (
+                        index.name, db
+                    ))
+        
+        def is_constraint(index):
+            return index.statement.lstrip().upper().startswith("ALTER")
+        
+        for batch in [[i for i in pending if not is_constraint(i)],
+                      [i for i in pending if is_constraint(i)]]:
+            if not batch:
+                continue
+            
+            if connections[db].vendor == "sqlite":
+                # other connections would not see an in-memory database, and
+                # SQLite builds one index at a time anyway
+                for index in batch:
+                    with Transactional():
+                        build(index)
+                continue
+            
+            queue = list(batch)
+            
+            def worker():
+                try:
+                    while True:
+                        with lock:
+                            if not queue:
+                                return
+                            index = queue.pop(0)
+                        build(index)
+                finally:
+                    connections[db].close()
+            
+            concurrency = min(NASHVEGAS.get("index_concurrency", 2),
+                              len(batch))
+            threads = [
+                threading.Thread(target=inherit_tenant_schemas(worker))
+                for i in range(concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        if failed:
+            raise MigrationError(
+                "Building %s on %r failed; run upgradedb --build-indexes to "
+                "retry" % (", ".join(failed), db)
+            )
+    
+    def _build_index(self, db, index):
+        connection = connections[db]
+        cursor = connection.cursor()
+        statement = index.statement
+        try:
+            if connection.vendor == "postgresql":
+                # CONCURRENTLY cannot run inside a transaction
+                connection.connection.set_isolation_level(0)
+                statement = make_concurrent_index(statement)
+                
+                # an interrupted concurrent build leaves an invalid index
+                cursor.execute(
+                    "SELECT 1 FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = %s AND NOT i.indisvalid",
+                    [index.name]
+                )
+                if cursor.fetchone():
+                    cursor.execute(
+                        "DROP INDEX %s" % connection.ops.quote_name(index.name)
                     )
-
-                    emit_post_sync_signal(
-                        created_models=created_models,
-                        verbosity=self.verbosity,
-                        interactive=self.interactive,
-                        db=db,
+            
+            self._execute_statement(cursor, db, index.migration_label,
+                                    statement)
+        finally:
+            cursor.close()
+        
+        DeferredIndex.objects.using(db).filter(pk=index.pk).update(
+            date_built=now()
+        )
+        transaction.commit_unless_managed(using=db)
+    
+    def _load_initial_data(self, db, touched=None):
+        """
+        Loads the initial_data fixtures of ``db``, unless they are unchanged
+        and none of the tables the migrations ``touched`` holds their objects.
+        """
+        sys.stdout.write("Loading initial_data fixtures on %r...." % db)
+        with Transactional():
+            count = load_initial_data(
+                db,
+                force=not NASHVEGAS.get("initial_data_digest", True),
+                touched=touched
+            )
+        if count is None:
+            sys.stdout.write("unchanged\n")
+        else:
+            sys.stdout.write("installed %d object(s)\n" % count)
+    
+    def compile_plans(self, directory):
+        """
+        Writes the pending SQL migrations of each database to
+        ``<directory>/<database>.sql``, along with the ledger rows recording
+        them, so they can be applied with the database's own client.
+        """
+        all_migrations = get_pending_migrations(
+            self.path, self.databases, phase=self.phase
+        )
+        if not len(all_migrations):
+            print "There are no migrations to apply."
+            return
+        
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        for db, migrations in all_migrations.iteritems():
+            plan_path = os.path.join(directory, "%s.sql" % db)
+            with open(plan_path, "wb") as fp:
+                compiled = self._compile_plan(db, migrations, fp)
+            print "%s: compiled %d of %d migration(s) into %s" % (
+                db, compiled, len(migrations), plan_path
+            )
+            if compiled < len(migrations):
+                print "%s: %s and later migrations must be applied with " \
+                      "--execute" % (db, migrations[compiled])
+    
+    def _compile_plan(self, db, migrations, fp):
+        """
+        Writes the plan of ``db`` to ``fp``, stopping at the first migration
+        which is not SQL. Returns the number of migrations compiled.
+        
+        After each migration, a manifest line records its label, the MD5 of
+        the content written to the ledger and the models it creates, for
+        --mark-applied-from.
+        """
+        connection = connections[db]
+        vendor = connection.vendor
+        qn = connection.ops.quote_name
+        backslash_escapes = vendor == "mysql"
+        transactional = supports_transactional_ddl(connection)
+        clock = PLAN_CLOCK_SQL.get(vendor, "CURRENT_TIMESTAMP")
+        batch_size = self._get_insert_batch_size(connection)
+        
+        def quote(value):
+            return quote_sql_literal(value, backslash_escapes)
+        
+        def write(statement):
+            # a trailing comment would swallow the semicolon
+            if "--" in statement.rsplit("\n", 1)[-1]:
+                statement += "\n"
+            fp.write("%s;\n" % statement)
+        
+        def marker(text):
+            sql = "SELECT %s AS nashvegas, %s AS at" % (quote(text), clock)
+            if vendor == "oracle":
+                sql += " FROM dual"
+            write(sql)
+        
+        opts = Migration._meta
+        ledger = "INSERT INTO %s (%s) VALUES (%%s, %s, %%s, %%s, %%s)" % (
+            qn(opts.db_table),
+            ", ".join([
+                qn(opts.get_field(name).column)
+                for name in ["migration_label", "date_created", "content",
+                             "scm_version", "phase"]
+            ]),
+            clock
+        )
+        
+        fp.write("-- nashvegas plan for %r, compiled %s\n" % (db, now()))
+        if vendor == "postgresql":
+            fp.write("\\set ON_ERROR_STOP on\n")
+        elif vendor == "sqlite":
+            fp.write(".bail on\n")
+        if transactional:
+            write("BEGIN")
+        
+        compiled = 0
+        for migration in migrations:
+            name, ext, compression = split_migration_name(migration)
+            if ext != ".sql":
+                fp.write("\n-- stops before %s, which must be applied with "
+                         "upgradedb --execute\n" % migration)
+                break
+            
+            migration_path = self._get_migration_path(db, migration)
+            label = get_migration_label(migration)
+            if compression:
+                content = None
+                source = open_migration(migration_path)
+            else:
+                with open(migration_path, "rb") as source:
+                    content = source.read()
+                source = StringIO(content)
+            
+            fp.write("\n-- %s\n" % label)
+            marker("started %s" % label)
+            created_models = set()
+            digest = hashlib.md5()
+            try:
+                statements = iter_sql_statements(
+                    self._read_sql(source, created_models, digest),
+                    vendor
+                )
+                for sources, statement in batch_insert_statements(statements,
+                                                                  batch_size):
+                    write(statement)
+            finally:
+                source.close()
+            
+            if content is None:
+                content = describe_compressed_migration(
+                    migration_path,
+                    digest.hexdigest()
+                )
+            write(ledger % (
+                quote(label),
+                quote(content),
+                quote(self._get_rev(migration_path)),
+                quote(get_migration_phase(migration_path))
+            ))
+            marker("finished %s" % label)
+            if not transactional:
+                write("COMMIT")
+            
+            models = [
+                "%s.%s" % (m._meta.app_label, m._meta.object_name)
+                for m in created_models if m is not None
+            ]
+            fp.write("-- nashvegas-plan: %s %s %s\n" % (
+                label,
+                hashlib.md5(content).hexdigest(),
+                ",".join(sorted(models)) or "-"
+            ))
+            compiled += 1
+        
+        if transactional:
+            fp.write("\n")
+            write("COMMIT")
+        return compiled
+    
+    def mark_applied_from(self, directory):
+        """
+        Checks that the plans compiled into ``directory`` have been applied,
+        i.e. that the ledger of each database records every migration of its
+        plan with the content the plan wrote, then sends ``post_syncdb`` for
+        the models they created and loads initial_data as --execute would.
+        """
+        problems = []
+        for plan in sorted(os.listdir(directory)):
+            db, ext = os.path.splitext(plan)
+            if ext != ".sql" or db not in settings.DATABASES:
+                continue
+            if self.databases and db not in self.databases:
+                continue
+            
+            entries = []
+            with open(os.path.join(directory, plan), "rb") as fp:
+                for line in fp:
+                    match = PLAN_MANIFEST_RE.match(line.rstrip())
+                    if match is not None:
+                        entries.append(match.groups())
+            
+            applied = dict(
+                Migration.objects.using(db).filter(
+                    migration_label__in=[entry[0] for entry in entries]
+                ).values_list("migration_label", "content")
+            )
+            
+            missing = []
+            created_models = set()
+            for label, digest, models in entries:
+                if label not in applied:
+                    missing.append("%s: %s is not in the ledger" % (db, label))
+                    continue
+                content = applied[label].encode("utf-8")
+                if hashlib.md5(content).hexdigest() != digest:
+                    missing.append(
+                        "%s: %s in the ledger is not the migration that was "
+                        "compiled" % (db, label)
                     )
+                    continue
+                if models != "-":
+                    created_models.update([
+                        get_model(*model.split(".")) for model in
+                        models.split(",")
+                    ])
+            
+            if missing:
+                problems.extend(missing)
+                continue
             
+            print "%s: %d migration(s) applied from %s" % (
+                db, len(entries), plan
+            )
+            self._emit_post_sync(db, created_models)
             if self.load_initial_data:
-                sys.stdout.write(
-                    "Running loaddata for initial_data fixtures on %r.\n" % db
-                )
-                call_command(
-                    "loaddata",
-                    "initial_data",
-                    verbosity=self.verbosity,
-                    database=db,
+                self._load_initial_data(
+                    db, self._get_plan_tables(db, os.path.join(directory, plan))
                 )
+        
+        if problems:
+            raise CommandError(
+                "The plans have not been fully applied:\n%s" %
+                "\n".join(problems)
+            )
+    
+    def _get_plan_tables(self, db, path):
+        """
+        Returns the tables the statements of the plan at ``path`` touched.
+        """
+        tables = set()
+        with open(path, "rb") as fp:
+            for statement in iter_sql_statements(fp, connections[db].vendor):
+                table = get_touched_table(statement)
+                if table is not None:
+                    tables.add(table)
+        return tables
     
     def seed_migrations(self, stop_at=None):
         # @@@ the command-line interface needs to be re-thinked
@@ -341,12 +1968,13 @@ class Command(BaseCommand):
                 migration_path = self._get_migration_path(db, migration)
 
                 m, created = Migration.objects.using(db).get_or_create(
-                    migration_label=os.path.split(migration)[-1],
-                    content=open(migration_path, "rb").read()
+                    migration_label=get_migration_label(migration),
+                    content=get_migration_content(migration_path)
                 )
                 if created:
                     # this might have been executed prior to committing
                     m.scm_version = self._get_rev(migration)
+                    m.phase = get_migration_phase(migration_path)
                     m.save()
                     print "%s:%s has been seeded" % (db, m.migration_label)
                 else:
@@ -354,16 +1982,380 @@ class Command(BaseCommand):
                         db, m.migration_label
                     )
     
+    def check_fingerprints(self):
+        """
+        Compares the schema of each database with the fingerprint recorded
+        after its last migration. Where they differ, the migrations are
+        applied one by one to a scratch database until its fingerprint
+        differs from the one recorded for the same migration, which shows
+        where the two diverged.
+        """
+        drifted = []
+        for db in self.databases or get_capable_databases():
+            recorded = list(
+                Migration.objects.using(db).exclude(
+                    fingerprint=None
+                ).order_by("pk")
+            )
+            if not recorded:
+                print "%s: no fingerprints have been recorded" % db
+                continue
+            
+            last = recorded[-1]
+            if get_schema_fingerprint(db) == last.fingerprint:
+                print "%s: schema matches its fingerprint after %s" % (
+                    db, last.migration_label
+                )
+                continue
+            
+            drifted.append(db)
+            print "%s: schema differs from its fingerprint after %s" % (
+                db, last.migration_label
+            )
+            if is_memory_database(db):
+                print "%s: an in-memory database cannot be rebuilt to find " \
+                      "where it diverged" % db
+                continue
+            print "%s: rebuilding to find where it diverged..." % db
+            diverged = self._find_divergence(db, recorded)
+            if diverged is None:
+                print "%s: every migration matches, so the schema was " \
+                      "changed outside of migrations after %s" % (
+                          db, last.migration_label
+                      )
+            else:
+                print "%s: the schema diverged at %s" % (db, diverged)
+        
+        if drifted:
+            raise CommandError(
+                "The schema of %s has drifted" % ", ".join(drifted)
+            )
+    
+    def _find_divergence(self, db, recorded):
+        """
+        Returns the label of the first migration whose fingerprint on a
+        rebuilt database differs from the one ``recorded``, if any.
+        """
+        expected = dict([(m.migration_label, m.fingerprint) for m in recorded])
+        migrations = [
+            os.path.basename(migration_path)
+            for number, migration_path in get_all_migrations(
+                self.path, [db]
+            ).get(db, [])
+        ]
+        
+        with scratch_database(db):
+            self.init_nashvegas([db])
+            for migration in migrations:
+                label = get_migration_label(migration)
+                self._run_migration(db, migration,
+                                    self._get_migration_path(db, migration),
+                                    show_traceback=False)
+                if label not in expected:
+                    continue
+                if get_schema_fingerprint(db) != expected[label]:
+                    return label
+                if label == recorded[-1].migration_label:
+                    break
+        return None
+    
+    def rehearse_migrations(self, show_traceback=True):
+        """
+        Applies the pending migrations of each database to a scratch database
+        holding a copy of its schema, and of up to ``--sample-rows`` rows of
+        each of its tables, then reports how long each migration took. The
+        databases themselves are only read from. A shard group is rehearsed
+        on its first database.
+        """
+        all_migrations = get_pending_migrations(
+            self.path, self.databases, phase=self.phase
+        )
+        if not all_migrations:
+            print "There are no migrations to rehearse."
+            return
+        
+        shards = defaultdict(list)
+        databases = []
+        for db in sorted(all_migrations):
+            group = get_shard_group(db)
+            if group is not None:
+                shards[group].append(db)
+            else:
+                databases.append(db)
+        for group, members in shards.iteritems():
+            order = NASHVEGAS["shard_groups"][group]
+            databases.append(min(members, key=order.index))
+        
+        failed = []
+        for db in databases:
+            if is_memory_database(db):
+                print "Skipping %r: an in-memory database cannot be " \
+                      "rehearsed" % db
+                continue
+            migrations = all_migrations[db]
+            schema = get_schema_sql(db)
+            sample = self._sample_rows(db)
+            
+            timer = TimingRecorder()
+            self.hooks.append(timer)
+            start = time.time()
+            try:
+                with scratch_database(db) as name:
+                    print "Rehearsing %d migrations of %r on %r..." % (
+                        len(migrations), db, name
+                    )
+                    self._load_rehearsal(db, schema, sample)
+                    self.init_nashvegas([db])
+                    try:
+                        self.execute_database_migrations(db, migrations,
+                                                         show_traceback)
+                    except Exception:
+                        failed.append(db)
+                    finally:
+                        for thread in self.analyzers:
+                            thread.join()
+                        self.analyzers = []
+                        self.deferred = []
+            finally:
+                self.hooks.remove(timer)
+            
+            self._report_rehearsal(db, migrations, timer, time.time() - start)
+        
+        if failed:
+            raise CommandError("Rehearsal failed on %s" % ", ".join(failed))
+    
+    def _sample_rows(self, db):
+        """
+        Returns ``(table, columns, rows)`` with up to ``--sample-rows`` rows
+        of each table of ``db`` other than nashvegas' own.
+        """
+        if not self.sample_rows:
+            return []
+        
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        cursor = connection.cursor()
+        sample = []
+        for table in connection.introspection.table_names():
+            if table.lower().startswith(("nashvegas_", "sqlite_")):
+                continue
+            if connection.vendor == "oracle":
+                sql = "SELECT * FROM %s WHERE ROWNUM <= %d"
+            else:
+                sql = "SELECT * FROM %s LIMIT %d"
+            cursor.execute(sql % (qn(table), self.sample_rows))
+            columns = [column[0] for column in cursor.description]
+            sample.append((table, columns, cursor.fetchall()))
+        cursor.close()
+        return sample
+    
+    def _load_rehearsal(self, db, schema, sample):
+        """
+        Loads the schema and sample rows taken from ``db`` into the scratch
+        database it currently points at. Foreign keys are not enforced while
+        the sample is loaded where the backend allows, since the rows of
+        related tables are sampled independently; tables whose sample still
+        cannot be loaded are left empty.
+        """
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        with Transactional():
+            cursor = connection.cursor()
+            for statement in schema:
+                statement = get_loadable_statement(statement)
+                if statement is not None:
+                    cursor.execute(statement)
+        if not sample:
+            return
+        
+        checks = {
+            "postgresql": ("SET session_replication_role = replica",
+                           "SET session_replication_role = DEFAULT"),
+            "mysql": ("SET foreign_key_checks = 0",
+                      "SET foreign_key_checks = 1"),
+        }.get(connection.vendor)
+        if checks:
+            try:
+                with Transactional():
+                    connection.cursor().execute(checks[0])
+            except Exception, e:
+                print "Foreign keys remain enforced: %s" % e
+        
+        rows = 0
+        for table, columns, values in sample:
+            if not values:
+                continue
+            sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+                qn(table),
+                ", ".join([qn(column) for column in columns]),
+                ", ".join(["%s"] * len(columns))
+            )
+            try:
+                with Transactional():
+                    connection.cursor().executemany(sql, values)
+            except Exception, e:
+                print "Unable to load the sample of %s: %s" % (table, e)
+            else:
+                rows += len(values)
+        
+        if checks:
+            with Transactional():
+                connection.cursor().execute(checks[1])
+        print "Loaded %d sample rows." % rows
+    
+    def _report_rehearsal(self, db, migrations, timer, duration):
+        print "Rehearsal of %r:" % db
+        for migration in migrations:
+            label = get_migration_label(migration)
+            if (db, label) not in timer.migrations:
+                print "\t%s: not run" % migration
+                continue
+            
+            seconds, success = timer.migrations[db, label]
+            print "\t%s: %s%.1fs" % (
+                migration, not success and "failed after " or "", seconds
+            )
+            if self.verbosity > 1:
+                slowest = sorted(timer.statements[db, label], reverse=True)
+                for seconds, statement in slowest[:3]:
+                    print "\t\t%.3fs %s" % (
+                        seconds, " ".join(statement.split())[:70]
+                    )
+        print "\ttotal: %.1fs, including index builds, statistics and " \
+              "initial data" % duration
+    
+    def lint_migrations(self):
+        """
+        Reports the statements of pending SQL migrations which lock or
+        rewrite tables, failing if any high risk statement touches a table
+        of at least "lint_max_rows" rows.
+        """
+        all_migrations = get_pending_migrations(
+            self.path, self.databases, phase=self.phase
+        )
+        findings = 0
+        errors = 0
+        for db, migrations in all_migrations.iteritems():
+            connection = connections[db]
+            tables = set(connection.introspection.table_names())
+            counts = {}
+            
+            def row_count(table):
+                if table not in tables:
+                    return None
+                if table not in counts:
+                    counts[table] = get_estimated_row_count(table, using=db)
+                return counts[table]
+            
+            linter = Linter(connection.vendor, row_count)
+            for migration in migrations:
+                if split_migration_name(migration)[1] != ".sql":
+                    continue
+                migration_path = self._get_migration_path(db, migration)
+                defer_indexes = self._defers_indexes(migration_path)
+                fp = open_migration(migration_path)
+                try:
+                    statements = iter_sql_statements(
+                        self._read_sql(fp, set(), hashlib.md5()),
+                        connection.vendor
+                    )
+                    for number, statement in enumerate(statements):
+                        for finding in linter.lint_statement(statement,
+                                                             defer_indexes):
+                            print "%s: %s, statement %d: %s" % (
+                                db, migration, number + 1, unicode(finding)
+                            )
+                            print "\t%s" % finding.statement.splitlines()[0][:72]
+                            findings += 1
+                            errors += finding.is_error
+                finally:
+                    fp.close()
+            max_rows = linter.max_rows
+        
+        if not findings:
+            print "No risky statements found."
+        elif errors:
+            raise CommandError(
+                "%d high risk statement(s) on tables of %d rows or more" % (
+                    errors, max_rows
+                )
+            )
+    
     def list_migrations(self):
-        all_migrations = get_pending_migrations(self.path, self.databases)
+        databases, tenants = self._split_tenant_databases()
+        all_migrations = []
+        if databases:
+            all_migrations = [
+                (database, database, migrations)
+                for database, migrations in get_pending_migrations(
+                    self.path, databases, phase=self.phase
+                ).iteritems()
+            ]
+        for database in tenants:
+            possible_migrations = get_all_migrations(self.path, [database])
+            try:
+                for schema in get_tenant_schemas(database) or []:
+                    use_tenant_schema(database, schema)
+                    # listing leaves the ledger of a new tenant uncreated,
+                    # all its migrations being pending
+                    applied_migrations = None
+                    if not self._has_ledger(database):
+                        applied_migrations = {database: []}
+                    migrations = get_pending_migrations(
+                        self.path, [database], phase=self.phase,
+                        possible_migrations=possible_migrations,
+                        applied_migrations=applied_migrations
+                    ).get(database)
+                    if migrations:
+                        all_migrations.append((
+                            database, "%s/%s" % (database, schema), migrations
+                        ))
+            finally:
+                use_tenant_schema(database, None)
+        
         if len(all_migrations) == 0:
             print "There are no migrations to apply."
-            return
+        else:
+            print "Migrations to Apply:"
+            for database, name, migrations in all_migrations:
+                for script in migrations:
+                    phase = get_migration_phase(
+                        self._get_migration_path(database, script)
+                    )
+                    print "\t%s: %s%s" % (
+                        name,
+                        script,
+                        phase == "post" and " (post-deploy)" or ""
+                    )
         
-        print "Migrations to Apply:"
-        for database, migrations in all_migrations.iteritems():
-            for script in migrations:
-                print "\t%s: %s" % (database, script)
+        indexes = []
+        for database in databases:
+            indexes.extend([
+                (database, index)
+                for index in DeferredIndex.objects.using(database).filter(
+                    date_built__isnull=True
+                ).order_by("pk")
+            ])
+        if indexes:
+            print "Deferred Indexes to Build:"
+            for database, index in indexes:
+                print "\t%s: %s (%s)" % (
+                    database, index.name, index.migration_label
+                )
+    
+    def _has_ledger(self, database):
+        connection = connections[database]
+        converter = connection.introspection.table_name_converter
+        return converter(Migration._meta.db_table) in \
+            connection.introspection.table_names()
+    
+    def _parse_duration(self, value):
+        if value is None:
+            return None
+        match = DURATION_RE.match(value.strip())
+        if match is None:
+            raise CommandError("Invalid duration %r" % value)
+        return float(match.group(1)) * DURATION_UNITS[match.group(2)]
     
     def _get_default_migration_path(self):
         try:
@@ -385,7 +2377,30 @@ class Command(BaseCommand):
         self.do_execute = options.get("do_execute")
         self.do_create = options.get("do_create")
         self.do_create_all = options.get("do_create_all")
+        self.record_snapshot = options.get("record_snapshot")
         self.do_seed = options.get("do_seed")
+        self.do_build_indexes = options.get("do_build_indexes")
+        self.do_lint = options.get("do_lint")
+        self.do_fingerprint_check = options.get("do_fingerprint_check")
+        self.do_rehearse = options.get("do_rehearse")
+        self.sample_rows = options.get("sample_rows") or 0
+        self.resume = options.get("do_resume", False)
+        self.retrying = set()
+        self.started = time.time()
+        self.max_duration = self._parse_duration(options.get("max_duration"))
+        self.phase = options.get("phase")
+        if self.phase is not None:
+            if self.phase.lower() not in MIGRATION_PHASES:
+                raise CommandError("Invalid --phase %r (must be pre or post)"
+                                   % self.phase)
+            self.phase = MIGRATION_PHASES[self.phase.lower()]
+        self.deferred = []
+        self.rates = {}
+        self.touched = defaultdict(set)
+        self.analyzers = []
+        self.compile_plan = options.get("compile_plan")
+        self.mark_applied_from_path = options.get("mark_applied_from")
+        self.hooks = get_hooks()
         self.load_initial_data = options.get("load_initial_data", True)
         self.args = args
         
@@ -409,17 +2424,41 @@ class Command(BaseCommand):
         if self.do_create and self.do_create_all:
             raise CommandError("You cannot combine --create and --create-all")
         
-        self.init_nashvegas()
-        
         if self.do_create_all:
             self.create_all_migrations()
         elif self.do_create:
             assert len(self.databases) == 1
             self.create_migrations(self.databases[0])
         
+        # migrations are created from the model snapshots, without touching
+        # the ledger
+        if self.do_create or self.do_create_all:
+            return
+        
+        self.init_nashvegas()
+        
+        if self.do_fingerprint_check:
+            self.check_fingerprints()
+        
+        if self.do_lint:
+            self.lint_migrations()
+        
+        if self.do_rehearse:
+            self.rehearse_migrations()
+        
         if self.do_execute:
             self.execute_migrations()
         
+        if self.do_build_indexes:
+            for database in self.databases or get_capable_databases():
+                self.build_deferred_indexes(database)
+        
+        if self.compile_plan:
+            self.compile_plans(self.compile_plan)
+        
+        if self.mark_applied_from_path:
+            self.mark_applied_from(self.mark_applied_from_path)
+        
         if self.do_list:
             self.list_migrations()
         
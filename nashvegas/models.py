@@ -10,10 +10,73 @@ except ImportError:
 
 class Migration(models.Model):
     
-    migration_label = models.CharField(max_length=200)
+    migration_label = models.CharField(max_length=200, db_index=True)
     date_created = models.DateTimeField(default=now)
     content = models.TextField()
     scm_version = models.CharField(max_length=50, null=True, blank=True)
+    fingerprint = models.CharField(max_length=32, null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    phase = models.CharField(max_length=4, null=True, blank=True)
     
     def __unicode__(self):
         return unicode("%s [%s]" % (self.migration_label, self.scm_version))
+
+
+class MigrationCheckpoint(models.Model):
+    
+    migration_label = models.CharField(max_length=200, unique=True)
+    statements_applied = models.IntegerField(default=0)
+    statements_hash = models.CharField(max_length=32)
+    date_updated = models.DateTimeField(default=now)
+    
+    def __unicode__(self):
+        return unicode("%s [%d statements]" % (
+            self.migration_label, self.statements_applied
+        ))
+
+
+class FixtureDigest(models.Model):
+    
+    name = models.CharField(max_length=200, unique=True)
+    digest = models.CharField(max_length=32)
+    date_updated = models.DateTimeField(default=now)
+    
+    def __unicode__(self):
+        return unicode("%s [%s]" % (self.name, self.digest))
+
+
+class DeferredIndex(models.Model):
+    
+    migration_label = models.CharField(max_length=200, db_index=True)
+    name = models.CharField(max_length=200)
+    statement = models.TextField()
+    date_created = models.DateTimeField(default=now)
+    date_built = models.DateTimeField(null=True, blank=True)
+    
+    def __unicode__(self):
+        return unicode("%s [%s]" % (self.name, self.migration_label))
+
+
+class MigrationAttempt(models.Model):
+    
+    migration_label = models.CharField(max_length=200, db_index=True)
+    attempt = models.IntegerField()
+    error = models.TextField()
+    date_created = models.DateTimeField(default=now)
+    outcome = models.CharField(max_length=20, null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    
+    def __unicode__(self):
+        return unicode("%s [attempt %d]" % (
+            self.migration_label, self.attempt
+        ))
+
+
+class MigrationLock(models.Model):
+    
+    name = models.CharField(max_length=200, unique=True)
+    owner = models.CharField(max_length=200)
+    date_acquired = models.DateTimeField(default=now)
+    
+    def __unicode__(self):
+        return unicode("%s [%s]" % (self.name, self.owner))
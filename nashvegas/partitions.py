@@ -0,0 +1,205 @@
+import traceback
+
+from django.db import connections, transaction
+from django.db.models import Min, Max
+
+from nashvegas.tenants import use_tenant_schema
+
+
+class Partition(object):
+    """
+    A slice of the rows a partitioned Python migration works through. The
+    migration's ``migrate(partition)`` restricts its querysets to the slice
+    with ``partition.filter(queryset)``; ``partition.using`` is the database
+    being migrated.
+    """
+
+    using = None
+
+    def filter(self, queryset):
+        raise NotImplementedError
+
+
+class KeyRange(Partition):
+    """
+    The rows whose primary key is in ``[start, end)``.
+    """
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def filter(self, queryset):
+        return queryset.filter(pk__gte=self.start, pk__lt=self.end)
+
+    def __repr__(self):
+        return "<KeyRange %r-%r>" % (self.start, self.end)
+
+
+class Remainder(Partition):
+    """
+    The rows whose primary key leaves ``remainder`` when divided by
+    ``divisor``.
+    """
+
+    def __init__(self, remainder, divisor):
+        self.remainder = remainder
+        self.divisor = divisor
+
+    def filter(self, queryset):
+        connection = connections[queryset.db]
+        column = "%s.%s" % (
+            connection.ops.quote_name(queryset.model._meta.db_table),
+            connection.ops.quote_name(queryset.model._meta.pk.column)
+        )
+        if connection.vendor == "sqlite":
+            # no MOD(); % is doubled for the parameter substitution
+            where = "%s %%%% %%s = %%s" % column
+        else:
+            where = "MOD(%s, %%s) = %%s" % column
+        return queryset.extra(
+            where=[where],
+            params=[self.divisor, self.remainder]
+        )
+
+    def __repr__(self):
+        return "<Remainder %d of %d>" % (self.remainder, self.divisor)
+
+
+class KeyRanges(object):
+    """
+    Partitions ``model``'s rows into ranges of primary keys, either ``size``
+    keys wide or ``count`` of them spanning the keys in use.
+
+    A Python migration declares its partitioning in a module level
+    ``partitions``::
+
+        from nashvegas.partitions import KeyRanges
+        from store.models import Product
+
+        partitions = KeyRanges(Product, size=100000)
+
+        def migrate(partition):
+            products = partition.filter(Product.objects.using(partition.using))
+            ...
+    """
+
+    def __init__(self, model, size=None, count=None):
+        if (size is None) == (count is None):
+            raise ValueError("KeyRanges takes either a size or a count")
+        self.model = model
+        self.size = size
+        self.count = count
+
+    def get_partitions(self, using):
+        keys = self.model._default_manager.using(using).aggregate(
+            start=Min("pk"),
+            end=Max("pk")
+        )
+        if keys["start"] is None:
+            return []
+        start, end = keys["start"], keys["end"] + 1
+
+        size = self.size
+        if size is None:
+            size = max(1, -(-(end - start) // self.count))
+        return [
+            KeyRange(key, min(key + size, end))
+            for key in range(start, end, size)
+        ]
+
+
+class Remainders(object):
+    """
+    Partitions rows into ``count`` partitions by the remainder of their
+    primary key, for keys too sparse to split into even ranges.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def get_partitions(self, using):
+        return [Remainder(i, self.count) for i in range(self.count)]
+
+
+_modules = {}
+# The connections inherited from the parent process share its sockets.
+# Closing them, even by garbage collection, would end the parent's sessions
+# (MySQLdb and libpq say goodbye to the server), so they are kept referenced
+# until the worker exits without closing them.
+_inherited = []
+
+
+def init_worker(schemas=None, timeouts=None):
+    """
+    Sets aside the connections inherited from the parent process, so that
+    each worker opens connections of its own rather than sharing the
+    parent's, pointed at the parent's tenant ``schemas`` and with the
+    migration's ``timeouts``, the statements setting them on each database.
+    """
+    for alias in connections:
+        if connections[alias].connection is not None:
+            _inherited.append(connections[alias].connection)
+        connections[alias].connection = None
+    for alias, schema in (schemas or {}).items():
+        use_tenant_schema(alias, schema)
+    for alias, statements in (timeouts or {}).items():
+        cursor = connections[alias].cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+        transaction.commit_unless_managed(using=alias)
+
+
+def _get_migrate(path):
+    if path not in _modules:
+        module = {}
+        execfile(path, module)
+        _modules[path] = module
+    return _modules[path]["migrate"]
+
+
+def run_partition(args):
+    """
+    Runs ``migrate(partition)`` of the Python migration at ``path`` in a
+    transaction of its own. Returns ``(partition, result, error)``, where
+    ``error`` is the formatted traceback of a failed partition.
+    """
+    path, database, partition = args
+    migrate = _get_migrate(path)
+
+    partition.using = database
+    transaction.enter_transaction_management(using=database)
+    transaction.managed(True, using=database)
+    try:
+        try:
+            result = migrate(partition)
+        except Exception:
+            transaction.rollback(using=database)
+            return partition, None, traceback.format_exc()
+        transaction.commit(using=database)
+    finally:
+        transaction.leave_transaction_management(using=database)
+    return partition, result, None
+
+
+def run_partition_in_savepoint(args):
+    """
+    Runs a partition like ``run_partition``, but in a savepoint of the
+    transaction the migrating process is in rather than a transaction of
+    its own, which would commit or roll back the rest of the migration.
+    Without savepoints (SQLite) a failed partition is rolled back with the
+    migration.
+    """
+    path, database, partition = args
+    migrate = _get_migrate(path)
+
+    partition.using = database
+    sid = transaction.savepoint(using=database)
+    try:
+        result = migrate(partition)
+    except Exception:
+        transaction.savepoint_rollback(sid, using=database)
+        return partition, None, traceback.format_exc()
+    transaction.savepoint_commit(sid, using=database)
+    return partition, result, None
@@ -0,0 +1,101 @@
+import threading
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from nashvegas.exceptions import MigrationError
+
+
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
+
+_local = threading.local()
+
+
+def get_tenant_schemas(using):
+    """
+    Returns the tenant schemas of ``using`` listed in the "tenant_schemas"
+    setting, either by name or as a ``LIKE`` pattern of the schemas to
+    discover, or ``None`` if ``using`` has no tenants.
+    """
+    schemas = NASHVEGAS.get("tenant_schemas", {}).get(using)
+    if schemas is None:
+        return None
+    
+    connection = connections[using]
+    if connection.vendor != "postgresql":
+        raise MigrationError(
+            "Tenant schemas are only supported on PostgreSQL, not on %r" %
+            using
+        )
+    if isinstance(schemas, basestring):
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT nspname FROM pg_namespace WHERE nspname LIKE %s "
+            "ORDER BY nspname",
+            [schemas]
+        )
+        schemas = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return list(schemas)
+
+
+def get_tenant_schema(using):
+    """
+    Returns the tenant schema the current thread's connection to ``using``
+    is pointed at, or ``None``.
+    """
+    return getattr(_local, "schemas", {}).get(using)
+
+
+def _set_search_path(connection, schema):
+    cursor = connection.connection.cursor()
+    if schema is None:
+        cursor.execute("SET search_path TO DEFAULT")
+    else:
+        cursor.execute(
+            "SET search_path TO %s" % connection.ops.quote_name(schema)
+        )
+    cursor.close()
+    connection.connection.commit()
+
+
+def use_tenant_schema(using, schema):
+    """
+    Points the current thread's connection to ``using`` at ``schema`` alone,
+    so that the tenant's tables and ledger are the only ones it sees, or
+    back at the default search_path for ``None``. The connections the thread
+    opens later are pointed at it as they are made.
+    """
+    if not hasattr(_local, "schemas"):
+        _local.schemas = {}
+    if schema is None:
+        _local.schemas.pop(using, None)
+    else:
+        _local.schemas[using] = schema
+    
+    connection = connections[using]
+    if connection.connection is not None:
+        _set_search_path(connection, schema)
+
+
+def inherit_tenant_schemas(target):
+    """
+    Wraps the ``target`` of a thread so that it uses the tenant schemas of
+    the thread starting it.
+    """
+    schemas = dict(getattr(_local, "schemas", {}))
+    
+    def run(*args, **kwargs):
+        _local.schemas = schemas
+        return target(*args, **kwargs)
+    return run
+
+
+def _connection_created(sender, connection, **kwargs):
+    schema = get_tenant_schema(connection.alias)
+    if schema is not None:
+        _set_search_path(connection, schema)
+
+
+connection_created.connect(_connection_created)
@@ -1,8 +1,16 @@
+import gzip
+import hashlib
+import io
 import itertools
+import json
+import math
 import os.path
 import re
 
 from collections import defaultdict
+from contextlib import contextmanager
+from subprocess import PIPE, Popen
+from django.conf import settings
 from django.core.management.color import no_style
 from django.core.management.sql import custom_sql_for_model
 from django.db import connections, router, models, DEFAULT_DB_ALIAS
@@ -10,17 +18,92 @@ from django.utils.datastructures import SortedDict
 from nashvegas.exceptions import MigrationError
 from nashvegas.models import Migration
 
+NASHVEGAS = getattr(settings, "NASHVEGAS", {})
 MIGRATION_NAME_RE = re.compile(r"(\d+)(.*)")
+SQL_TOKEN_RE = re.compile(r"--|/\*|['\"`;$]")
+MYSQL_TOKEN_RE = re.compile(r"--|/\*|#|['\"`;$]")
+# the E of a PostgreSQL escape string constant, just before its quote
+E_STRING_RE = re.compile(r"(?<![\w$])[Ee]$")
+# settings of the session a schema dump was taken in
+DUMP_SESSION_RE = re.compile(
+    r"^(?:SET\s|SELECT\s+pg_catalog\.set_config\s*\()",
+    re.IGNORECASE
+)
+DOLLAR_QUOTE_RE = re.compile(r"\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$")
+DIRECTIVE_RE = re.compile(r"^(?:--|#)\s*nashvegas:(.*)$")
+INSERT_VALUES_RE = re.compile(
+    r"^INSERT\s+INTO\s+([^\s(]+)\s*(\([^)]*\))?\s*VALUES\s*(\(.*\))$",
+    re.IGNORECASE | re.DOTALL
+)
+# plain (non-unique) index builds, which later statements cannot depend on
+CREATE_INDEX_RE = re.compile(
+    r"^(\s*CREATE\s+INDEX)\s+(CONCURRENTLY\s+)?(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"([`\"]?)([\w$]+)\3\s+ON\b",
+    re.IGNORECASE
+)
+# errors raised when a lock could not be acquired in time
+LOCK_TIMEOUT_RE = re.compile(
+    r"lock timeout|lock wait timeout exceeded|database is locked|"
+    r"ORA-00054|ORA-30006",
+    re.IGNORECASE
+)
+# statements which change a table's contents or shape
+TOUCHED_TABLE_RE = re.compile(
+    r"^(?:INSERT\s+(?:IGNORE\s+)?INTO|REPLACE\s+INTO|UPDATE(?:\s+ONLY)?|"
+    r"DELETE\s+FROM(?:\s+ONLY)?|TRUNCATE(?:\s+TABLE)?|COPY|"
+    r"(?:CREATE|ALTER)\s+TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?(?:\s+ONLY)?|"
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX(?:\s+CONCURRENTLY)?"
+    r"(?:\s+IF\s+NOT\s+EXISTS)?\s+[`\"\w$]+\s+ON(?:\s+ONLY)?)"
+    r"\s+([`\"\w$.]+)",
+    re.IGNORECASE
+)
 
+# Data migrations are delimited files loaded straight into a table
+DATA_MIGRATION_DELIMITERS = {
+    ".csv": ",",
+    ".tsv": "\t",
+}
+MIGRATION_EXTENSIONS = [".sql", ".py"] + DATA_MIGRATION_DELIMITERS.keys()
+# SQL and data migrations may be compressed, and are decompressed as they
+# are read
+COMPRESSION_EXTENSIONS = [".gz", ".zst"]
+COMPRESSIBLE_EXTENSIONS = [".sql"] + DATA_MIGRATION_DELIMITERS.keys()
 
-def get_sql_for_new_models(apps=None, using=DEFAULT_DB_ALIAS):
+# The state of the models migrations have been created for, kept next to the
+# migrations of each database
+MODEL_SNAPSHOT_NAME = "models.json"
+MODEL_SNAPSHOT_VERSION = 1
+
+# Expand migrations run before the new code is deployed and contract ones
+# after it has taken traffic
+MIGRATION_PHASES = {
+    "pre": "pre",
+    "pre-deploy": "pre",
+    "expand": "pre",
+    "post": "post",
+    "post-deploy": "post",
+    "contract": "post",
+}
+
+# Backends which implicitly commit DDL and so cannot roll back a partially
+# applied migration.
+NON_TRANSACTIONAL_DDL_VENDORS = ["mysql", "oracle"]
+
+
+def get_sql_for_new_models(apps=None, using=DEFAULT_DB_ALIAS, tables=None):
     """
     Unashamedly copied and tweaked from django.core.management.commands.syncdb
+    
+    Models are new unless their table is in ``tables``, which defaults to the
+    tables introspected from the database.
     """
     connection = connections[using]
     
     # Get a list of already installed *models* so that references work right.
-    tables = connection.introspection.table_names()
+    if tables is None:
+        tables = connection.introspection.table_names()
+    else:
+        tables = map(connection.introspection.table_name_converter, tables)
     seen_models = connection.introspection.installed_models(tables)
     created_models = set()
     pending_references = {}
@@ -121,6 +204,924 @@ def get_sql_for_new_models(apps=None, using=DEFAULT_DB_ALIAS):
     return statements
 
 
+def get_model_tables(apps=None, using=DEFAULT_DB_ALIAS):
+    """
+    Returns a dictionary of "app_label.ModelName" => table of the installed
+    models, including automatically created many-to-many tables, which are
+    synchronized to ``using``.
+    """
+    if apps:
+        apps = [models.get_app(a) for a in apps]
+    else:
+        apps = models.get_apps()
+    
+    tables = {}
+    for app in apps:
+        for model in models.get_models(app, include_auto_created=True):
+            if router.allow_syncdb(using, model):
+                opts = model._meta
+                tables["%s.%s" % (opts.app_label, opts.object_name)] = \
+                    opts.db_table
+    return tables
+
+
+def read_model_snapshot(path):
+    """
+    Returns the "app_label.ModelName" => table mapping of the model snapshot
+    in the migration directory ``path``, or ``None`` if there is none yet.
+    """
+    snapshot_path = os.path.join(path, MODEL_SNAPSHOT_NAME)
+    if not os.path.exists(snapshot_path):
+        return None
+    
+    with open(snapshot_path) as fp:
+        snapshot = json.load(fp)
+    if snapshot.get("version") != MODEL_SNAPSHOT_VERSION:
+        raise MigrationError(
+            "Unsupported model snapshot version %r in %r" % (
+                snapshot.get("version"), snapshot_path
+            )
+        )
+    return snapshot["models"]
+
+
+def write_model_snapshot(path, tables):
+    """
+    Writes the "app_label.ModelName" => table mapping ``tables`` as the model
+    snapshot of the migration directory ``path``.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    
+    with open(os.path.join(path, MODEL_SNAPSHOT_NAME), "w") as fp:
+        json.dump({
+            "version": MODEL_SNAPSHOT_VERSION,
+            "models": tables,
+        }, fp, indent=2, sort_keys=True, separators=(",", ": "))
+        fp.write("\n")
+
+
+def _find_unescaped(line, closing, pos):
+    """
+    Returns the position of ``closing`` in ``line`` from ``pos`` on, skipping
+    backslash escapes, which may escape a backslash themselves.
+    """
+    while True:
+        end = line.find(closing, pos)
+        escape = line.find("\\", pos)
+        if end == -1 or escape == -1 or end < escape:
+            return end
+        pos = escape + 2
+
+
+def iter_sql_statements(lines, vendor=None):
+    """
+    Splits an iterable of SQL lines into individual statements.
+    
+    Statements end at a ``;`` which is not inside a quoted string, a
+    comment or a PostgreSQL dollar-quoted body. Lines are consumed lazily
+    so that large migrations never have to be held in memory at once, and
+    statements made up only of comments are skipped.
+    
+    On MySQL, backslashes escape the next character of any quoted string and
+    ``#`` starts a comment; elsewhere backslashes only escape within
+    PostgreSQL's ``E'...'`` strings.
+    """
+    mysql = vendor == "mysql"
+    token_re = mysql and MYSQL_TOKEN_RE or SQL_TOKEN_RE
+    buf = []
+    has_content = False
+    # the string that closes the quote or comment we are in, if any, and
+    # whether backslashes escape within it
+    closing = None
+    escapes = False
+    
+    for line in lines:
+        pos = 0
+        length = len(line)
+        while pos < length:
+            if closing is not None:
+                if escapes:
+                    end = _find_unescaped(line, closing, pos)
+                else:
+                    end = line.find(closing, pos)
+                if end == -1:
+                    buf.append(line[pos:])
+                    break
+                end += len(closing)
+                buf.append(line[pos:end])
+                pos = end
+                closing = None
+                continue
+            
+            match = token_re.search(line, pos)
+            if match is None:
+                chunk = line[pos:]
+                buf.append(chunk)
+                has_content = has_content or bool(chunk.strip())
+                break
+            
+            chunk = line[pos:match.start()]
+            buf.append(chunk)
+            has_content = has_content or bool(chunk.strip())
+            token = match.group(0)
+            pos = match.end()
+            
+            if token == ";":
+                if has_content:
+                    yield "".join(buf).strip()
+                buf = []
+                has_content = False
+            elif token in ("--", "#"):
+                buf.append(line[match.start():])
+                break
+            elif token == "/*":
+                buf.append(token)
+                closing = "*/"
+                escapes = False
+            elif token == "$":
+                dollar = DOLLAR_QUOTE_RE.match(line, match.start())
+                buf.append(token)
+                has_content = True
+                if dollar is not None:
+                    buf.append(line[pos:dollar.end()])
+                    pos = dollar.end()
+                    closing = dollar.group(0)
+                    escapes = False
+            else:
+                buf.append(token)
+                has_content = True
+                closing = token
+                escapes = mysql or (
+                    token == "'" and
+                    E_STRING_RE.search(
+                        line, max(0, match.start() - 1), match.start()
+                    ) is not None
+                )
+    
+    if has_content:
+        yield "".join(buf).strip()
+
+
+def get_migration_directives(lines):
+    """
+    Parses the directives in the header of a migration, i.e. the leading
+    comment lines of the form::
+    
+        -- nashvegas: name=value, flag
+    
+    (``#`` starts the comment in Python and data migrations). Returns a
+    dictionary of names to values, ``True`` for bare flags. Stops at the
+    first line that is not a comment so only the header is ever read.
+    """
+    directives = {}
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if not (stripped.startswith("--") or stripped.startswith("#")):
+            break
+        
+        match = DIRECTIVE_RE.match(stripped)
+        if match is None:
+            continue
+        for directive in match.group(1).split(","):
+            name, sep, value = directive.partition("=")
+            name = name.strip()
+            if name:
+                directives[name] = sep and value.strip() or True
+    return directives
+
+
+def split_migration_name(script):
+    """
+    Splits a migration's file name into its name, extension and compression
+    extension (``None`` when it is not compressed), e.g.
+    ``("0005_seed", ".sql", ".gz")`` for ``0005_seed.sql.gz``.
+    """
+    name, ext = os.path.splitext(os.path.split(script)[-1])
+    compression = None
+    if ext in COMPRESSION_EXTENSIONS:
+        compression = ext
+        name, ext = os.path.splitext(name)
+    return name, ext, compression
+
+
+def get_migration_label(script):
+    """
+    Returns the name a migration is recorded under in the ledger, which
+    leaves out any compression extension.
+    """
+    name, ext, compression = split_migration_name(script)
+    return name + ext
+
+
+def open_migration(path):
+    """
+    Opens a migration for reading, decompressing it on the fly if needed.
+    """
+    compression = split_migration_name(path)[2]
+    if compression == ".gz":
+        return gzip.open(path, "rb")
+    elif compression == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise MigrationError("The zstandard package is required to "
+                                 "read %r" % path)
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        )
+    return open(path, "rb")
+
+
+def read_data_header(fp):
+    """
+    Reads the header of a data migration: its leading comments and the row
+    of column names that follows them.
+    """
+    header = []
+    for line in iter(fp.readline, ""):
+        header.append(line)
+        if line.strip() and not line.lstrip().startswith("#"):
+            break
+    return header
+
+
+def describe_compressed_migration(path, digest):
+    """
+    Returns what the ledger records as the content of a compressed
+    migration, which is too large to store in full.
+    """
+    return "-- %s: compressed migration, md5 %s\n" % (
+        os.path.split(path)[-1], digest
+    )
+
+
+def get_migration_content(path):
+    """
+    Returns what the ledger records as the content of the migration at
+    ``path``.
+    """
+    name, ext, compression = split_migration_name(path)
+    fp = open_migration(path)
+    try:
+        if ext in DATA_MIGRATION_DELIMITERS:
+            return "".join(read_data_header(fp))
+        if compression:
+            digest = hashlib.md5()
+            for chunk in iter(lambda: fp.read(65536), ""):
+                digest.update(chunk)
+            return describe_compressed_migration(path, digest.hexdigest())
+        return fp.read()
+    finally:
+        fp.close()
+
+
+def read_migration_directives(path):
+    """
+    Returns the directives in the header of the migration at ``path``.
+    """
+    fp = open_migration(path)
+    try:
+        return get_migration_directives(fp)
+    finally:
+        fp.close()
+
+
+def get_migration_phase(path):
+    """
+    Returns the deploy phase, ``"pre"`` or ``"post"``, of the migration at
+    ``path`` from its ``phase`` directive. Migrations without one run before
+    the deploy.
+    """
+    phase = read_migration_directives(path).get("phase", "pre")
+    if phase is True or phase.lower() not in MIGRATION_PHASES:
+        raise MigrationError(
+            "Invalid phase %r in %r (must be pre or post)" % (phase, path)
+        )
+    return MIGRATION_PHASES[phase.lower()]
+
+
+def is_values_list(sql):
+    """
+    Returns whether ``sql`` is nothing but a comma separated list of
+    parenthesised rows, e.g. ``(1, 'a'), (2, 'b')``.
+    """
+    depth = 0
+    quote = None
+    expect_row = True
+    for char in sql:
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "(":
+            if depth == 0 and not expect_row:
+                return False
+            depth += 1
+            expect_row = False
+        elif char == ")":
+            depth -= 1
+            if depth < 0:
+                return False
+        elif depth == 0:
+            if char == "," and not expect_row:
+                expect_row = True
+            elif not char.isspace():
+                return False
+    return depth == 0 and quote is None and not expect_row
+
+
+def batch_insert_statements(statements, batch_size):
+    """
+    Coalesces runs of ``INSERT ... VALUES`` statements into the same table
+    and columns into multi-row inserts of up to ``batch_size`` statements.
+    
+    Yields ``(sources, sql)`` tuples where ``sources`` lists the original
+    statements that ``sql`` executes.
+    """
+    batch = []
+    batch_key = None
+    rows = []
+    
+    for statement in statements:
+        match = None
+        if batch_size > 1:
+            match = INSERT_VALUES_RE.match(statement)
+        if match is not None and not is_values_list(match.group(3)):
+            match = None
+        
+        key = None
+        if match is not None:
+            key = (match.group(1).lower(),
+                   " ".join((match.group(2) or "").split()))
+        
+        if batch and (key != batch_key or len(batch) >= batch_size):
+            yield batch, _join_insert(batch, batch_key, rows)
+            batch, batch_key, rows = [], None, []
+        
+        if key is None:
+            yield [statement], statement
+        else:
+            batch.append(statement)
+            batch_key = key
+            rows.append(match.group(3))
+    
+    if batch:
+        yield batch, _join_insert(batch, batch_key, rows)
+
+
+def _join_insert(batch, key, rows):
+    if len(batch) == 1:
+        return batch[0]
+    match = INSERT_VALUES_RE.match(batch[0])
+    return "INSERT INTO %s %sVALUES %s" % (
+        match.group(1),
+        match.group(2) and match.group(2) + " " or "",
+        ", ".join(rows),
+    )
+
+
+def _strip_leading_comments(statement):
+    lines = statement.splitlines()
+    while lines and (not lines[0].strip() or
+                     lines[0].strip().startswith("--")):
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def get_index_name(statement):
+    """
+    Returns the name of the index created by a plain ``CREATE INDEX``
+    statement, or ``None`` for any other statement, including ``CREATE
+    UNIQUE INDEX``.
+    """
+    match = CREATE_INDEX_RE.match(_strip_leading_comments(statement))
+    return match and match.group(4) or None
+
+
+def make_concurrent_index(statement):
+    """
+    Rewrites a plain ``CREATE INDEX`` statement as PostgreSQL's
+    ``CREATE INDEX CONCURRENTLY``.
+    """
+    statement = _strip_leading_comments(statement)
+    match = CREATE_INDEX_RE.match(statement)
+    if match is None or match.group(2):
+        return statement
+    return "%s CONCURRENTLY %s" % (
+        match.group(1),
+        statement[match.end(1):].lstrip()
+    )
+
+
+def quote_sql_literal(value, backslash_escapes=False):
+    """
+    Returns ``value`` as a SQL string literal, or ``NULL`` for ``None``.
+    Backslashes are doubled for databases which treat them as escapes.
+    """
+    if value is None:
+        return "NULL"
+    if backslash_escapes:
+        value = value.replace("\\", "\\\\")
+    return "'%s'" % value.replace("'", "''")
+
+
+def get_touched_table(statement):
+    """
+    Returns the unquoted name of the table a statement inserts into,
+    updates, deletes from, creates, alters or indexes, or ``None``.
+    """
+    match = TOUCHED_TABLE_RE.match(
+        _strip_leading_comments(statement).lstrip()
+    )
+    if match is None:
+        return None
+    return match.group(1).split(".")[-1].strip("`\"")
+
+
+def get_analyze_sql(connection, tables):
+    """
+    Returns the statements refreshing the planner statistics of ``tables``.
+    """
+    qn = connection.ops.quote_name
+    if connection.vendor == "mysql":
+        return ["ANALYZE TABLE %s" % ", ".join([qn(t) for t in tables])]
+    if connection.vendor == "oracle":
+        # introspection lower cases Oracle's table names
+        return [
+            "BEGIN DBMS_STATS.GATHER_TABLE_STATS(USER, %s); END;" %
+            quote_sql_literal(table.upper())
+            for table in tables
+        ]
+    return ["ANALYZE %s" % qn(table) for table in tables]
+
+
+def supports_transactional_ddl(connection):
+    """
+    Returns whether schema changes on ``connection`` are rolled back along
+    with the rest of a failed transaction.
+    """
+    return connection.vendor not in NON_TRANSACTIONAL_DDL_VENDORS
+
+
+def get_timeout_sql(connection, lock_timeout=None, statement_timeout=None):
+    """
+    Returns the statements setting the lock and statement timeouts, in
+    seconds, of ``connection``'s session, and those restoring them. Backends
+    without a statement timeout ignore it.
+    """
+    vendor = connection.vendor
+    set_sql = []
+    reset_sql = []
+    if vendor == "postgresql":
+        if lock_timeout is not None:
+            set_sql.append("SET lock_timeout = '%dms'" % (lock_timeout * 1000))
+            reset_sql.append("RESET lock_timeout")
+        if statement_timeout is not None:
+            set_sql.append(
+                "SET statement_timeout = '%dms'" % (statement_timeout * 1000)
+            )
+            reset_sql.append("RESET statement_timeout")
+    elif vendor == "mysql" and lock_timeout is not None:
+        # metadata locks and row locks are waited for separately
+        seconds = max(1, int(math.ceil(lock_timeout)))
+        set_sql.append(
+            "SET SESSION lock_wait_timeout = %d, "
+            "innodb_lock_wait_timeout = %d" % (seconds, seconds)
+        )
+        reset_sql.append(
+            "SET SESSION lock_wait_timeout = DEFAULT, "
+            "innodb_lock_wait_timeout = DEFAULT"
+        )
+    elif vendor == "sqlite" and lock_timeout is not None:
+        default = connection.settings_dict["OPTIONS"].get("timeout", 5)
+        set_sql.append("PRAGMA busy_timeout = %d" % (lock_timeout * 1000))
+        reset_sql.append("PRAGMA busy_timeout = %d" % (default * 1000))
+    elif vendor == "oracle" and lock_timeout is not None:
+        set_sql.append(
+            "ALTER SESSION SET ddl_lock_timeout = %d" %
+            max(1, int(math.ceil(lock_timeout)))
+        )
+        reset_sql.append("ALTER SESSION SET ddl_lock_timeout = 0")
+    return set_sql, reset_sql
+
+
+def is_lock_timeout(exc):
+    """
+    Returns whether a database error was raised because a lock could not be
+    acquired within the lock timeout.
+    """
+    if exc.args and exc.args[0] == 1205:
+        # MySQL's ER_LOCK_WAIT_TIMEOUT
+        return True
+    # the message may be bytes in the database's encoding
+    return LOCK_TIMEOUT_RE.search(repr(exc.args)) is not None
+
+
+def get_estimated_row_count(table, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the number of rows in ``table`` as estimated by the database's
+    statistics, or ``None`` where the backend keeps no such estimate.
+    """
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        sql = "SELECT reltuples FROM pg_class WHERE oid = %s::regclass"
+    elif connection.vendor == "mysql":
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+    else:
+        return None
+    
+    cursor = connection.cursor()
+    cursor.execute(sql, [table])
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def get_secondary_indexes(table, using=DEFAULT_DB_ALIAS):
+    """
+    Returns ``(name, drop, create)`` for the non-unique indexes and foreign
+    keys of ``table``, with the statements dropping and recreating each, for
+    a bulk load to do without them. Foreign keys come first, since MySQL
+    cannot drop the index a foreign key uses. Only PostgreSQL, MySQL and
+    SQLite are supported, and SQLite's foreign keys cannot be dropped.
+    """
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    results = []
+    
+    if connection.vendor == "postgresql":
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f' "
+            "ORDER BY conname",
+            [table]
+        )
+        for name, definition in cursor.fetchall():
+            results.append((
+                name,
+                "ALTER TABLE %s DROP CONSTRAINT %s" % (qn(table), qn(name)),
+                "ALTER TABLE %s ADD CONSTRAINT %s %s" % (
+                    qn(table), qn(name), definition
+                ),
+            ))
+        
+        cursor.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND NOT i.indisunique "
+            "AND NOT i.indisprimary ORDER BY c.relname",
+            [table]
+        )
+        for name, definition in cursor.fetchall():
+            results.append((name, "DROP INDEX %s" % qn(name), definition))
+    
+    elif connection.vendor == "mysql":
+        cursor.execute(
+            "SELECT k.constraint_name, k.column_name, "
+            "k.referenced_table_name, k.referenced_column_name, "
+            "r.delete_rule, r.update_rule "
+            "FROM information_schema.key_column_usage k "
+            "JOIN information_schema.referential_constraints r "
+            "ON r.constraint_schema = k.table_schema "
+            "AND r.constraint_name = k.constraint_name "
+            "WHERE k.table_schema = DATABASE() AND k.table_name = %s "
+            "ORDER BY k.constraint_name, k.ordinal_position",
+            [table]
+        )
+        for name, rows in itertools.groupby(cursor.fetchall(),
+                                            lambda row: row[0]):
+            rows = list(rows)
+            results.append((
+                name,
+                "ALTER TABLE %s DROP FOREIGN KEY %s" % (qn(table), qn(name)),
+                "ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) "
+                "REFERENCES %s (%s) ON DELETE %s ON UPDATE %s" % (
+                    qn(table),
+                    qn(name),
+                    ", ".join([qn(row[1]) for row in rows]),
+                    qn(rows[0][2]),
+                    ", ".join([qn(row[3]) for row in rows]),
+                    rows[0][4],
+                    rows[0][5],
+                ),
+            ))
+        
+        cursor.execute(
+            "SELECT index_name, column_name, sub_part, index_type "
+            "FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s "
+            "AND non_unique = 1 ORDER BY index_name, seq_in_index",
+            [table]
+        )
+        for name, rows in itertools.groupby(cursor.fetchall(),
+                                            lambda row: row[0]):
+            rows = list(rows)
+            kind = ""
+            if rows[0][3] in ("FULLTEXT", "SPATIAL"):
+                kind = rows[0][3] + " "
+            results.append((
+                name,
+                "DROP INDEX %s ON %s" % (qn(name), qn(table)),
+                "CREATE %sINDEX %s ON %s (%s)" % (
+                    kind,
+                    qn(name),
+                    qn(table),
+                    ", ".join([
+                        row[2] and "%s(%d)" % (qn(row[1]), row[2]) or
+                        qn(row[1])
+                        for row in rows
+                    ])
+                ),
+            ))
+    
+    elif connection.vendor == "sqlite":
+        # indexes SQLite creates itself have no SQL
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name = %s AND sql IS NOT NULL ORDER BY name",
+            [table]
+        )
+        for name, definition in cursor.fetchall():
+            if re.match(r"^\s*CREATE\s+UNIQUE\b", definition, re.IGNORECASE):
+                continue
+            results.append((name, "DROP INDEX %s" % qn(name), definition))
+    
+    cursor.close()
+    return results
+
+
+def get_sql_for_new_columns(model, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the statements adding the nullable fields of ``model`` missing
+    from its existing table, so that tables created by older versions of
+    nashvegas can be brought up to date.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if table not in connection.introspection.table_names():
+        return []
+    
+    cursor = connection.cursor()
+    columns = set([
+        column[0].lower()
+        for column in connection.introspection.get_table_description(
+            cursor, table
+        )
+    ])
+    cursor.close()
+    
+    qn = connection.ops.quote_name
+    # Oracle has no COLUMN keyword
+    add = connection.vendor == "oracle" and "ADD" or "ADD COLUMN"
+    return [
+        "ALTER TABLE %s %s %s %s NULL" % (
+            qn(table), add, qn(field.column),
+            field.db_type(connection=connection)
+        )
+        for field in model._meta.local_fields
+        if field.null and field.column.lower() not in columns
+    ]
+
+
+def get_sql_for_new_indexes(model, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the statements creating the ``db_index`` indexes of ``model``
+    missing from its existing table, including PostgreSQL's pattern ops
+    variant for ``LIKE`` prefix matches. Only PostgreSQL, MySQL and SQLite
+    are supported.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    if table not in connection.introspection.table_names() or \
+       connection.vendor not in ("postgresql", "mysql", "sqlite"):
+        return []
+    
+    existing = set([
+        name.lower() for name, drop, create in get_secondary_indexes(
+            table, using
+        )
+    ])
+    return [
+        statement
+        for statement in connection.creation.sql_indexes_for_model(
+            model, no_style()
+        )
+        if (get_index_name(statement) or "").lower() not in existing
+    ]
+
+
+# one or two catalog queries of the current schema, the table name first;
+# plain indexes are left out, as deferred ones are built whenever the last
+# migration of a run is done
+SCHEMA_FINGERPRINT_SQL = {
+    "postgresql": [
+        "SELECT table_name, column_name, data_type, is_nullable, "
+        "character_maximum_length, numeric_precision, numeric_scale "
+        "FROM information_schema.columns "
+        "WHERE table_schema = current_schema() "
+        "ORDER BY table_name, ordinal_position",
+        "SELECT t.relname, i.relname, a.attname, x.indisprimary, "
+        "x.indisunique "
+        "FROM pg_index x "
+        "JOIN pg_class t ON t.oid = x.indrelid "
+        "JOIN pg_class i ON i.oid = x.indexrelid "
+        "JOIN pg_namespace n ON n.oid = t.relnamespace "
+        "JOIN pg_attribute a ON a.attrelid = t.oid "
+        "AND a.attnum = ANY(x.indkey) "
+        "WHERE n.nspname = current_schema() "
+        "AND (x.indisprimary OR x.indisunique) "
+        "ORDER BY t.relname, i.relname, a.attname",
+    ],
+    "mysql": [
+        "SELECT table_name, column_name, column_type, is_nullable "
+        "FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() "
+        "ORDER BY table_name, ordinal_position",
+        "SELECT table_name, index_name, column_name "
+        "FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND non_unique = 0 "
+        "ORDER BY table_name, index_name, seq_in_index",
+    ],
+    "sqlite": [
+        "SELECT tbl_name, type, name, sql FROM sqlite_master "
+        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%%' "
+        "AND (type = 'table' OR sql LIKE 'CREATE UNIQUE INDEX%%') "
+        "ORDER BY tbl_name, type DESC, name",
+    ],
+}
+
+
+def _get_introspected_schema(connection, cursor):
+    introspection = connection.introspection
+    for table in sorted(introspection.table_names()):
+        # display sizes depend on the data rather than the schema
+        for column in introspection.get_table_description(cursor, table):
+            name, type_code, display_size = column[:3]
+            yield [table, name, type_code] + list(column[3:])
+        indexes = introspection.get_indexes(cursor, table)
+        for column, index in sorted(indexes.items()):
+            if index["primary_key"] or index["unique"]:
+                yield [table, column, index["primary_key"], index["unique"]]
+
+
+def get_schema_fingerprint(using=DEFAULT_DB_ALIAS):
+    """
+    Returns a hash of the tables, columns, primary keys and unique indexes of
+    the current schema of ``using``, leaving out nashvegas's own tables.
+    
+    On PostgreSQL, MySQL and SQLite the schema is read from the catalog in a
+    query or two; other backends introspect it table by table.
+    """
+    connection = connections[using]
+    own_tables = set([
+        model._meta.db_table.lower()
+        for model in models.get_models(models.get_app("nashvegas"))
+    ])
+    
+    cursor = connection.cursor()
+    if connection.vendor in SCHEMA_FINGERPRINT_SQL:
+        rows = []
+        for sql in SCHEMA_FINGERPRINT_SQL[connection.vendor]:
+            cursor.execute(sql)
+            rows.extend(cursor.fetchall())
+    else:
+        rows = list(_get_introspected_schema(connection, cursor))
+    cursor.close()
+    
+    digest = hashlib.md5()
+    for row in rows:
+        if row[0].lower() in own_tables:
+            continue
+        digest.update(u"|".join(map(unicode, row)).encode("utf-8"))
+        digest.update("\n")
+    return digest.hexdigest()
+
+
+def get_loadable_statement(statement):
+    """
+    Returns a statement of a schema dump without the psql meta-commands
+    (e.g. ``\\restrict``) a DB-API cursor cannot run, or ``None`` for an
+    empty statement or one which only changes the dumping session's
+    settings, such as the empty search_path recent pg_dumps select.
+    """
+    statement = "\n".join([
+        line for line in statement.splitlines()
+        if not line.lstrip().startswith("\\")
+    ]).strip()
+    body = _strip_leading_comments(statement).strip()
+    if not body or DUMP_SESSION_RE.match(body):
+        return None
+    return statement
+
+
+def get_schema_sql(using=DEFAULT_DB_ALIAS):
+    """
+    Returns the statements recreating the schema of ``using``, read from
+    SQLite's catalog or dumped with the "dumpdb" command of ``NASHVEGAS``, as
+    comparedb does.
+    """
+    connection = connections[using]
+    if connection.vendor == "sqlite":
+        cursor = connection.cursor()
+        # tables first, since the indexes, triggers and views refer to them
+        cursor.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL "
+            "AND name NOT LIKE 'sqlite_%%' "
+            "ORDER BY type != 'table', rowid"
+        )
+        statements = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return statements
+    
+    command = NASHVEGAS.get("dumpdb", "pg_dump -s {dbname}")
+    dump = Popen(
+        command.format(dbname=connection.settings_dict["NAME"]),
+        shell=True,
+        stdout=PIPE
+    )
+    statements = list(iter_sql_statements(dump.stdout, connection.vendor))
+    if dump.wait():
+        raise MigrationError("Dumping the schema of %r failed" % using)
+    return statements
+
+
+def is_memory_database(using=DEFAULT_DB_ALIAS):
+    """
+    Returns whether ``using`` is an in-memory SQLite database.
+    """
+    connection = connections[using]
+    return connection.vendor == "sqlite" and \
+        connection.settings_dict["NAME"] in ("", ":memory:")
+
+
+@contextmanager
+def scratch_database(using=DEFAULT_DB_ALIAS, name=None):
+    """
+    Points ``using`` at a new, empty database for the duration of the block,
+    dropping it afterwards. Databases are created and dropped with the
+    "createdb" and "dropdb" commands of ``NASHVEGAS``, as comparedb does, or
+    as files on SQLite. In-memory SQLite databases are refused, as closing
+    their connection would discard them.
+    """
+    if is_memory_database(using):
+        raise MigrationError(
+            "%r is an in-memory SQLite database, which cannot be set aside "
+            "for a scratch database" % using
+        )
+    connection = connections[using]
+    current_name = connection.settings_dict["NAME"]
+    if name is None:
+        name = "%s_scratch" % current_name
+    
+    if connection.vendor != "sqlite":
+        command = NASHVEGAS.get("createdb", "createdb {dbname}")
+        if Popen(command.format(dbname=name), shell=True).wait():
+            # e.g. left behind by an aborted run, and not ours to drop
+            raise MigrationError(
+                "Creating the scratch database %r failed; drop it if it was "
+                "left behind by an earlier run" % name
+            )
+    connection.close()
+    connection.settings_dict["NAME"] = name
+    try:
+        yield name
+    finally:
+        connection.close()
+        connection.settings_dict["NAME"] = current_name
+        if connection.vendor != "sqlite":
+            command = NASHVEGAS.get("dropdb", "dropdb {dbname}")
+            Popen(command.format(dbname=name), shell=True).wait()
+        elif os.path.exists(name):
+            os.remove(name)
+
+
+def get_shard_group(database):
+    """
+    Returns the name of the shard group ``database`` belongs to, or
+    ``None``. Shard groups map one migrations directory to many databases
+    through the "shard_groups" key of the ``NASHVEGAS`` setting.
+    """
+    for group, databases in NASHVEGAS.get("shard_groups", {}).iteritems():
+        if database in databases:
+            return group
+    return None
+
+
+def get_migration_directory(path, database):
+    """
+    Returns the directory holding the migrations of ``database``.
+    """
+    return os.path.join(path, get_shard_group(database) or database)
+
+
 def get_capable_databases():
     """
     Returns a list of databases which are capable of supporting
@@ -182,6 +1183,7 @@ def get_all_migrations(path, databases=None):
     """
     # database: [(number, full_path)]
     possible_migrations = defaultdict(list)
+    shard_groups = NASHVEGAS.get("shard_groups", {})
     
     try:
         in_directory = sorted(get_file_list(path))
@@ -195,18 +1197,25 @@ def get_all_migrations(path, databases=None):
     # actually runnable
     for full_path in in_directory:
         child_path, script = os.path.split(full_path)
-        name, ext = os.path.splitext(script)
+        if script == MODEL_SNAPSHOT_NAME:
+            continue
+        name, ext, compression = split_migration_name(script)
         
         # the database component is default if this is in the root directory
         # is <directory> if in a subdirectory
         if path == child_path:
-            db = DEFAULT_DB_ALIAS
+            dbs = [DEFAULT_DB_ALIAS]
         else:
-            db = os.path.split(child_path)[-1]
+            directory = os.path.split(child_path)[-1]
+            # the directory of a shard group holds the migrations of every
+            # database in the group
+            dbs = shard_groups.get(directory, [directory])
         
         # filter by database if set
-        if databases and db not in databases:
-            continue
+        if databases:
+            dbs = [d for d in dbs if d in databases]
+            if not dbs:
+                continue
         
         match = MIGRATION_NAME_RE.match(name)
         if match is None:
@@ -214,33 +1223,49 @@ def get_all_migrations(path, databases=None):
                                  "(must begin with a number)" % name)
         
         number = int(match.group(1))
-        if ext in [".sql", ".py"]:
-            possible_migrations[db].append((number, full_path))
+        if compression and ext not in COMPRESSIBLE_EXTENSIONS:
+            continue
+        if ext in MIGRATION_EXTENSIONS:
+            for db in dbs:
+                possible_migrations[db].append((number, full_path))
     
     return possible_migrations
 
 
-def get_pending_migrations(path, databases=None, stop_at=None):
+def get_pending_migrations(path, databases=None, stop_at=None, phase=None,
+                           possible_migrations=None, applied_migrations=None):
     """
     Returns a dictionary of database => [migrations] representing all pending
     migrations.
+    
+    With a ``phase``, only the pending migrations of that phase up to the
+    first one of the other phase are returned, since migrations are always
+    applied in order. ``possible_migrations`` saves scanning ``path`` again
+    when it has been scanned already, and ``applied_migrations`` reading
+    the ledgers.
     """
     if stop_at is None:
         stop_at = float("inf")
     
     # database: [(number, full_path)]
-    possible_migrations = get_all_migrations(path, databases)
+    if possible_migrations is None:
+        possible_migrations = get_all_migrations(path, databases)
     # database: [full_path]
-    applied_migrations = get_applied_migrations(databases)
+    if applied_migrations is None:
+        applied_migrations = get_applied_migrations(databases)
     # database: [full_path]
     to_execute = defaultdict(list)
     
     for database, scripts in possible_migrations.iteritems():
-        applied = applied_migrations[database]
+        applied = set(applied_migrations[database])
         pending = to_execute[database]
         for number, migration in scripts:
             path, script = os.path.split(migration)
-            if script not in applied and number <= stop_at:
-                pending.append(script)
+            label = get_migration_label(script)
+            if label in applied or number > stop_at:
+                continue
+            if phase is not None and get_migration_phase(migration) != phase:
+                break
+            pending.append(script)
     
     return dict((k, v) for k, v in to_execute.iteritems() if v)
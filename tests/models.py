@@ -0,0 +1,8 @@
+from django.db import models
+
+
+class Stamped(models.Model):
+    
+    name = models.CharField(max_length=200)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
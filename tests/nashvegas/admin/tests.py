@@ -0,0 +1,88 @@
+import mock
+from django.contrib import admin
+from django.test import TestCase
+from django.test.client import RequestFactory
+from nashvegas.admin import DatabaseListFilter, EstimatedCountQuerySet
+from nashvegas.admin import MigrationAdmin
+from nashvegas.models import Migration
+
+
+class EstimatedCountQuerySetTest(TestCase):
+    def setUp(self):
+        for label in ['0001.sql', '0002.sql']:
+            Migration.objects.create(migration_label=label)
+        self.qs = Migration.objects.all()._clone(klass=EstimatedCountQuerySet)
+
+    @mock.patch('nashvegas.admin.get_estimated_row_count',
+                return_value=50000)
+    def test_unfiltered_count_is_estimated(self, estimate):
+        self.assertEquals(self.qs.count(), 50000)
+        estimate.assert_called_once_with('nashvegas_migration',
+                                         using='default')
+
+    @mock.patch('nashvegas.admin.get_estimated_row_count',
+                return_value=50000)
+    def test_filtered_count_is_exact(self, estimate):
+        qs = self.qs.filter(migration_label='0001.sql')
+        self.assertEquals(qs.count(), 1)
+        self.assertFalse(estimate.called)
+
+    @mock.patch('nashvegas.admin.get_estimated_row_count', return_value=10)
+    def test_small_tables_are_counted(self, estimate):
+        self.assertEquals(self.qs.count(), 2)
+
+    def test_no_estimate(self):
+        # SQLite keeps no row estimates
+        self.assertEquals(self.qs.count(), 2)
+
+
+class MigrationAdminTest(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        for label in ['0001_users.sql', '0002_users_email.sql',
+                      '0010_users.sql']:
+            Migration.objects.create(migration_label=label,
+                                     content='ALTER TABLE users')
+        Migration.objects.using('other').create(migration_label='0001.sql')
+        self.admin = MigrationAdmin(Migration, admin.site)
+        self.factory = RequestFactory()
+
+    def labels(self, qs):
+        return sorted(qs.values_list('migration_label', flat=True))
+
+    def test_prefix_search(self):
+        qs = self.admin.search(Migration.objects.all(), '000')
+        self.assertEquals(self.labels(qs),
+                          ['0001_users.sql', '0002_users_email.sql'])
+        # the label is only matched from its start
+        qs = self.admin.search(Migration.objects.all(), 'users')
+        self.assertEquals(self.labels(qs), [])
+
+    @mock.patch.dict('nashvegas.admin.NASHVEGAS',
+                     {'admin_fulltext_search': True})
+    def test_fulltext_search_falls_back_to_labels(self):
+        # SQLite has no full-text index to search the content with
+        qs = self.admin.search(Migration.objects.all(), 'ALTER')
+        self.assertEquals(self.labels(qs), [])
+
+    def test_queryset_uses_selected_database(self):
+        request = self.factory.get('/', {'database': 'other'})
+        self.assertEquals(self.labels(self.admin.queryset(request)),
+                          ['0001.sql'])
+
+        request = self.factory.get('/', {'database': 'missing'})
+        self.assertEquals(len(self.admin.queryset(request)), 3)
+
+    def test_database_list_filter(self):
+        if DatabaseListFilter is None:
+            # Django 1.3
+            return
+        request = self.factory.get('/', {'database': 'other'})
+        list_filter = DatabaseListFilter(request, {'database': 'other'},
+                                         Migration, self.admin)
+        self.assertEquals(sorted(list_filter.lookups(request, self.admin)),
+                          [('default', 'default'), ('other', 'other')])
+        self.assertEquals(list_filter.value(), 'other')
+        qs = self.admin.queryset(request)
+        self.assertEquals(list_filter.queryset(request, qs), qs)
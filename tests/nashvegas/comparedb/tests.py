@@ -0,0 +1,70 @@
+from django.test import TestCase
+from nashvegas.management.commands.comparedb import parse_schema, \
+  compare_schemas
+
+
+CURRENT = """
+--
+-- Name: foo; Type: TABLE; Schema: public; Owner: bob
+--
+
+CREATE TABLE foo (
+    id integer NOT NULL,
+    bar character varying(100)
+);
+
+CREATE TABLE baz (
+    id integer NOT NULL
+);
+
+ALTER TABLE ONLY foo
+    ADD CONSTRAINT foo_pkey PRIMARY KEY (id);
+
+CREATE INDEX foo_bar ON foo USING btree (bar);
+"""
+
+NEW = """
+CREATE INDEX foo_bar ON foo USING btree (bar);
+
+CREATE TABLE baz (
+    id integer NOT NULL
+);
+
+CREATE TABLE foo (
+    id integer NOT NULL,
+    bar character varying(100),
+    test character varying(100)
+);
+
+CREATE FUNCTION qux(integer) RETURNS integer AS $$
+    SELECT $1;
+$$ LANGUAGE sql;
+"""
+
+
+class ParseSchemaTest(TestCase):
+    def test_keys_objects(self):
+        objects = parse_schema(CURRENT.splitlines(True))
+        self.assertEquals(objects.keys(), [
+            ("TABLE", "foo"),
+            ("TABLE", "baz"),
+            ("CONSTRAINT", "foo.foo_pkey"),
+            ("INDEX", "foo_bar"),
+        ])
+        self.assertTrue(objects[("TABLE", "foo")].startswith("CREATE TABLE"))
+
+
+class CompareSchemasTest(TestCase):
+    def test_ignores_ordering(self):
+        current = parse_schema(CURRENT.splitlines(True))
+        new = parse_schema(NEW.splitlines(True))
+        report = "".join(compare_schemas(current, new, 0))
+
+        self.assertTrue("Only in current database: CONSTRAINT foo.foo_pkey"
+                        in report)
+        self.assertTrue("Only in fresh database: FUNCTION qux(integer)"
+                        in report)
+        self.assertTrue("Differs: TABLE foo" in report)
+        self.assertTrue("+    test character varying(100)" in report)
+        self.assertFalse("baz" in report)
+        self.assertFalse("foo_bar" in report)
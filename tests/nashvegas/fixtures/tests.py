@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from django.db.models import get_model
+from django.test import TestCase
+from nashvegas.fixtures import get_fixture_files, load_initial_data
+from nashvegas.models import Migration
+
+
+class LoadInitialDataTest(TestCase):
+    def setUp(self):
+        self.fixture_dir = tempfile.mkdtemp()
+        self.fixture_dirs = self.settings(FIXTURE_DIRS=[self.fixture_dir])
+        self.fixture_dirs.enable()
+        self.write_fixture(["0001.sql", "0002.sql"])
+
+    def tearDown(self):
+        self.fixture_dirs.disable()
+        shutil.rmtree(self.fixture_dir)
+
+    def write_fixture(self, labels):
+        objects = [
+            {"pk": pk, "model": "nashvegas.migration",
+             "fields": {"migration_label": label, "content": "",
+                        "date_created": "2012-01-01 00:00:00"}}
+            for pk, label in enumerate(labels, 1)
+        ]
+        with open(os.path.join(self.fixture_dir, "initial_data.json"), "w") as fp:
+            json.dump(objects, fp)
+
+    def test_finds_fixture(self):
+        files = get_fixture_files()
+        self.assertEquals(files, [
+            (os.path.join(self.fixture_dir, "initial_data.json"), "json", None)
+        ])
+
+    def test_skips_unchanged_fixtures(self):
+        self.assertEquals(load_initial_data(), 2)
+        self.assertEquals(Migration.objects.count(), 2)
+        self.assertEquals(load_initial_data(), None)
+
+        self.write_fixture(["0001.sql", "0002_changed.sql", "0003.sql"])
+        self.assertEquals(load_initial_data(), 3)
+        self.assertEquals(
+            list(Migration.objects.order_by("pk").values_list(
+                "migration_label", flat=True)),
+            ["0001.sql", "0002_changed.sql", "0003.sql"]
+        )
+
+    def test_reloads_into_touched_tables(self):
+        self.assertEquals(load_initial_data(), 2)
+        # a migration emptied the table
+        Migration.objects.all().delete()
+        self.assertEquals(load_initial_data(touched=["other_table"]), None)
+        self.assertEquals(load_initial_data(touched=["nashvegas_migration"]),
+                          2)
+        self.assertEquals(Migration.objects.count(), 2)
+
+    def test_keeps_auto_now_values(self):
+        with open(os.path.join(self.fixture_dir, "initial_data.json"), "w") as fp:
+            json.dump([
+                {"pk": 1, "model": "tests.stamped",
+                 "fields": {"name": "a",
+                            "date_created": "2012-01-01 00:00:00",
+                            "date_updated": "2012-01-02 00:00:00"}},
+            ], fp)
+        self.assertEquals(load_initial_data(), 1)
+        stamped = get_model("tests", "stamped").objects.get(pk=1)
+        self.assertEquals(stamped.date_created, datetime(2012, 1, 1))
+        self.assertEquals(stamped.date_updated, datetime(2012, 1, 2))
@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+
+import mock
+from django.test import TestCase
+from nashvegas.exceptions import MigrationError
+from nashvegas.hooks import get_hooks, notify, JSONLinesSink, \
+  SlowStatementLogger, TimingRecorder
+
+
+class GetHooksTest(TestCase):
+    @mock.patch.dict('nashvegas.hooks.NASHVEGAS', {'hooks': [
+        'nashvegas.hooks.SlowStatementLogger',
+        ('nashvegas.hooks.JSONLinesSink', {'path': '/dev/null'}),
+    ]})
+    def test_loads_hooks(self):
+        hooks = get_hooks()
+        self.assertEquals(len(hooks), 2)
+        self.assertTrue(isinstance(hooks[0], SlowStatementLogger))
+        self.assertTrue(isinstance(hooks[1], JSONLinesSink))
+        self.assertEquals(hooks[1].path, '/dev/null')
+
+    @mock.patch.dict('nashvegas.hooks.NASHVEGAS', {'hooks': [
+        'nashvegas.hooks.Missing',
+    ]})
+    def test_invalid_hook(self):
+        self.assertRaises(MigrationError, get_hooks)
+
+
+class NotifyTest(TestCase):
+    def test_failing_hook_is_ignored(self):
+        failing = mock.Mock()
+        failing.before_migration.side_effect = ValueError
+        working = mock.Mock()
+        notify([failing, working], 'before_migration',
+               database='default', migration='0001.sql')
+        working.before_migration.assert_called_once_with(
+            database='default', migration='0001.sql')
+
+
+class TimingRecorderTest(TestCase):
+    def test_records_durations(self):
+        timer = TimingRecorder()
+        notify([timer], 'after_statement', database='default',
+               migration='0001.sql', statement='SELECT 1', duration=0.5,
+               rowcount=1, success=True)
+        notify([timer], 'after_migration', database='default',
+               migration='0001.sql', duration=1.0, success=False)
+        notify([timer], 'after_migration', database='default',
+               migration='0001.sql', duration=2.0, success=True)
+        self.assertEquals(timer.migrations[('default', '0001.sql')],
+                          (3.0, True))
+        self.assertEquals(timer.statements[('default', '0001.sql')],
+                          [(0.5, 'SELECT 1')])
+
+
+class JSONLinesSinkTest(TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def read(self):
+        with open(self.path) as fp:
+            return [json.loads(line)['event'] for line in fp]
+
+    def test_keeps_file_open_and_flushes(self):
+        sink = JSONLinesSink(self.path)
+        notify([sink], 'before_migration', database='default',
+               migration='0001.sql')
+        fp = sink.fp
+        self.assertEquals(self.read(), ['before_migration'])
+        notify([sink], 'after_migration', database='default',
+               migration='0001.sql', duration=1.0, success=True)
+        self.assertTrue(sink.fp is fp)
+        self.assertEquals(self.read(),
+                          ['before_migration', 'after_migration'])
+        sink.close()
+        self.assertTrue(fp.closed)
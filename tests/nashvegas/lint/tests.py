@@ -0,0 +1,68 @@
+from django.test import TestCase
+from nashvegas.lint import Linter
+
+
+def lint(vendor, statement, rows=1000000, defer_indexes=False):
+    linter = Linter(vendor, lambda table: rows, max_rows=100000)
+    return [
+        (finding.rule.name, finding.table, finding.is_error)
+        for finding in linter.lint_statement(statement, defer_indexes)
+    ]
+
+
+class LinterTest(TestCase):
+    def test_postgresql(self):
+        self.assertEquals(
+            lint("postgresql", "ALTER TABLE Foo ADD COLUMN token uuid "
+                               "DEFAULT gen_random_uuid()"),
+            [("volatile-default", "foo", True)]
+        )
+        self.assertEquals(
+            lint("postgresql", 'CREATE INDEX "foo_bar" ON "foo" ("bar")'),
+            [("create-index", "foo", True)]
+        )
+        self.assertEquals(
+            lint("postgresql", "ALTER TABLE foo ADD CONSTRAINT foo_bar_fk "
+                               "FOREIGN KEY (bar_id) REFERENCES bar (id)"),
+            [("foreign-key", "foo", True)]
+        )
+
+    def test_safe_statements(self):
+        self.assertEquals(
+            lint("postgresql", "ALTER TABLE foo ADD COLUMN code varchar(10) "
+                               "DEFAULT now()"),
+            []
+        )
+        self.assertEquals(
+            lint("postgresql", "CREATE INDEX CONCURRENTLY foo_bar ON foo "
+                               "(bar)"),
+            []
+        )
+        self.assertEquals(
+            lint("postgresql", "ALTER TABLE foo ADD CONSTRAINT foo_bar_fk "
+                               "FOREIGN KEY (bar_id) REFERENCES bar (id) "
+                               "NOT VALID"),
+            []
+        )
+        self.assertEquals(
+            lint("postgresql", "CREATE INDEX foo_bar ON foo (bar)",
+                 defer_indexes=True),
+            []
+        )
+
+    def test_weighed_by_rows(self):
+        self.assertEquals(
+            lint("mysql", "ALTER TABLE `foo` MODIFY `bar` bigint", rows=10),
+            [("modify-column", "foo", False)]
+        )
+        self.assertEquals(
+            lint("mysql", "ALTER TABLE `foo` MODIFY `bar` bigint", rows=None),
+            [("modify-column", "foo", False)]
+        )
+
+    def test_tables_created_by_migrations(self):
+        linter = Linter("postgresql", lambda table: 1000000, max_rows=100000)
+        linter.lint_statement("CREATE TABLE foo (id integer, bar integer)")
+        self.assertEquals(
+            linter.lint_statement("CREATE INDEX foo_bar ON foo (bar)"), []
+        )
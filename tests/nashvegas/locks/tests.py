@@ -0,0 +1,63 @@
+import datetime
+import threading
+import mock
+from django.test import TestCase
+from nashvegas.locks import LeaderLock
+from nashvegas.models import MigrationLock
+
+
+class LeaderLockTest(TestCase):
+    def test_single_leader(self):
+        leader = LeaderLock('default')
+        other = LeaderLock('default')
+        other.owner = 'elsewhere:1'
+
+        self.assertTrue(leader.acquire())
+        self.assertFalse(other.acquire())
+        leader.release()
+        self.assertTrue(other.acquire())
+        other.release()
+        self.assertEquals(MigrationLock.objects.count(), 0)
+
+    @mock.patch.dict('nashvegas.locks.NASHVEGAS', {'leader_lock_expiry': 60})
+    def test_expired_lock_is_taken_over(self):
+        MigrationLock.objects.create(
+            name='nashvegas',
+            owner='elsewhere:1',
+            date_acquired=datetime.datetime(2000, 1, 1)
+        )
+        lock = LeaderLock('default')
+        self.assertTrue(lock.acquire())
+        self.assertEquals(MigrationLock.objects.get().owner, lock.owner)
+        lock.release()
+
+    @mock.patch.dict('nashvegas.locks.NASHVEGAS', {'leader_lock_expiry': 60})
+    def test_refreshed_lock_is_kept(self):
+        leader = LeaderLock('default')
+        self.assertTrue(leader.acquire())
+        # the leader has been migrating for longer than the expiry
+        MigrationLock.objects.update(
+            date_acquired=datetime.datetime(2000, 1, 1)
+        )
+        self.assertTrue(leader.refresh())
+
+        other = LeaderLock('default')
+        other.owner = 'elsewhere:1'
+        self.assertFalse(other.acquire())
+        self.assertEquals(MigrationLock.objects.get().owner, leader.owner)
+        self.assertFalse(other.refresh())
+        leader.release()
+
+    @mock.patch.dict('nashvegas.locks.NASHVEGAS',
+                     {'leader_lock_expiry': 0.03})
+    def test_heartbeat_refreshes_lock(self):
+        beats = threading.Event()
+        leader = LeaderLock('default')
+        with mock.patch.object(leader, 'refresh',
+                               side_effect=lambda: beats.set() or True):
+            self.assertTrue(leader.acquire())
+            beats.wait(5)
+            self.assertTrue(beats.is_set())
+            leader.release()
+        self.assertEquals(leader.heartbeat, None)
+        self.assertEquals(MigrationLock.objects.count(), 0)
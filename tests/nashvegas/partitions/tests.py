@@ -0,0 +1,118 @@
+import os
+import tempfile
+
+import mock
+from django.db import connections
+from django.test import TestCase
+from nashvegas import partitions as partitions_module
+from nashvegas.models import Migration
+from nashvegas.partitions import KeyRanges, Remainders, run_partition
+from nashvegas.partitions import init_worker, run_partition_in_savepoint
+
+
+class PartitionsTest(TestCase):
+    def setUp(self):
+        self.ids = [
+            Migration.objects.create(migration_label="%04d.sql" % i).pk
+            for i in range(5)
+        ]
+
+    def test_key_ranges(self):
+        partitions = KeyRanges(Migration, count=2).get_partitions("default")
+        self.assertEquals(len(partitions), 2)
+        self.assertEquals(
+            sorted(sum([
+                list(p.filter(Migration.objects).values_list("pk", flat=True))
+                for p in partitions
+            ], [])),
+            self.ids
+        )
+
+    def test_key_ranges_of_empty_table(self):
+        Migration.objects.all().delete()
+        self.assertEquals(
+            KeyRanges(Migration, size=10).get_partitions("default"), []
+        )
+
+    def test_remainders(self):
+        partitions = Remainders(3).get_partitions("default")
+        counts = [p.filter(Migration.objects).count() for p in partitions]
+        self.assertEquals(sum(counts), 5)
+        self.assertTrue(all(counts))
+
+
+class RunPartitionTest(TestCase):
+    runner = staticmethod(run_partition)
+
+    def run_migration(self, source):
+        fd, path = tempfile.mkstemp(suffix=".py")
+        os.write(fd, source)
+        os.close(fd)
+        try:
+            return self.runner((path, "default",
+                                Remainders(1).get_partitions("default")[0]))
+        finally:
+            os.remove(path)
+
+    def test_result(self):
+        partition, result, error = self.run_migration(
+            "import os\n"
+            "def migrate(partition):\n"
+            "    return os.path.basename('/a/b'), partition.using\n"
+        )
+        self.assertEquals(result, ("b", "default"))
+        self.assertEquals(error, None)
+
+    def test_failure(self):
+        partition, result, error = self.run_migration(
+            "def migrate(partition):\n"
+            "    raise ValueError('boom')\n"
+        )
+        self.assertEquals(result, None)
+        self.assertTrue("ValueError: boom" in error)
+
+
+class RunPartitionInSavepointTest(RunPartitionTest):
+    runner = staticmethod(run_partition_in_savepoint)
+
+    def test_does_not_end_transaction(self):
+        with mock.patch("django.db.transaction.commit") as commit:
+            with mock.patch("django.db.transaction.rollback") as rollback:
+                self.test_result()
+                self.test_failure()
+        self.assertFalse(commit.called)
+        self.assertFalse(rollback.called)
+
+
+class InitWorkerTest(TestCase):
+    def test_keeps_inherited_connections(self):
+        saved = dict([
+            (alias, connections[alias].connection) for alias in connections
+        ])
+        inherited = mock.Mock()
+        connections['default'].connection = inherited
+        try:
+            init_worker()
+            self.assertEquals(connections['default'].connection, None)
+        finally:
+            for alias, connection in saved.items():
+                connections[alias].connection = connection
+        # closing it would end the parent's session
+        self.assertTrue(inherited in partitions_module._inherited)
+        self.assertFalse(inherited.close.called)
+        del partitions_module._inherited[:]
+
+    def test_sets_timeouts(self):
+        saved = dict([
+            (alias, connections[alias].connection) for alias in connections
+        ])
+        try:
+            init_worker(timeouts={'default': ['PRAGMA busy_timeout = 1234']})
+            cursor = connections['default'].cursor()
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEquals(cursor.fetchone()[0], 1234)
+            connections['default'].close()
+        finally:
+            for alias, connection in saved.items():
+                connections[alias].connection = connection
+            del partitions_module._inherited[:]
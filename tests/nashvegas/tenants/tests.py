@@ -0,0 +1,53 @@
+import threading
+import mock
+from django.test import TestCase
+from nashvegas.exceptions import MigrationError
+from nashvegas.tenants import get_tenant_schemas, get_tenant_schema
+from nashvegas.tenants import use_tenant_schema, inherit_tenant_schemas
+
+
+class GetTenantSchemasTest(TestCase):
+    def test_no_tenants(self):
+        self.assertEquals(get_tenant_schemas('default'), None)
+
+    @mock.patch.dict('nashvegas.tenants.NASHVEGAS',
+                     {'tenant_schemas': {'default': ['a', 'b']}})
+    def test_postgresql_only(self):
+        self.assertRaises(MigrationError, get_tenant_schemas, 'default')
+
+
+class UseTenantSchemaTest(TestCase):
+    def setUp(self):
+        # SQLite has no search_path
+        self.patcher = mock.patch('nashvegas.tenants._set_search_path')
+        self.patcher.start()
+
+    def tearDown(self):
+        use_tenant_schema('default', None)
+        self.patcher.stop()
+
+    def test_thread_local(self):
+        use_tenant_schema('default', 'tenant_a')
+        self.assertEquals(get_tenant_schema('default'), 'tenant_a')
+        self.assertEquals(get_tenant_schema('other'), None)
+
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(get_tenant_schema('default'))
+        )
+        thread.start()
+        thread.join()
+        self.assertEquals(seen, [None])
+
+        use_tenant_schema('default', None)
+        self.assertEquals(get_tenant_schema('default'), None)
+
+    def test_inherit(self):
+        use_tenant_schema('default', 'tenant_a')
+        seen = []
+        thread = threading.Thread(target=inherit_tenant_schemas(
+            lambda: seen.append(get_tenant_schema('default'))
+        ))
+        thread.start()
+        thread.join()
+        self.assertEquals(seen, ['tenant_a'])
@@ -0,0 +1,797 @@
+import os
+import shutil
+import tempfile
+import threading
+from collections import defaultdict
+from StringIO import StringIO
+
+import mock
+from django.core.management import call_command
+from django.db import connection, connections, DatabaseError
+from django.db.models import get_app
+from django.db.models.signals import post_syncdb
+from django.test import TestCase, TransactionTestCase
+from nashvegas.exceptions import MigrationError, LockTimeoutError
+from nashvegas.lint import Linter
+from nashvegas.management.commands.upgradedb import Command, PrefixedOutput
+from nashvegas.models import Migration, MigrationAttempt, DeferredIndex
+from nashvegas.tenants import use_tenant_schema, get_tenant_schema
+from nashvegas.utils import iter_sql_statements, get_analyze_sql
+from nashvegas.utils import get_model_tables, read_model_snapshot
+from nashvegas.utils import write_model_snapshot, get_secondary_indexes
+
+
+UPGRADEDB = 'nashvegas.management.commands.upgradedb'
+CREATE = 'CREATE TABLE nashvegas_migration (id integer)'
+
+
+class MigrationsMixin(object):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.path, 'default')
+        os.mkdir(self.db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write_migration(self, name, content):
+        with open(os.path.join(self.db_path, name), 'w') as fp:
+            fp.write(content)
+
+    def upgradedb(self, *args, **options):
+        stdout = StringIO()
+        # failed migrations print their tracebacks
+        with mock.patch('sys.stdout', stdout):
+            with mock.patch('sys.stderr', StringIO()):
+                call_command('upgradedb', path=self.path, *args, **options)
+        return stdout.getvalue()
+
+    def execute(self, **options):
+        options.setdefault('databases', ['default'])
+        return self.upgradedb(do_execute=True, **options)
+
+    def query(self, sql):
+        cursor = connection.cursor()
+        cursor.execute(sql)
+        return cursor.fetchall()
+
+    def applied(self):
+        return list(Migration.objects.order_by('pk').values_list(
+            'migration_label', flat=True
+        ))
+
+
+class UpgradeDbTestCase(MigrationsMixin, TestCase):
+    pass
+
+
+class ExecuteTestCase(MigrationsMixin, TransactionTestCase):
+    # migrations commit and roll back their own transactions
+
+    def setUp(self):
+        super(ExecuteTestCase, self).setUp()
+        self.tables = set(connection.introspection.table_names())
+
+    def tearDown(self):
+        cursor = connection.cursor()
+        for table in connection.introspection.table_names():
+            if table not in self.tables:
+                cursor.execute('DROP TABLE %s' % table)
+        super(ExecuteTestCase, self).tearDown()
+
+
+class ShardsTestCase(ExecuteTestCase):
+    # shards are migrated from threads of their own, which in-memory
+    # databases would not be shared with
+    shards = ['shard_a', 'shard_b', 'shard_c']
+
+    def setUp(self):
+        super(ShardsTestCase, self).setUp()
+        self.db_path = os.path.join(self.path, 'shards')
+        os.mkdir(self.db_path)
+        self.files = tempfile.mkdtemp()
+        for shard in self.shards:
+            connections.databases[shard] = {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(self.files, '%s.db' % shard),
+            }
+        settings = {'shard_groups': {'shards': self.shards},
+                    'shard_concurrency': 1}
+        self.patchers = [
+            mock.patch.dict(UPGRADEDB + '.NASHVEGAS', settings),
+            mock.patch.dict('nashvegas.utils.NASHVEGAS', settings),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        for shard in self.shards:
+            connections[shard].close()
+            del connections.databases[shard]
+            delattr(connections._connections, shard)
+        shutil.rmtree(self.files)
+        super(ShardsTestCase, self).tearDown()
+
+    def shard_applied(self, shard):
+        return list(Migration.objects.using(shard).order_by(
+            'pk').values_list('migration_label', flat=True))
+
+
+class InitLedgerTest(TestCase):
+    def test_skips_statements_another_node_ran(self):
+        # the table is created by another node after this one looked
+        with mock.patch(UPGRADEDB + '.get_sql_for_new_models',
+                        side_effect=[[CREATE], []]):
+            Command()._init_ledger('default')
+
+    def test_creates_missing_label_index(self):
+        # ledgers created before migration_label was indexed
+        index = [
+            name for name, drop, create in get_secondary_indexes(
+                'nashvegas_migration'
+            )
+        ]
+        self.assertEquals(len(index), 1)
+        connection.cursor().execute('DROP INDEX %s' % index[0])
+        Command()._init_ledger('default')
+        self.assertEquals(
+            [name for name, drop, create in get_secondary_indexes(
+                'nashvegas_migration'
+            )],
+            index
+        )
+
+    def test_raises_other_errors(self):
+        with mock.patch(UPGRADEDB + '.get_sql_for_new_models',
+                        return_value=[CREATE]):
+            self.assertRaises(DatabaseError, Command()._init_ledger,
+                              'default')
+
+
+class CreateTest(UpgradeDbTestCase):
+    def setUp(self):
+        super(CreateTest, self).setUp()
+        self.tables = get_model_tables(['nashvegas'])
+        del self.tables['nashvegas.Migration']
+        write_model_snapshot(self.db_path, self.tables)
+
+    def test_create_leaves_snapshot_alone(self):
+        for i in range(2):
+            output = self.upgradedb('nashvegas', do_create=True)
+            self.assertTrue('CREATE TABLE' in output)
+        self.assertEquals(read_model_snapshot(self.db_path), self.tables)
+
+    def test_create_records_snapshot(self):
+        self.upgradedb('nashvegas', do_create=True, record_snapshot=True)
+        self.assertTrue(
+            'nashvegas.Migration' in read_model_snapshot(self.db_path)
+        )
+        self.assertEquals(self.upgradedb('nashvegas', do_create=True), '')
+
+    def test_create_all_writes_migration_and_snapshot(self):
+        self.upgradedb(do_create_all=True)
+        self.assertTrue(os.path.exists(os.path.join(self.db_path, '0001.sql')))
+        self.assertTrue(
+            'nashvegas.Migration' in read_model_snapshot(self.db_path)
+        )
+
+
+class TenantScopeTest(TestCase):
+    def setUp(self):
+        # SQLite has no search_path
+        self.patcher = mock.patch('nashvegas.tenants._set_search_path')
+        self.patcher.start()
+
+    def tearDown(self):
+        use_tenant_schema('default', None)
+        self.patcher.stop()
+
+    def test_touched_tables_are_kept_per_schema(self):
+        command = Command()
+        command.touched = defaultdict(set)
+        use_tenant_schema('default', 'tenant_a')
+        command.touched[command._scope('default')].add('t')
+
+        use_tenant_schema('default', 'tenant_b')
+        command.analyze_tables('default')
+        self.assertEquals(command.touched.keys(), [('default', 'tenant_a')])
+
+
+class TenantListTest(UpgradeDbTestCase):
+    def setUp(self):
+        super(TenantListTest, self).setUp()
+        # SQLite has no search_path
+        self.patchers = [
+            mock.patch('nashvegas.tenants._set_search_path'),
+            mock.patch.dict(UPGRADEDB + '.NASHVEGAS',
+                            {'tenant_schemas': {'default': ['old', 'new']}}),
+            mock.patch(UPGRADEDB + '.get_tenant_schemas',
+                       return_value=['old', 'new']),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        use_tenant_schema('default', None)
+        for patcher in self.patchers:
+            patcher.stop()
+        super(TenantListTest, self).tearDown()
+
+    def test_list_leaves_new_tenant_ledgers_uncreated(self):
+        self.write_migration('0001_a.sql', 'SELECT 1;\n')
+        self.write_migration('0002_b.sql', 'SELECT 2;\n')
+        Migration.objects.create(migration_label='0001_a.sql')
+
+        table_names = connection.introspection.table_names
+        init_ledger = Command._init_ledger
+        initialized = []
+
+        def tenant_table_names(*args):
+            # the "new" schema has no tables yet
+            if get_tenant_schema('default') == 'new':
+                return []
+            return table_names(*args)
+
+        def record_init_ledger(command, database):
+            initialized.append(get_tenant_schema(database))
+            init_ledger(command, database)
+
+        with mock.patch.object(connection.introspection, 'table_names',
+                               side_effect=tenant_table_names):
+            with mock.patch.object(Command, '_init_ledger',
+                                   record_init_ledger):
+                output = self.upgradedb(do_list=True)
+        self.assertEquals(filter(None, initialized), [])
+        self.assertEquals(output.splitlines(), [
+            'Migrations to Apply:',
+            '\tdefault/old: 0002_b.sql',
+            '\tdefault/new: 0001_a.sql',
+            '\tdefault/new: 0002_b.sql',
+        ])
+
+
+class InMemoryScratchTest(ExecuteTestCase):
+    # the test databases are in-memory SQLite ones
+
+    def test_rehearse_skips_in_memory_database(self):
+        self.write_migration('0001_a.sql', 'SELECT 1;\n')
+        Migration.objects.create(migration_label='0000_kept.sql')
+        output = self.upgradedb(do_rehearse=True, databases=['default'])
+        self.assertTrue("Skipping 'default'" in output)
+        self.assertEquals(self.applied(), ['0000_kept.sql'])
+
+    def test_fingerprint_check_does_not_rebuild_in_memory_database(self):
+        Migration.objects.create(migration_label='0001_a.sql',
+                                 fingerprint='stale')
+        stdout = StringIO()
+        with mock.patch('sys.stdout', stdout):
+            self.assertRaises(SystemExit, call_command, 'upgradedb',
+                              path=self.path, do_fingerprint_check=True,
+                              databases=['default'])
+        self.assertTrue('an in-memory database cannot be rebuilt'
+                        in stdout.getvalue())
+        self.assertEquals(self.applied(), ['0001_a.sql'])
+
+
+class CanaryTest(ShardsTestCase):
+    def test_canary_is_migrated_first(self):
+        self.write_migration('0001_a.sql',
+                             'CREATE TABLE shard_test (id integer);\n')
+        output = self.execute(databases=list(reversed(self.shards)))
+        lines = [line for line in output.splitlines() if 'Shard' in line]
+        self.assertEquals(output.splitlines()[0],
+                          "Migrating canary 'shard_a' of 'shards'.")
+        self.assertEquals(lines, [
+            "[shard_a] Shard 'shard_a' of 'shards' migrated (1/3).",
+            "[shard_b] Shard 'shard_b' of 'shards' migrated (2/3).",
+            "[shard_c] Shard 'shard_c' of 'shards' migrated (3/3).",
+        ])
+        for shard in self.shards:
+            self.assertEquals(self.shard_applied(shard), ['0001_a.sql'])
+
+    def test_failed_canary_stops_the_group(self):
+        self.write_migration('0001_a.sql',
+                             'CREATE TABLE shard_test (id integer);\n')
+        # the canary already has the table, so its migration fails
+        connections['shard_a'].cursor().execute(
+            'CREATE TABLE shard_test (id integer)'
+        )
+        self.assertRaises(MigrationError, self.execute,
+                          databases=self.shards)
+        for shard in self.shards:
+            self.assertEquals(self.shard_applied(shard), [])
+        self.assertFalse('shard_test' in
+                         connections['shard_b'].introspection.table_names())
+
+
+class PrefixedOutputTest(TestCase):
+    def test_writes_whole_lines(self):
+        stream = StringIO()
+        output = PrefixedOutput(stream)
+        output.set_prefix('[s1] ')
+        output.write("Executing migration '0001.sql' on 's1'....")
+
+        def other():
+            output.set_prefix('[s2] ')
+            output.write("Executing migration '0001.sql' on 's2'....")
+            output.write('success\n')
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+
+        output.write('success\n')
+        output.write('unfinished')
+        output.set_prefix(None)
+        output.write('done\n')
+        self.assertEquals(stream.getvalue().splitlines(), [
+            "[s2] Executing migration '0001.sql' on 's2'....success",
+            "[s1] Executing migration '0001.sql' on 's1'....success",
+            "[s1] unfinished",
+            "done",
+        ])
+
+
+class GetTimeoutsTest(UpgradeDbTestCase):
+    def get_timeouts(self, header):
+        path = os.path.join(self.db_path, '0001.sql')
+        with open(path, 'w') as fp:
+            fp.write('-- nashvegas: %s\nSELECT 1;\n' % header)
+        return Command()._get_timeouts(path)
+
+    def test_durations(self):
+        timeouts = self.get_timeouts(
+            'lock_timeout=5s, statement_timeout=2m, lock_retries=10'
+        )
+        self.assertEquals(timeouts, {
+            'lock_timeout': 5, 'statement_timeout': 120, 'lock_retries': 10
+        })
+        self.assertEquals(self.get_timeouts('lock_timeout=0.5'), {
+            'lock_timeout': 0.5, 'statement_timeout': None, 'lock_retries': 3
+        })
+
+    def test_invalid(self):
+        self.assertRaises(MigrationError, self.get_timeouts,
+                          'lock_timeout=5 seconds')
+        self.assertRaises(MigrationError, self.get_timeouts,
+                          'lock_retries=2s')
+
+
+class ResumeTest(ExecuteTestCase):
+    @mock.patch.dict(UPGRADEDB + '.NASHVEGAS', {'checkpoint': True})
+    def test_resumes_after_failed_statement(self):
+        self.write_migration('0001_resume.sql', (
+            'CREATE TABLE resume_test (id integer);\n'
+            'INSERT INTO resume_test VALUES (1);\n'
+            'INSERT INTO resume_missing VALUES (2);\n'
+            'INSERT INTO resume_test VALUES (3);\n'
+        ))
+        self.assertRaises(MigrationError, self.execute)
+        self.assertEquals(self.query('SELECT id FROM resume_test'), [(1,)])
+        self.assertEquals(self.applied(), [])
+
+        # fixed, but only applied with --resume
+        self.write_migration('0001_resume.sql', (
+            'CREATE TABLE resume_test (id integer);\n'
+            'INSERT INTO resume_test VALUES (1);\n'
+            'INSERT INTO resume_test VALUES (2);\n'
+            'INSERT INTO resume_test VALUES (3);\n'
+        ))
+        self.assertRaises(MigrationError, self.execute)
+        self.execute(do_resume=True)
+        self.assertEquals(
+            self.query('SELECT id FROM resume_test ORDER BY id'),
+            [(1,), (2,), (3,)]
+        )
+        self.assertEquals(self.applied(), ['0001_resume.sql'])
+
+
+class DataMigrationTest(ExecuteTestCase):
+    def test_loads_csv_into_table(self):
+        self.write_migration('0001_country.sql', (
+            'CREATE TABLE data_country (code varchar(2), name varchar(50));\n'
+        ))
+        self.write_migration('0002_countries.csv', (
+            '# nashvegas: table=data_country\n'
+            'code,name\n'
+            'US,United States\n'
+            'FR,\n'
+        ))
+        self.execute()
+        self.assertEquals(
+            self.query('SELECT code, name FROM data_country ORDER BY code'),
+            [(u'FR', None), (u'US', u'United States')]
+        )
+        self.assertEquals(self.applied(),
+                          ['0001_country.sql', '0002_countries.csv'])
+
+
+class PartitionedMigrationTest(ExecuteTestCase):
+    def test_in_process_partitions_roll_back_with_migration(self):
+        self.write_migration('0001_create.sql',
+                             'CREATE TABLE partition_test (id integer);\n')
+        self.write_migration('0002_fill.py', (
+            'from django.db import connections\n'
+            'from nashvegas.partitions import Remainders\n'
+            'partitions = Remainders(2)\n'
+            'def migrate(partition):\n'
+            '    if partition.remainder:\n'
+            '        raise ValueError("boom")\n'
+            '    connections[partition.using].cursor().execute(\n'
+            '        "INSERT INTO partition_test VALUES (1)")\n'
+        ))
+        self.assertRaises(MigrationError, self.execute)
+        self.assertEquals(self.applied(), ['0001_create.sql'])
+        # the first partition did not commit the migration's transaction
+        self.assertEquals(self.query('SELECT id FROM partition_test'), [])
+
+
+class CopyHookTest(TestCase):
+    def test_failed_copy_is_reported(self):
+        command = Command()
+        command.touched = defaultdict(set)
+        hook = mock.Mock()
+        command.hooks = [hook]
+        postgresql = mock.Mock(vendor='postgresql')
+        postgresql.ops.quote_name.side_effect = lambda name: '"%s"' % name
+        cursor = postgresql.cursor.return_value
+        cursor.copy_expert.side_effect = DatabaseError('invalid input')
+        fp = StringIO('# nashvegas: table=data_country\ncode,name\nUS,\n')
+        with mock.patch(UPGRADEDB + '.connections', {'default': postgresql}):
+            self.assertRaises(DatabaseError, command._execute_data,
+                              'default', '0001_countries.csv', fp)
+        self.assertEquals(hook.before_statement.call_count, 1)
+        kwargs = hook.after_statement.call_args[1]
+        self.assertTrue(kwargs['statement'].startswith('COPY'))
+        self.assertEquals(kwargs['success'], False)
+        self.assertEquals(kwargs['rowcount'], None)
+
+
+class DeferredIndexTest(ExecuteTestCase):
+    def test_index_is_built_after_migration(self):
+        self.write_migration('0001_items.sql', (
+            '-- nashvegas: defer_indexes=true\n'
+            'CREATE TABLE deferred_item (id integer, name varchar(50));\n'
+            'CREATE INDEX deferred_item_name ON deferred_item (name);\n'
+        ))
+        output = self.execute()
+        lines = output.splitlines()
+        migrated = [i for i, line in enumerate(lines)
+                    if line.startswith('Executing migration') and
+                    line.endswith('success')]
+        built = lines.index(
+            "Built index deferred_item_name on 'default'."
+        )
+        self.assertEquals(len(migrated), 1)
+        self.assertTrue(migrated[0] < built)
+
+        index = DeferredIndex.objects.get()
+        self.assertEquals(
+            (index.name, index.migration_label),
+            ('deferred_item_name', '0001_items.sql')
+        )
+        self.assertFalse(index.date_built is None)
+        self.assertEquals(
+            [name for name, drop, create in get_secondary_indexes(
+                'deferred_item'
+            )],
+            ['deferred_item_name']
+        )
+
+
+class LintTest(ExecuteTestCase):
+    def setUp(self):
+        super(LintTest, self).setUp()
+        connection.cursor().execute(
+            'CREATE TABLE lint_item (id integer, name varchar(50))'
+        )
+
+    def test_warnings_exit_cleanly(self):
+        self.write_migration('0001_purge.sql', 'DELETE FROM lint_item;\n')
+        output = self.upgradedb(do_lint=True, databases=['default'])
+        self.assertTrue('warning unbounded-dml' in output)
+        self.assertEquals(self.applied(), [])
+
+    @mock.patch(UPGRADEDB + '.get_estimated_row_count', return_value=10 ** 6)
+    def test_high_risk_statement_exits_with_error(self, row_count):
+        self.write_migration('0001_index.sql',
+                             'CREATE INDEX lint_item_name ON lint_item '
+                             '(name);\n')
+        stdout, stderr = StringIO(), StringIO()
+        # SQLite has no high risk statements
+        linter = lambda vendor, row_count: Linter('postgresql', row_count)
+        with mock.patch(UPGRADEDB + '.Linter', linter):
+            with mock.patch('sys.stdout', stdout):
+                with mock.patch('sys.stderr', stderr):
+                    try:
+                        call_command('upgradedb', path=self.path,
+                                     do_lint=True, databases=['default'])
+                    except SystemExit, e:
+                        self.assertEquals(e.code, 1)
+                    else:
+                        self.fail('--lint did not fail')
+        self.assertTrue('ERROR create-index' in stdout.getvalue())
+        self.assertTrue('1 high risk statement(s)' in stderr.getvalue())
+        self.assertEquals(self.applied(), [])
+
+
+class BulkLoadTest(ExecuteTestCase):
+    def setUp(self):
+        super(BulkLoadTest, self).setUp()
+        self.write_migration('0001_items.sql', (
+            'CREATE TABLE bulk_item (id integer, name varchar(50));\n'
+            'CREATE INDEX bulk_item_name ON bulk_item (name);\n'
+        ))
+
+    def indexes(self):
+        return [name for name, drop, create in get_secondary_indexes(
+            'bulk_item'
+        )]
+
+    def execute_recording_indexes(self):
+        execute_migration = Command._execute_migration
+        during = []
+
+        def record_indexes(command, database, migration, *args, **kwargs):
+            if migration.endswith('0002_load.sql'):
+                during.extend(self.indexes())
+            return execute_migration(command, database, migration, *args,
+                                     **kwargs)
+
+        with mock.patch.object(Command, '_execute_migration',
+                               record_indexes):
+            try:
+                self.execute()
+            finally:
+                self.during = during
+
+    def test_indexes_are_restored(self):
+        self.write_migration('0002_load.sql', (
+            '-- nashvegas: bulk_load=bulk_item\n'
+            "INSERT INTO bulk_item VALUES (1, 'a');\n"
+            "INSERT INTO bulk_item VALUES (2, 'b');\n"
+        ))
+        self.execute_recording_indexes()
+        self.assertEquals(self.during, [])
+        self.assertEquals(self.indexes(), ['bulk_item_name'])
+        self.assertEquals(self.applied(), ['0001_items.sql', '0002_load.sql'])
+        self.assertFalse(
+            DeferredIndex.objects.get(name='bulk_item_name').date_built is None
+        )
+
+    def test_indexes_are_restored_after_failure(self):
+        self.write_migration('0002_load.sql', (
+            '-- nashvegas: bulk_load=bulk_item\n'
+            "INSERT INTO bulk_item VALUES (1, 'a');\n"
+            'INSERT INTO missing_table VALUES (2);\n'
+        ))
+        self.assertRaises(MigrationError, self.execute_recording_indexes)
+        self.assertEquals(self.during, [])
+        self.assertEquals(self.indexes(), ['bulk_item_name'])
+        self.assertEquals(self.applied(), ['0001_items.sql'])
+
+
+class AnalyzeTest(ExecuteTestCase):
+    def test_analyzes_only_touched_tables(self):
+        connection.cursor().execute(
+            'CREATE TABLE analyze_other (id integer)'
+        )
+        self.write_migration('0001_items.sql', (
+            'CREATE TABLE analyze_item (id integer);\n'
+            'INSERT INTO analyze_item SELECT id FROM analyze_other;\n'
+        ))
+        self.write_migration('0002_tags.sql', (
+            'CREATE TABLE analyze_tag (id integer);\n'
+            'SELECT COUNT(*) FROM analyze_other;\n'
+        ))
+        with mock.patch(UPGRADEDB + '.get_analyze_sql',
+                        wraps=get_analyze_sql) as analyze_sql:
+            output = self.execute()
+        self.assertEquals(analyze_sql.call_count, 1)
+        self.assertEquals(analyze_sql.call_args[0][1],
+                          ['analyze_item', 'analyze_tag'])
+        self.assertTrue(
+            "Analyzed analyze_item, analyze_tag on 'default'." in output
+        )
+
+
+class PostSyncTest(ExecuteTestCase):
+    def setUp(self):
+        super(PostSyncTest, self).setUp()
+        self.write_migration('0001_a.sql', 'CREATE TABLE sync_a (id integer);\n')
+        self.write_migration('0002_b.sql', 'CREATE TABLE sync_b (id integer);\n')
+        self.sent = []
+        post_syncdb.connect(self.receiver, sender=get_app('nashvegas'))
+
+    def tearDown(self):
+        post_syncdb.disconnect(self.receiver, sender=get_app('nashvegas'))
+        super(PostSyncTest, self).tearDown()
+
+    def receiver(self, db, **kwargs):
+        self.sent.append(db)
+
+    def test_sent_once_per_database(self):
+        self.execute()
+        self.assertEquals(self.sent, ['default'])
+
+    @mock.patch.dict(UPGRADEDB + '.NASHVEGAS',
+                     {'post_sync_per_migration': True})
+    def test_sent_per_migration(self):
+        self.execute()
+        self.assertEquals(self.sent, ['default', 'default'])
+
+
+class CompiledPlanTest(ExecuteTestCase):
+    def setUp(self):
+        super(CompiledPlanTest, self).setUp()
+        self.plans = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.plans)
+        super(CompiledPlanTest, self).tearDown()
+
+    def test_compile_apply_and_mark_applied(self):
+        self.write_migration('0001_plan.sql', (
+            'CREATE TABLE plan_test (id integer);\n'
+            'INSERT INTO plan_test VALUES (1);\n'
+        ))
+        self.upgradedb(compile_plan=self.plans, databases=['default'])
+        self.assertEquals(self.applied(), [])
+        # a CommandError, which call_command turns into an exit
+        self.assertRaises(SystemExit, self.upgradedb,
+                          mark_applied_from=self.plans)
+
+        # as the sqlite3 shell would apply it, leaving it its dot commands
+        with open(os.path.join(self.plans, 'default.sql')) as fp:
+            connection.connection.executescript(''.join([
+                line for line in fp if not line.startswith('.')
+            ]))
+        self.assertEquals(self.query('SELECT id FROM plan_test'), [(1,)])
+
+        output = self.upgradedb(mark_applied_from=self.plans)
+        self.assertTrue('default: 1 migration(s) applied' in output)
+        self.assertEquals(self.applied(), ['0001_plan.sql'])
+
+
+class MigrationAttemptTest(ExecuteTestCase):
+    def attempts(self):
+        return list(MigrationAttempt.objects.order_by('pk').values_list(
+            'migration_label', 'attempt', 'outcome'
+        ))
+
+    def test_records_successful_attempt(self):
+        self.write_migration('0001_a.sql', 'SELECT 1;\n')
+        self.execute()
+        self.assertEquals(self.attempts(), [('0001_a.sql', 1, 'success')])
+        self.assertFalse(MigrationAttempt.objects.get().duration is None)
+
+    @mock.patch(UPGRADEDB + '.time.sleep')
+    def test_records_each_attempt(self, sleep):
+        self.write_migration('0001_a.sql', 'SELECT 1;\n')
+        execute_migration = Command._execute_migration
+        calls = []
+
+        def lock_timeout_once(command, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise LockTimeoutError('database is locked')
+            return execute_migration(command, *args, **kwargs)
+
+        with mock.patch.object(Command, '_execute_migration',
+                               lock_timeout_once):
+            self.execute()
+        self.assertEquals(self.attempts(), [
+            ('0001_a.sql', 1, 'lock_timeout'),
+            ('0001_a.sql', 2, 'success'),
+        ])
+        self.assertEquals(self.applied(), ['0001_a.sql'])
+
+
+class PhaseTest(ExecuteTestCase):
+    def test_invalid_phase_aborts_before_anything_runs(self):
+        self.write_migration('0001_create.sql',
+                             'CREATE TABLE phase_test (id integer);\n')
+        self.write_migration('0002_later.sql', (
+            '-- nashvegas: phase=later\n'
+            'INSERT INTO phase_test VALUES (1);\n'
+        ))
+        for phase in [None, 'pre']:
+            self.assertRaises(MigrationError, self.execute, phase=phase)
+            self.assertEquals(self.applied(), [])
+            self.assertFalse(
+                'phase_test' in connection.introspection.table_names()
+            )
+
+
+class MaxDurationTest(ExecuteTestCase):
+    # a second per byte
+    @mock.patch.dict(UPGRADEDB + '.NASHVEGAS', {'seconds_per_mb': 1 << 20})
+    def test_defers_migrations_beyond_budget(self):
+        self.write_migration('0001_small.sql',
+                             'CREATE TABLE budget_test (id integer);\n')
+        self.write_migration('0002_large.sql', (
+            '-- %s\n'
+            'INSERT INTO budget_test VALUES (1);\n' % ('x' * 4000)
+        ))
+        self.write_migration('0003_small.sql',
+                             'INSERT INTO budget_test VALUES (2);\n')
+        output = self.execute(max_duration='1h')
+        self.assertEquals(self.applied(), ['0001_small.sql'])
+        self.assertTrue('Deferred to stay within --max-duration' in output)
+        self.assertTrue('0002_large.sql' in output)
+        self.assertTrue('0003_small.sql' in output)
+
+        self.execute()
+        self.assertEquals(self.applied(), [
+            '0001_small.sql', '0002_large.sql', '0003_small.sql'
+        ])
+
+    def test_ignores_durations_of_other_migration_directories(self):
+        # other's 0001_small.sql is an unrelated, slow migration
+        os.mkdir(os.path.join(self.path, 'other'))
+        Migration.objects.using('other').create(
+            migration_label='0001_small.sql', duration=7200
+        )
+        try:
+            self.write_migration('0001_small.sql',
+                                 'CREATE TABLE budget_test (id integer);\n')
+            output = self.execute(max_duration='1h',
+                                  databases=['default', 'other'])
+        finally:
+            Migration.objects.using('other').all().delete()
+        self.assertEquals(self.applied(), ['0001_small.sql'])
+        self.assertFalse('Deferred' in output)
+
+
+# the preamble and epilogue of pg_dump 17.6 --schema-only
+PG_DUMP = '''--
+-- PostgreSQL database dump
+--
+
+\\restrict 5fFq3kXbJ2aSg7
+
+-- Dumped from database version 17.6
+-- Dumped by pg_dump version 17.6
+
+SET statement_timeout = 0;
+SET lock_timeout = 0;
+SET idle_in_transaction_session_timeout = 0;
+SET transaction_timeout = 0;
+SET client_encoding = 'UTF8';
+SET standard_conforming_strings = on;
+SELECT pg_catalog.set_config('search_path', '', false);
+SET check_function_bodies = false;
+SET xmloption = content;
+SET client_min_messages = warning;
+SET row_security = off;
+
+SET default_tablespace = '';
+
+SET default_table_access_method = heap;
+
+--
+-- Name: rehearsal_tag; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE rehearsal_tag (
+    id integer NOT NULL,
+    name character varying(50) NOT NULL
+);
+
+--
+-- PostgreSQL database dump complete
+--
+
+\\unrestrict 5fFq3kXbJ2aSg7
+
+'''
+
+
+class LoadRehearsalTest(ExecuteTestCase):
+    def test_skips_session_settings_and_meta_commands(self):
+        schema = list(iter_sql_statements(PG_DUMP.splitlines(True),
+                                          'postgresql'))
+        with mock.patch('sys.stdout', StringIO()):
+            Command()._load_rehearsal('default', schema, [])
+        self.assertEquals(self.query('SELECT * FROM rehearsal_tag'), [])
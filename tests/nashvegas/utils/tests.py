@@ -1,7 +1,17 @@
 import mock
+import shutil
+import tempfile
+from django.db import connection
 from django.test import TestCase
+from nashvegas.exceptions import MigrationError
 from nashvegas.utils import get_capable_databases, get_all_migrations, \
-  get_file_list, get_pending_migrations
+  get_file_list, get_pending_migrations, iter_sql_statements, \
+  batch_insert_statements, get_migration_directives, split_migration_name, \
+  get_migration_label, quote_sql_literal, get_index_name, \
+  make_concurrent_index, get_timeout_sql, is_lock_timeout, \
+  get_schema_fingerprint, get_sql_for_new_models, get_model_tables, \
+  read_model_snapshot, write_model_snapshot, get_secondary_indexes, \
+  get_touched_table, get_analyze_sql, get_migration_phase, scratch_database
 from os.path import join, dirname
 
 mig_root = join(dirname(__import__('tests', {}, {}, [], -1).__file__), 'fixtures', 'migrations')
@@ -44,6 +54,21 @@ class GetAllMigrationsTest(TestCase):
         self.assertTrue((1, join(path, 'other', '0001.sql')) in other)
         self.assertTrue((2, join(path, 'other', '0002_bar.sql')) in other)
 
+    @mock.patch.dict('nashvegas.utils.NASHVEGAS', {
+        'shard_groups': {'other': ['shard01', 'shard02']},
+    })
+    def test_shard_groups(self):
+        path = join(mig_root, 'multidb')
+        results = dict(get_all_migrations(path))
+        self.assertEquals(sorted(results.keys()),
+                          ['default', 'shard01', 'shard02'])
+        self.assertEquals(results['shard01'], results['shard02'])
+        self.assertTrue((2, join(path, 'other', '0002_bar.sql'))
+                        in results['shard01'])
+
+        results = dict(get_all_migrations(path, ['shard02']))
+        self.assertEquals(results.keys(), ['shard02'])
+
 
 class GetPendingMigrationsTest(TestCase):
     @mock.patch('nashvegas.utils.get_all_migrations')
@@ -66,3 +91,359 @@ class GetPendingMigrationsTest(TestCase):
         self.assertTrue('dupes' in results)
         self.assertEquals(len(results['dupes']), 1)
         self.assertTrue('0002_bar.sql' in results['dupes'])
+
+
+class IterSqlStatementsTest(TestCase):
+    def test_splits_on_semicolons(self):
+        lines = [
+            "CREATE TABLE foo (id integer);\n",
+            "INSERT INTO foo VALUES (1); INSERT INTO foo VALUES (2);\n",
+        ]
+        results = list(iter_sql_statements(lines))
+        self.assertEquals(results, [
+            "CREATE TABLE foo (id integer)",
+            "INSERT INTO foo VALUES (1)",
+            "INSERT INTO foo VALUES (2)",
+        ])
+
+    def test_ignores_quoted_semicolons(self):
+        lines = [
+            "INSERT INTO foo VALUES ('a;b', 'it''s');\n",
+            "-- a comment; with a semicolon\n",
+            "/* another; comment */\n",
+            "CREATE FUNCTION f() RETURNS void AS $body$\n",
+            "BEGIN PERFORM 1; END;\n",
+            "$body$ LANGUAGE plpgsql;\n",
+        ]
+        results = list(iter_sql_statements(lines))
+        self.assertEquals(len(results), 2)
+        self.assertEquals(results[0], "INSERT INTO foo VALUES ('a;b', 'it''s')")
+        self.assertTrue(results[1].endswith("$body$ LANGUAGE plpgsql"))
+
+    def test_backslash_escapes(self):
+        lines = ["INSERT INTO foo VALUES ('it\\'s;');\n"]
+        self.assertEquals(len(list(iter_sql_statements(lines))), 2)
+        results = list(iter_sql_statements(lines, "mysql"))
+        self.assertEquals(results, ["INSERT INTO foo VALUES ('it\\'s;')"])
+
+    def test_escaped_backslash_ends_string(self):
+        lines = [
+            "INSERT INTO q VALUES ('C:\\\\');\n",
+            "INSERT INTO q VALUES ('x');\n",
+            "DROP TABLE q;\n",
+        ]
+        results = list(iter_sql_statements(lines, "mysql"))
+        self.assertEquals(results, [
+            "INSERT INTO q VALUES ('C:\\\\')",
+            "INSERT INTO q VALUES ('x')",
+            "DROP TABLE q",
+        ])
+
+    def test_mysql_hash_comments(self):
+        lines = [
+            "# don't forget\n",
+            "CREATE TABLE q (id integer);\n",
+            "DROP TABLE q; # it's gone\n",
+        ]
+        results = list(iter_sql_statements(lines, "mysql"))
+        self.assertEquals(results, [
+            "# don't forget\nCREATE TABLE q (id integer)",
+            "DROP TABLE q",
+        ])
+        # a hash is not a comment elsewhere
+        self.assertEquals(len(list(iter_sql_statements(lines))), 1)
+
+    def test_postgresql_escape_strings(self):
+        lines = [
+            "INSERT INTO q VALUES (E'it\\'s;', E'C:\\\\');\n",
+            "INSERT INTO q VALUES ('C:\\');\n",
+            "DROP TABLE q;\n",
+        ]
+        results = list(iter_sql_statements(lines, "postgresql"))
+        self.assertEquals(results, [
+            "INSERT INTO q VALUES (E'it\\'s;', E'C:\\\\')",
+            "INSERT INTO q VALUES ('C:\\')",
+            "DROP TABLE q",
+        ])
+
+    def test_skips_comment_only_statements(self):
+        lines = ["-- nothing to see here\n", ";\n", "SELECT 1\n"]
+        results = list(iter_sql_statements(lines))
+        self.assertEquals(results, ["SELECT 1"])
+
+
+class BatchInsertStatementsTest(TestCase):
+    def test_coalesces_same_shape_inserts(self):
+        statements = [
+            "INSERT INTO foo (a, b) VALUES (1, 'x')",
+            "insert into FOO (a,  b) values (2, '(y)')",
+            "INSERT INTO foo (a, b) VALUES (3, 'z')",
+            "INSERT INTO bar VALUES (1)",
+            "UPDATE foo SET a = 1",
+        ]
+        results = list(batch_insert_statements(statements, 2))
+        self.assertEquals([len(sources) for sources, sql in results],
+                          [2, 1, 1, 1])
+        self.assertEquals(
+            results[0][1],
+            "INSERT INTO foo (a, b) VALUES (1, 'x'), (2, '(y)')"
+        )
+        self.assertEquals(results[1][1], statements[2])
+        self.assertEquals(results[3][1], statements[4])
+
+    def test_leaves_other_inserts_alone(self):
+        statements = [
+            "INSERT INTO foo VALUES (1) RETURNING (id)",
+            "INSERT INTO foo VALUES (2) RETURNING (id)",
+            "INSERT INTO foo SELECT * FROM bar",
+        ]
+        results = list(batch_insert_statements(statements, 100))
+        self.assertEquals([sql for sources, sql in results], statements)
+
+
+class GetMigrationDirectivesTest(TestCase):
+    def test_parses_header(self):
+        lines = [
+            "-- Add the reference tables\n",
+            "-- nashvegas: table=foo, bar\n",
+            "\n",
+            "# nashvegas: baz = 1\n",
+            "CREATE TABLE foo (id integer);\n",
+            "-- nashvegas: ignored=1\n",
+        ]
+        self.assertEquals(get_migration_directives(lines), {
+            "table": "foo",
+            "bar": True,
+            "baz": "1",
+        })
+
+
+class SplitMigrationNameTest(TestCase):
+    def test_compressed(self):
+        self.assertEquals(split_migration_name("/tmp/0005_seed.sql.gz"),
+                          ("0005_seed", ".sql", ".gz"))
+        self.assertEquals(split_migration_name("0006_data.csv.zst"),
+                          ("0006_data", ".csv", ".zst"))
+        self.assertEquals(get_migration_label("/tmp/0005_seed.sql.gz"),
+                          "0005_seed.sql")
+
+    def test_uncompressed(self):
+        self.assertEquals(split_migration_name("0001.sql"),
+                          ("0001", ".sql", None))
+        self.assertEquals(get_migration_label("0002_foo.py"), "0002_foo.py")
+
+
+class QuoteSqlLiteralTest(TestCase):
+    def test_quotes(self):
+        self.assertEquals(quote_sql_literal("it's"), "'it''s'")
+        self.assertEquals(quote_sql_literal(None), "NULL")
+
+    def test_backslash_escapes(self):
+        self.assertEquals(quote_sql_literal("a\\b"), "'a\\b'")
+        self.assertEquals(quote_sql_literal("a\\b", backslash_escapes=True),
+                          "'a\\\\b'")
+
+
+class IndexStatementTest(TestCase):
+    def test_get_index_name(self):
+        self.assertEquals(
+            get_index_name('-- speeds up lookups\n'
+                           'CREATE INDEX "foo_bar" ON "foo" ("bar")'),
+            "foo_bar"
+        )
+        self.assertEquals(
+            get_index_name("create index concurrently if not exists foo_baz "
+                           "on foo (baz)"),
+            "foo_baz"
+        )
+
+    def test_get_index_name_other_statements(self):
+        self.assertEquals(
+            get_index_name("CREATE UNIQUE INDEX foo_bar ON foo (bar)"), None
+        )
+        self.assertEquals(get_index_name("CREATE TABLE foo (id int)"), None)
+
+    def test_make_concurrent_index(self):
+        self.assertEquals(
+            make_concurrent_index('CREATE INDEX "foo_bar" ON "foo" ("bar")'),
+            'CREATE INDEX CONCURRENTLY "foo_bar" ON "foo" ("bar")'
+        )
+        self.assertEquals(
+            make_concurrent_index("CREATE INDEX CONCURRENTLY a ON b (c)"),
+            "CREATE INDEX CONCURRENTLY a ON b (c)"
+        )
+
+
+class TimeoutTest(TestCase):
+    def test_postgresql(self):
+        connection = mock.Mock(vendor="postgresql")
+        self.assertEquals(
+            get_timeout_sql(connection, lock_timeout=2.5,
+                            statement_timeout=60),
+            (["SET lock_timeout = '2500ms'",
+              "SET statement_timeout = '60000ms'"],
+             ["RESET lock_timeout", "RESET statement_timeout"])
+        )
+
+    def test_no_timeouts(self):
+        connection = mock.Mock(vendor="mysql")
+        self.assertEquals(get_timeout_sql(connection), ([], []))
+
+    def test_is_lock_timeout(self):
+        self.assertTrue(is_lock_timeout(
+            Exception("canceling statement due to lock timeout")
+        ))
+        self.assertTrue(is_lock_timeout(
+            Exception(1205, "Lock wait timeout exceeded; try restarting "
+                            "transaction")
+        ))
+        self.assertFalse(is_lock_timeout(
+            Exception("canceling statement due to statement timeout")
+        ))
+
+
+class GetSchemaFingerprintTest(TestCase):
+    def test_changes_with_schema(self):
+        fingerprint = get_schema_fingerprint()
+        self.assertEquals(get_schema_fingerprint(), fingerprint)
+
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE fingerprint_test (id integer)")
+        self.assertNotEquals(get_schema_fingerprint(), fingerprint)
+
+        # plain indexes are not part of the schema fingerprint
+        fingerprint = get_schema_fingerprint()
+        cursor.execute("CREATE INDEX fingerprint_test_id "
+                       "ON fingerprint_test (id)")
+        self.assertEquals(get_schema_fingerprint(), fingerprint)
+
+        cursor.execute("CREATE UNIQUE INDEX fingerprint_test_unique "
+                       "ON fingerprint_test (id)")
+        self.assertNotEquals(get_schema_fingerprint(), fingerprint)
+        cursor.execute("DROP TABLE fingerprint_test")
+
+    def test_reads_the_catalog_once(self):
+        # however many tables there are
+        self.assertNumQueries(1, get_schema_fingerprint)
+
+
+class ModelSnapshotTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        self.assertEquals(read_model_snapshot(self.path), None)
+        tables = get_model_tables(['nashvegas'])
+        self.assertEquals(tables['nashvegas.Migration'], 'nashvegas_migration')
+        write_model_snapshot(self.path, tables)
+        self.assertEquals(read_model_snapshot(self.path), tables)
+
+    def test_not_a_migration(self):
+        write_model_snapshot(self.path, {})
+        open(join(self.path, '0001.sql'), 'w').close()
+        results = get_all_migrations(self.path)
+        self.assertEquals(results['default'], [(1, join(self.path, '0001.sql'))])
+
+    def test_new_models(self):
+        tables = get_model_tables(['nashvegas'])
+        self.assertEquals(
+            get_sql_for_new_models(['nashvegas'], tables=tables.values()), []
+        )
+
+        del tables['nashvegas.Migration']
+        statements = get_sql_for_new_models(['nashvegas'], tables=tables.values())
+        self.assertEquals(statements[0], '### New Model: nashvegas.Migration')
+        self.assertEquals(len([
+            s for s in statements if s.startswith('### New Model')
+        ]), 1)
+
+
+class GetSecondaryIndexesTest(TestCase):
+    def test_sqlite(self):
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE bulk_test (id integer PRIMARY KEY, "
+                       "code varchar(10) UNIQUE, name varchar(10))")
+        cursor.execute("CREATE INDEX bulk_test_name ON bulk_test (name)")
+        cursor.execute("CREATE UNIQUE INDEX bulk_test_both "
+                       "ON bulk_test (code, name)")
+        self.assertEquals(get_secondary_indexes('bulk_test'), [(
+            'bulk_test_name',
+            'DROP INDEX "bulk_test_name"',
+            'CREATE INDEX bulk_test_name ON bulk_test (name)'
+        )])
+        cursor.execute("DROP TABLE bulk_test")
+
+
+class AnalyzeTest(TestCase):
+    def test_get_touched_table(self):
+        for statement in [
+            "INSERT INTO store_product VALUES (1)",
+            "-- seed\nupdate \"store_product\" SET code = NULL",
+            "DELETE FROM public.store_product WHERE id = 1",
+            "ALTER TABLE store_product ADD COLUMN code varchar(10)",
+            "CREATE TABLE IF NOT EXISTS store_product (id integer)",
+            "CREATE INDEX CONCURRENTLY store_product_code "
+            "ON store_product (code)",
+        ]:
+            self.assertEquals(get_touched_table(statement), 'store_product')
+        self.assertEquals(get_touched_table("SELECT 1"), None)
+        self.assertEquals(get_touched_table("DROP TABLE store_product"), None)
+
+    def test_get_analyze_sql(self):
+        self.assertEquals(get_analyze_sql(connection, ['a', 'b']),
+                          ['ANALYZE "a"', 'ANALYZE "b"'])
+
+
+class GetMigrationPhaseTest(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def phase(self, header):
+        path = join(self.path, '0001.sql')
+        with open(path, 'w') as fp:
+            fp.write(header + 'SELECT 1;\n')
+        return get_migration_phase(path)
+
+    def test_phases(self):
+        self.assertEquals(self.phase(''), 'pre')
+        self.assertEquals(self.phase('-- nashvegas: phase=expand\n'), 'pre')
+        self.assertEquals(self.phase('-- nashvegas: phase=post\n'), 'post')
+        self.assertEquals(self.phase('-- nashvegas: phase=Contract\n'),
+                          'post')
+        self.assertRaises(MigrationError, self.phase,
+                          '-- nashvegas: phase=later\n')
+
+
+class ScratchDatabaseTest(TestCase):
+    @mock.patch('nashvegas.utils.Popen')
+    def test_createdb_failure(self, popen):
+        popen.return_value.wait.return_value = 1
+        connection = mock.Mock(vendor='postgresql',
+                               settings_dict={'NAME': 'shop'})
+
+        def use_scratch():
+            with scratch_database('default'):
+                self.fail('a stale scratch database would be used')
+
+        with mock.patch('nashvegas.utils.connections',
+                        {'default': connection}):
+            self.assertRaises(MigrationError, use_scratch)
+        # neither switched to nor dropped
+        self.assertEquals(connection.settings_dict['NAME'], 'shop')
+        self.assertEquals(popen.call_count, 1)
+
+    def test_refuses_in_memory_sqlite(self):
+        def use_scratch():
+            with scratch_database('default'):
+                self.fail('the in-memory database would be discarded')
+
+        self.assertRaises(MigrationError, use_scratch)
+        self.assertTrue(
+            'nashvegas_migration' in connection.introspection.table_names()
+        )